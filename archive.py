@@ -0,0 +1,347 @@
+"""ZIP packaging for finished playlists.
+
+Audio is already compressed, so every entry is written with ZIP_STORED and
+costs no CPU beyond the CRC. zipfile switches to ZIP64 records on its own
+once an entry, the entry count or the archive outgrows the classic limits.
+"""
+import copy
+import functools
+import hashlib
+import os
+import shutil
+import struct
+import threading
+import zipfile
+from urllib.parse import quote
+
+CHUNK_SIZE = 256 * 1024
+
+
+class _StreamSink:
+    """Write-only file object that buffers zipfile output for a generator to drain.
+
+    It reports a position but cannot seek, which makes zipfile emit data
+    descriptors instead of rewriting local headers, so the archive can be
+    produced strictly front to back.
+    """
+
+    def __init__(self, offset=0):
+        self.buffer = bytearray()
+        self.offset = offset
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def iter_zip_stream(files, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP_STORED archive of (path, arcname) pairs in chunks as it is built"""
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path, arcname in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, "rb") as source, archive.open(info, "w") as entry:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+                    entry.write(data)
+                    if len(sink.buffer) >= chunk_size:
+                        yield sink.drain()
+    # Closing the archive appends the central directory
+    yield sink.drain()
+
+
+def _zip64_sizes(extra):
+    """(file size, compressed size) from a local header's ZIP64 extra field, or None"""
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, length = struct.unpack("<HH", extra[position:position + 4])
+        if header_id == 0x0001 and length >= 16:
+            return struct.unpack("<QQ", extra[position + 4:position + 20])
+        position += 4 + length
+    return None
+
+
+def _recover_entries(file):
+    """Entries of an archive whose writer died before writing the central directory.
+
+    Local headers are walked front to back and an entry is kept only if its
+    data is complete and matches its CRC, so a track that was half written
+    at the time of the crash is dropped. Returns the entries and the offset
+    just past the last good one.
+    """
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    entries = []
+    offset = 0
+    while offset + zipfile.sizeFileHeader <= size:
+        file.seek(offset)
+        (signature, extract_version, _, flag_bits, compress_type, dos_time, dos_date, crc,
+         compress_size, file_size, name_length, extra_length) = struct.unpack(
+            zipfile.structFileHeader, file.read(zipfile.sizeFileHeader)
+        )
+        # Data descriptors are never written to a seekable file
+        if signature != zipfile.stringFileHeader or flag_bits & 0x08:
+            break
+        name = file.read(name_length).decode("utf-8" if flag_bits & 0x800 else "cp437")
+        if compress_size == 0xFFFFFFFF:
+            # Tracks over 4 GiB keep their sizes in the ZIP64 extra field
+            sizes = _zip64_sizes(file.read(extra_length))
+            if sizes is None:
+                break
+            file_size, compress_size = sizes
+        data_start = offset + zipfile.sizeFileHeader + name_length + extra_length
+        data_end = data_start + compress_size
+        if data_end > size:
+            break
+
+        file.seek(data_start)
+        checksum = 0
+        remaining = compress_size
+        while remaining > 0:
+            data = file.read(min(CHUNK_SIZE, remaining))
+            checksum = zipfile.crc32(data, checksum)
+            remaining -= len(data)
+        following = file.read(4)
+        if checksum != crc or following not in (b"", zipfile.stringFileHeader, zipfile.stringCentralDir):
+            break
+
+        info = zipfile.ZipInfo(name, (
+            (dos_date >> 9) + 1980, (dos_date >> 5) & 0xF, dos_date & 0x1F,
+            dos_time >> 11, (dos_time >> 5) & 0x3F, (dos_time & 0x1F) * 2
+        ))
+        info.compress_type = compress_type
+        info.flag_bits = flag_bits
+        info.extract_version = extract_version
+        info.CRC = crc
+        info.compress_size = compress_size
+        info.file_size = file_size
+        info.header_offset = offset
+        info.external_attr = 0o100644 << 16
+        entries.append(info)
+        offset = data_end
+    return entries, offset
+
+
+class IncrementalArchive:
+    """On-disk ZIP_STORED archive that grows one track at a time.
+
+    Tracks are appended as soon as they finish, so closing the archive after
+    the last track only writes the central directory. While the archive is
+    still growing, iter_partial() serves a valid zip of everything appended
+    so far. With `resume`, an existing archive is reopened and appended to,
+    including one left without a central directory by a crash.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self.file = open(path, "r+b")
+            if not zipfile.is_zipfile(self.file):
+                entries, end = _recover_entries(self.file)
+                self.file.seek(end)
+                self.file.truncate()
+                directory = zipfile.ZipFile(self.file, "w", allowZip64=True)
+                directory.filelist = entries
+                directory.close()
+            self.file.seek(0)
+            self.zip = zipfile.ZipFile(self.file, "a", compression=zipfile.ZIP_STORED, allowZip64=True)
+            self.end = self.zip.start_dir
+        else:
+            self.file = open(path, "w+b")
+            self.zip = zipfile.ZipFile(self.file, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+            self.end = 0
+        self.closed = False
+
+    def add(self, source, arcname):
+        """Append one file without recompressing it; returns its size, or 0 if arcname is already archived"""
+        with self.lock:
+            if arcname in self.zip.NameToInfo:
+                return 0
+            self.zip.write(source, arcname=arcname)
+            self.file.flush()
+            self.end = self.file.tell()
+            return self.zip.filelist[-1].file_size
+
+    def copy_from(self, path):
+        """Append every entry of another zip that is not archived yet; returns how many were copied"""
+        copied = 0
+        with zipfile.ZipFile(path) as source:
+            for info in source.infolist():
+                with self.lock:
+                    if info.filename in self.zip.NameToInfo:
+                        continue
+                    entry = zipfile.ZipInfo(info.filename, info.date_time)
+                    entry.compress_type = zipfile.ZIP_STORED
+                    entry.external_attr = info.external_attr
+                    entry.file_size = info.file_size
+                    with source.open(info) as reader, self.zip.open(entry, "w") as writer:
+                        shutil.copyfileobj(reader, writer, CHUNK_SIZE)
+                    self.file.flush()
+                    self.end = self.file.tell()
+                copied += 1
+        return copied
+
+    def names(self):
+        with self.lock:
+            return [info.filename for info in self.zip.filelist]
+
+    def entries(self):
+        """Copies of the entries appended so far; their data is complete on disk"""
+        with self.lock:
+            return [copy.copy(info) for info in self.zip.filelist]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.zip.filelist)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.zip.close()
+            self.file.close()
+            self.closed = True
+
+    def iter_partial(self, chunk_size=CHUNK_SIZE):
+        """Yield a complete zip of the entries appended so far"""
+        with self.lock:
+            end = self.end
+            entries = [copy.copy(info) for info in self.zip.filelist]
+
+        with open(self.path, "rb") as source:
+            remaining = end
+            while remaining > 0:
+                data = source.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+        # A fresh ZipFile positioned after those entries writes just their central directory
+        sink = _StreamSink(end)
+        directory = zipfile.ZipFile(sink, "w", allowZip64=True)
+        directory.filelist = entries
+        directory.close()
+        yield sink.drain()
+
+
+@functools.lru_cache(maxsize=64)
+def _entries_at(path, size, mtime_ns):
+    with open(path, "rb") as file:
+        if zipfile.is_zipfile(file):
+            with zipfile.ZipFile(file) as archive:
+                return archive.infolist()
+        return _recover_entries(file)[0]
+
+
+def read_entries(path):
+    """Entries of an archive on disk, finished or still growing in another process.
+
+    Cached per size and mtime, so polling a manifest only re-reads the
+    archive after it changed.
+    """
+    stat = os.stat(path)
+    return list(_entries_at(path, stat.st_size, stat.st_mtime_ns))
+
+
+def data_offset(path, info):
+    """Where a stored entry's bytes start in the archive, read from its local header"""
+    return _data_start(path, info.header_offset)
+
+
+def _data_start(path, header_offset):
+    with open(path, "rb") as file:
+        file.seek(header_offset)
+        header = struct.unpack(zipfile.structFileHeader, file.read(zipfile.sizeFileHeader))
+    name_length, extra_length = header[10], header[11]
+    return header_offset + zipfile.sizeFileHeader + name_length + extra_length
+
+
+@functools.lru_cache(maxsize=4096)
+def _crc32_at(path, size, mtime_ns):
+    checksum = 0
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(CHUNK_SIZE)
+            if not data:
+                return checksum
+            checksum = zipfile.crc32(data, checksum)
+
+
+def file_crc32(path):
+    """CRC-32 of a file, the same checksum zip entries carry; cached per size and mtime"""
+    stat = os.stat(path)
+    return _crc32_at(path, stat.st_size, stat.st_mtime_ns)
+
+
+def _sha256_of(path, offset, length):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        file.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = file.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            digest.update(data)
+            remaining -= len(data)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=4096)
+def _file_sha256_at(path, size, mtime_ns):
+    return _sha256_of(path, 0, size)
+
+
+@functools.lru_cache(maxsize=4096)
+def _entry_sha256_at(path, inode, header_offset, size, crc):
+    return _sha256_of(path, _data_start(path, header_offset), size)
+
+
+def file_sha256(path):
+    """SHA-256 of a file, strong enough to recognise a track across jobs; cached per size and mtime"""
+    stat = os.stat(path)
+    return _file_sha256_at(path, stat.st_size, stat.st_mtime_ns)
+
+
+def entry_sha256(path, info):
+    """SHA-256 of a stored entry's bytes.
+
+    Appending to the archive changes its mtime but never the bytes of an
+    entry already in it, so the digest is cached per entry instead.
+    """
+    return _entry_sha256_at(path, os.stat(path).st_ino, info.header_offset, info.file_size, info.CRC)
+
+
+def list_audio_files(directory, extensions):
+    """(path, arcname) pairs for the audio files in a job folder, in name order"""
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(extensions):
+                files.append((os.path.join(root, name), name))
+    return sorted(files, key=lambda item: item[1])
+
+
+def content_disposition(filename):
+    """attachment header value, RFC 5987 encoded when the name is not plain ASCII"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
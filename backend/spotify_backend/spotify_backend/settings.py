@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+from urllib.parse import urlparse
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -36,6 +37,11 @@ CORS_ALLOWED_ORIGINS = [
     "https://reed-gilt.vercel.app",
 ]
 
+# The frontend the OAuth callback redirects to must be able to call back in with its cookie
+_frontend = urlparse(os.getenv("FRONTEND_URL", ""))
+if _frontend.scheme and _frontend.netloc and f"{_frontend.scheme}://{_frontend.netloc}" not in CORS_ALLOWED_ORIGINS:
+    CORS_ALLOWED_ORIGINS.append(f"{_frontend.scheme}://{_frontend.netloc}")
+
 CORS_ALLOW_CREDENTIALS = True
 
 CORS_ALLOW_METHODS = [
@@ -72,9 +78,11 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'spotify_signup.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'spotify_signup.middleware.SpotifyAuthMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -100,11 +108,21 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'spotify_backend.wsgi.application'
 
-# Cache settings
+# Cache settings. CACHE_BACKEND selects where cached playlists (and cache-backed
+# sessions) live: "locmem" is private to this process, "file" is shared by the
+# processes on one host through CACHE_PATH, "redis" by every instance through REDIS_URL
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "locmem").lower()
+CACHE_LOCATIONS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'unique-snowflake'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', os.getenv("CACHE_PATH", os.path.join(BASE_DIR, 'cache'))),
+    'redis': ('django.core.cache.backends.redis.RedisCache', os.getenv("REDIS_URL", "redis://localhost:6379/0")),
+}
+if CACHE_BACKEND not in CACHE_LOCATIONS:
+    raise ValueError(f"Unknown CACHE_BACKEND '{CACHE_BACKEND}'")
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': CACHE_LOCATIONS[CACHE_BACKEND][0],
+        'LOCATION': CACHE_LOCATIONS[CACHE_BACKEND][1],
     }
 }
 
@@ -112,13 +130,61 @@ CACHES = {
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, 'db.sqlite3')),
     }
 }
 
-# Session settings
-SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+# Download status storage: "memory" is per process, "sqlite" is shared by all workers
+DOWNLOAD_STORE = os.getenv("DOWNLOAD_STORE", "memory")
+DOWNLOAD_STORE_PATH = os.getenv("DOWNLOAD_STORE_PATH", os.path.join(BASE_DIR, 'downloads.sqlite3'))
+
+# Downloads run here: DOWNLOAD_WORKERS at once, up to DOWNLOAD_QUEUE_LIMIT more waiting,
+# each stopped after DOWNLOAD_TIMEOUT seconds; archives are kept under DOWNLOAD_ROOT
+DOWNLOAD_ROOT = os.getenv("DOWNLOAD_ROOT", os.path.join(BASE_DIR, 'downloads'))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "2"))
+DOWNLOAD_QUEUE_LIMIT = int(os.getenv("DOWNLOAD_QUEUE_LIMIT", "8"))
+DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", "1800"))
+DOWNLOAD_FORMAT = os.getenv("DOWNLOAD_FORMAT", "mp3")
+DOWNLOAD_BITRATE = os.getenv("DOWNLOAD_BITRATE", "192k")
+SPOTDL_BIN = os.getenv("SPOTDL_BIN", "spotdl")
+
+# Spotify Web API
+SPOTIFY_CLIENT_ID = os.getenv("CLIENT_ID")
+SPOTIFY_CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+SPOTIFY_ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com")
+SPOTIFY_PAGE_WORKERS = int(os.getenv("SPOTIFY_PAGE_WORKERS", "8"))
+# User tokens are refreshed this many seconds before they expire
+SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.getenv("SPOTIFY_TOKEN_REFRESH_MARGIN", "300"))
+# Rate-limited calls are retried this many times, unless Retry-After asks for a longer wait
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", "3"))
+SPOTIFY_MAX_RETRY_AFTER = float(os.getenv("SPOTIFY_MAX_RETRY_AFTER", "30"))
+# Playlists are served from the cache for PLAYLIST_CACHE_TTL seconds, then revalidated,
+# and fully reloaded after PLAYLIST_CACHE_MAX_AGE
+PLAYLIST_CACHE_TTL = int(os.getenv("PLAYLIST_CACHE_TTL", "30"))
+PLAYLIST_CACHE_MAX_AGE = int(os.getenv("PLAYLIST_CACHE_MAX_AGE", "600"))
+# Page size of /api/playlists when the client does not ask for one, and the largest it may ask for
+PLAYLIST_PAGE_SIZE = int(os.getenv("PLAYLIST_PAGE_SIZE", "50"))
+PLAYLIST_PAGE_MAX = int(os.getenv("PLAYLIST_PAGE_MAX", "200"))
+
+# Session settings. SESSION_BACKEND selects the store: "signed_cookies" (the
+# default) keeps the session in the cookie itself, so any instance can serve any
+# user without shared storage; "cache" keeps sessions in CACHES above, which only
+# survives across instances with CACHE_BACKEND=redis; "sqlite" in the database
+# (run migrate first) and "file" under SESSION_FILE_PATH. Signed cookies can be
+# read by the browser, including the Spotify tokens in them, but not modified.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "signed_cookies").lower()
+SESSION_ENGINES = {
+    'cache': 'django.contrib.sessions.backends.cache',
+    'sqlite': 'django.contrib.sessions.backends.db',
+    'file': 'django.contrib.sessions.backends.file',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+if SESSION_BACKEND not in SESSION_ENGINES:
+    raise ValueError(f"Unknown SESSION_BACKEND '{SESSION_BACKEND}'")
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
 SESSION_CACHE_ALIAS = 'default'
+SESSION_FILE_PATH = os.getenv("SESSION_FILE_PATH") or None
 SESSION_COOKIE_SAMESITE = 'None'
 SESSION_COOKIE_SECURE = True  # Only works over HTTPS
 SESSION_COOKIE_HTTPONLY = True
@@ -128,6 +194,31 @@ SESSION_COOKIE_HTTPONLY = True
 CSRF_COOKIE_SAMESITE = 'None'
 CSRF_COOKIE_SECURE = True
 
+# Logging: key=value messages, DEBUG shows per-request auth decisions
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            'format': 'time=%(asctime)s level=%(levelname)s logger=%(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+    },
+    'loggers': {
+        'spotify_signup': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
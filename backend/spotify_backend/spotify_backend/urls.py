@@ -27,6 +27,7 @@ urlpatterns = [
     path('logout', views.logout, name='logout'),
     # path('download/<str:playlist_id>/', views.download_playlist, name='download_playlist'),
     path('api/playlists', views.api_playlists, name='api_playlists'),
+    path('api/spotify-metrics', views.api_spotify_metrics, name='api_spotify_metrics'),
     path('download/<str:playlist_id>', csrf_exempt(views.download_playlist), name='download_playlist'),
 
     path('download/<str:playlist_id>', views.download_playlist, name='download_playlist'),
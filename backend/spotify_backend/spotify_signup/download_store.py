@@ -0,0 +1,170 @@
+"""Download status storage shared by every worker serving the app.
+
+DOWNLOAD_STORE selects the backend: "memory" keeps statuses in this process,
+"sqlite" keeps them in a WAL-mode SQLite file at DOWNLOAD_STORE_PATH so they
+survive restarts and are visible to every worker. Statuses are keyed by
+playlist id and can also be looked up by their download token.
+"""
+import json
+import sqlite3
+import threading
+
+from django.conf import settings
+
+
+def applies(status, only_if_pending, only_for_token):
+    """Whether an update with these conditions may change status"""
+    if status is None or (only_if_pending and status.get('completed')):
+        return False
+    return only_for_token is None or status.get('download_token') == only_for_token
+
+
+class MemoryDownloadStore:
+    def __init__(self):
+        self.statuses = {}
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    def put(self, playlist_id, status):
+        with self.lock:
+            self._put(playlist_id, status)
+
+    def _put(self, playlist_id, status):
+        previous = self.statuses.get(playlist_id)
+        if previous:
+            self.tokens.pop(previous.get('download_token'), None)
+        self.statuses[playlist_id] = dict(status)
+        if status.get('download_token'):
+            self.tokens[status['download_token']] = playlist_id
+
+    def add(self, playlist_id, status, active):
+        """Store status unless active(current status) holds; returns that active status, or None once stored"""
+        with self.lock:
+            current = self.statuses.get(playlist_id)
+            if current is not None and active(current):
+                return dict(current)
+            self._put(playlist_id, status)
+            return None
+
+    def get(self, playlist_id):
+        with self.lock:
+            status = self.statuses.get(playlist_id)
+            return dict(status) if status is not None else None
+
+    def get_by_token(self, token):
+        with self.lock:
+            status = self.statuses.get(self.tokens.get(token))
+            return dict(status) if status is not None else None
+
+    def update(self, playlist_id, only_if_pending=False, only_for_token=None, **fields):
+        """Merge fields into a status; with only_if_pending, skip completed downloads,
+        with only_for_token, skip a status that belongs to another download"""
+        with self.lock:
+            status = self.statuses.get(playlist_id)
+            if not applies(status, only_if_pending, only_for_token):
+                return False
+            status.update(fields)
+            return True
+
+
+class SQLiteDownloadStore:
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+        connection = self._connection()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS download_statuses (
+                playlist_id TEXT PRIMARY KEY,
+                download_token TEXT,
+                data TEXT NOT NULL
+            )
+        """)
+        connection.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS download_statuses_token ON download_statuses (download_token)"
+        )
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def put(self, playlist_id, status):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO download_statuses (playlist_id, download_token, data) VALUES (?, ?, ?)",
+            (playlist_id, status.get('download_token'), json.dumps(status))
+        )
+
+    def add(self, playlist_id, status, active):
+        """Store status unless active(current status) holds; returns that active status, or None once stored"""
+        connection = self._connection()
+        # The write lock is held from the check to the insert, so only one request can start a download
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT data FROM download_statuses WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()
+            current = json.loads(row[0]) if row else None
+            if current is not None and active(current):
+                connection.execute("ROLLBACK")
+                return current
+            connection.execute(
+                "INSERT OR REPLACE INTO download_statuses (playlist_id, download_token, data) VALUES (?, ?, ?)",
+                (playlist_id, status.get('download_token'), json.dumps(status))
+            )
+            connection.execute("COMMIT")
+            return None
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def get(self, playlist_id):
+        row = self._connection().execute(
+            "SELECT data FROM download_statuses WHERE playlist_id = ?", (playlist_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_by_token(self, token):
+        row = self._connection().execute(
+            "SELECT data FROM download_statuses WHERE download_token = ?", (token,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, playlist_id, only_if_pending=False, only_for_token=None, **fields):
+        """Merge fields into a status; with only_if_pending, skip completed downloads,
+        with only_for_token, skip a status that belongs to another download"""
+        connection = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent updates cannot interleave
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT data FROM download_statuses WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()
+            status = json.loads(row[0]) if row else None
+            if not applies(status, only_if_pending, only_for_token):
+                connection.execute("ROLLBACK")
+                return False
+            status.update(fields)
+            connection.execute(
+                "UPDATE download_statuses SET data = ? WHERE playlist_id = ?", (json.dumps(status), playlist_id)
+            )
+            connection.execute("COMMIT")
+            return True
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+
+def create_download_store():
+    backend = getattr(settings, 'DOWNLOAD_STORE', 'memory')
+    if backend == 'sqlite':
+        return SQLiteDownloadStore(settings.DOWNLOAD_STORE_PATH)
+    if backend == 'memory':
+        return MemoryDownloadStore()
+    raise ValueError(f"Unknown DOWNLOAD_STORE '{backend}'")
+
+
+download_store = create_download_store()
@@ -0,0 +1,155 @@
+"""Playlist downloads run by the Django app itself.
+
+Jobs go through a bounded thread pool: DOWNLOAD_WORKERS run spotdl at once
+and at most DOWNLOAD_QUEUE_LIMIT more wait for a slot; anything beyond that
+is turned away so a burst cannot pile up unbounded work. Progress is written
+to the shared download store, and the finished archive is kept under
+DOWNLOAD_ROOT where get_download_archive serves it as a file.
+"""
+import logging
+import re
+import shutil
+import signal
+import subprocess
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+
+from .download_store import download_store
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {".mp3", ".m4a", ".flac", ".opus", ".ogg", ".wav"}
+
+FOUND_PATTERN = re.compile(r'Found (\d+) songs in ')
+DOWNLOADED_PATTERN = re.compile(r'Downloaded "(.+)"|Skipping (.+?) \((?:file already exists|skip file found)\)')
+
+executor = ThreadPoolExecutor(max_workers=settings.DOWNLOAD_WORKERS, thread_name_prefix="downloads")
+slots = threading.BoundedSemaphore(settings.DOWNLOAD_WORKERS + settings.DOWNLOAD_QUEUE_LIMIT)
+
+
+def archive_path(playlist_id):
+    return Path(settings.DOWNLOAD_ROOT) / f"{playlist_id}.zip"
+
+
+def submit(playlist_id, playlist_url, download_token):
+    """Queue a download; False when the pool and its queue are full"""
+    if not slots.acquire(blocking=False):
+        return False
+    future = executor.submit(run, playlist_id, playlist_url, download_token)
+
+    def finished(future):
+        slots.release()
+        # run() records its own failures; this catches any it could not record
+        if future.exception() is not None:
+            logger.error("download.crashed playlist=%s", playlist_id, exc_info=future.exception())
+
+    future.add_done_callback(finished)
+    return True
+
+
+def run(playlist_id, playlist_url, download_token):
+    # Statuses are only touched while they still belong to this download, so a
+    # job the status check gave up on cannot overwrite the one that replaced it
+    update = partial(download_store.update, playlist_id, only_for_token=download_token)
+    # The status check gives up on jobs that waited too long; don't start those
+    if not update(only_if_pending=True, state='downloading', started_at=time.time()):
+        return
+    work_dir = Path(settings.DOWNLOAD_ROOT) / f"{playlist_id}-{download_token}"
+    try:
+        work_dir.mkdir(parents=True)
+        total = (download_store.get(playlist_id) or {}).get('total_tracks') or 0
+        if not download(update, playlist_url, work_dir, total):
+            return
+        update(state='packaging')
+        if not pack(work_dir, archive_path(playlist_id)):
+            update(completed=True, error='No tracks could be downloaded')
+            return
+        update(completed=True, state='completed', progress=100)
+        logger.info("download.completed playlist=%s", playlist_id)
+    except Exception as e:
+        logger.exception("download.failed playlist=%s", playlist_id)
+        update(completed=True, error=str(e))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def download(update, playlist_url, work_dir, total=0):
+    """Run spotdl into work_dir, reporting progress through update as it goes"""
+    command = [
+        settings.SPOTDL_BIN, 'download', playlist_url,
+        '--output', str(work_dir),
+        '--format', settings.DOWNLOAD_FORMAT,
+        '--bitrate', settings.DOWNLOAD_BITRATE
+    ]
+    try:
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace'
+        )
+    except FileNotFoundError:
+        update(completed=True, error='spotdl is not available on this server.')
+        return False
+
+    # The pipe is read on this thread, so a watchdog enforces the time limit
+    timed_out = threading.Event()
+
+    def stop():
+        timed_out.set()
+        process.kill()
+
+    timer = threading.Timer(settings.DOWNLOAD_TIMEOUT, stop)
+    timer.start()
+    done = 0
+    try:
+        for line in process.stdout:
+            found = FOUND_PATTERN.search(line)
+            if found:
+                total = int(found.group(1))
+                update(total_tracks=total)
+            elif DOWNLOADED_PATTERN.search(line):
+                done += 1
+                update(
+                    downloaded_tracks=done,
+                    progress=min(99, int(done * 100 / total)) if total else 0
+                )
+        process.wait()
+    finally:
+        timer.cancel()
+
+    if process.returncode != 0:
+        if timed_out.is_set():
+            error = 'Download timed out'
+        elif process.returncode < 0:
+            # Killed from outside, e.g. by the OOM killer or a deploy
+            error = f"spotdl was stopped by signal {signal_name(-process.returncode)}"
+        else:
+            error = f"spotdl exited with code {process.returncode}"
+        update(completed=True, error=error)
+        return False
+    return True
+
+
+def signal_name(number):
+    try:
+        return signal.Signals(number).name
+    except ValueError:
+        return str(number)
+
+
+def pack(work_dir, destination):
+    """Zip the audio files in work_dir; audio is already compressed, so they are stored as is"""
+    files = sorted(path for path in work_dir.rglob('*') if path.suffix.lower() in AUDIO_EXTENSIONS)
+    if not files:
+        return False
+    # Named after the work dir, so an abandoned run still packing cannot collide with its replacement
+    unfinished = destination.with_name(f"{work_dir.name}.zip.part")
+    with zipfile.ZipFile(unfinished, 'w', zipfile.ZIP_STORED) as archive:
+        for path in files:
+            archive.write(path, path.relative_to(work_dir))
+    unfinished.replace(destination)
+    return True
@@ -0,0 +1,185 @@
+"""Load test of the auth, playlist and download status views against MockSpotify.
+
+    python manage.py spotify_loadtest --workers 1,4,16 --requests 2000 --latency 0.02 --throttle-rate 0.05
+
+Each scenario runs at every worker count: that many threads share the
+requests, each with its own test client, so the middleware, session backend
+and cache configured in settings are all exercised in process, much as
+under gunicorn's threaded workers. Every run starts with an empty playlist
+cache. A further single-threaded pass under tracemalloc measures the memory
+a request allocates; when a request reaches the mock server, which runs in
+this process, its share is included.
+
+Sessions are created in the configured session store and deleted again.
+Download statuses are written under loadtest-* ids.
+"""
+import json
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from spotify_signup.download_store import download_store
+from spotify_signup.mock_spotify import MockSpotify
+from spotify_signup.playlists import cache_key, spotify
+
+SCENARIOS = {
+    "check_auth": lambda user: "/check_auth",
+    "api_playlists": lambda user: "/api/playlists?limit=50",
+    "download_status": lambda user: f"/download-status/loadtest-{user}",
+    "download_result": lambda user: f"/download-result/loadtest-token-{user}"
+}
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "Measure throughput, latency and allocations of the auth, playlist and download status views"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", default="1,4,16", help="comma separated worker thread counts")
+        parser.add_argument("--requests", type=int, default=1000, help="requests per scenario and worker count")
+        parser.add_argument("--users", type=int, default=50, help="distinct sessions the requests rotate through")
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated scenarios to run")
+        parser.add_argument("--playlists", type=int, default=200, help="playlists every mock user has")
+        parser.add_argument("--latency", type=float, default=0.0, help="seconds the mock adds to every call")
+        parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of API calls the mock answers with 429")
+        parser.add_argument("--retry-after", type=int, default=0, help="Retry-After of throttled calls")
+        parser.add_argument("--alloc-requests", type=int, default=100, help="requests in the allocation pass, 0 to skip it")
+        parser.add_argument("--json", help="also write the results to this file")
+
+    def handle(self, *args, **options):
+        try:
+            worker_counts = [int(count) for count in options["workers"].split(",")]
+        except ValueError:
+            raise CommandError("--workers must be a comma separated list of numbers")
+        scenarios = options["scenarios"].split(",")
+        unknown = [scenario for scenario in scenarios if scenario not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+        mock = MockSpotify(
+            playlists=options["playlists"],
+            latency=options["latency"],
+            throttle_rate=options["throttle_rate"],
+            retry_after=options["retry_after"]
+        )
+        original_client = (spotify.api_url, spotify.accounts_url, spotify.client_id, spotify.client_secret)
+        with mock:
+            spotify.api_url, spotify.accounts_url = mock.api_url, mock.accounts_url
+            spotify.client_id, spotify.client_secret = "mock-client", "mock-secret"
+            sessions = [self.create_session(user) for user in range(options["users"])]
+            try:
+                results = []
+                for scenario in scenarios:
+                    allocated = self.measure_allocations(scenario, sessions, options["alloc_requests"])
+                    for workers in worker_counts:
+                        result = self.run_scenario(scenario, sessions, workers, options["requests"], mock)
+                        result["alloc_kib_per_request"] = allocated
+                        results.append(result)
+                        self.report(result)
+            finally:
+                for session in sessions:
+                    session.delete()
+                spotify.api_url, spotify.accounts_url, spotify.client_id, spotify.client_secret = original_client
+
+        if options["json"]:
+            with open(options["json"], "w") as file:
+                json.dump({"options": {key: options[key] for key in (
+                    "workers", "requests", "users", "playlists", "latency", "throttle_rate", "retry_after"
+                )}, "results": results}, file, indent=2)
+
+    def create_session(self, user):
+        """A logged in session for a mock user, plus a running download to ask about"""
+        token = f"mock-user-{user}"
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session["spotify_token"] = token
+        session["token_info"] = {"access_token": token, "refresh_token": f"mock-refresh-{user}", "expires_at": int(time.time()) + 3600}
+        session.save()
+        download_store.put(f"loadtest-{user}", {
+            "completed": False,
+            "error": None,
+            "state": "downloading",
+            "start_time": time.time(),
+            "progress": 50,
+            "total_tracks": 40,
+            "downloaded_tracks": 20,
+            "playlist_name": f"Load test {user}",
+            "playlist_url": f"https://open.spotify.com/playlist/mock{user:05d}",
+            "download_token": f"loadtest-token-{user}"
+        })
+        return session
+
+    def request(self, client, scenario, sessions, index):
+        user = index % len(sessions)
+        client.cookies[settings.SESSION_COOKIE_NAME] = sessions[user].session_key
+        return client.get(SCENARIOS[scenario](user))
+
+    def run_scenario(self, scenario, sessions, workers, total, mock):
+        cache.delete_many([cache_key(session["spotify_token"]) for session in sessions])
+        mock.reset_counts()
+
+        def work(worker):
+            client = Client(HTTP_HOST="localhost", raise_request_exception=False)
+            latencies, errors = [], 0
+            for index in range(worker, total, workers):
+                started = time.perf_counter()
+                response = self.request(client, scenario, sessions, index)
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code >= 400
+            return latencies, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(work, range(workers)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for worker_latencies, _ in outcomes for latency in worker_latencies)
+        return {
+            "scenario": scenario,
+            "workers": workers,
+            "requests": len(latencies),
+            "errors": sum(errors for _, errors in outcomes),
+            "requests_per_second": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "spotify_calls": sum(mock.requests.values()),
+            "spotify_throttled": mock.throttled
+        }
+
+    def measure_allocations(self, scenario, sessions, count):
+        """Mean KiB allocated at the peak of a request, one request at a time"""
+        if count <= 0:
+            return None
+        client = Client(HTTP_HOST="localhost", raise_request_exception=False)
+        # Warm up imports, connections and the playlist cache before measuring
+        for index in range(len(sessions)):
+            self.request(client, scenario, sessions, index)
+        allocated = []
+        tracemalloc.start()
+        try:
+            for index in range(count):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                self.request(client, scenario, sessions, index)
+                allocated.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+        return statistics.mean(allocated) / 1024
+
+    def report(self, result):
+        allocated = result["alloc_kib_per_request"]
+        self.stdout.write(
+            f"{result['scenario']:<16} workers={result['workers']:<3} "
+            f"{result['requests_per_second']:8.1f} req/s  p50 {result['p50_ms']:7.2f}ms  p99 {result['p99_ms']:7.2f}ms  "
+            f"errors={result['errors']}  spotify_calls={result['spotify_calls']} (throttled {result['spotify_throttled']})"
+            + (f"  alloc {allocated:.1f} KiB/req" if allocated is not None else "")
+        )
@@ -0,0 +1,98 @@
+"""Request and response middleware for the app."""
+import logging
+import re
+import time
+
+import requests
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+from .playlists import spotify
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = re.compile(r"\bbr\b")
+
+# Archives and images are already compressed
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Brotli for clients that accept it (when the brotli package is installed), gzip otherwise"""
+
+    def process_response(self, request, response):
+        if not response.get("Content-Type", "").startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if (
+            brotli is None
+            or response.streaming
+            or len(response.content) < 200
+            or response.has_header("Content-Encoding")
+            or not re_accepts_brotli.search(accept_encoding)
+        ):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed_content = brotli.compress(response.content, quality=5)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers["Content-Length"] = str(len(response.content))
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
+
+
+class SpotifyAuthMiddleware:
+    """Resolve the session's Spotify token once per request as request.spotify_token.
+
+    Tokens about to expire are refreshed with the stored refresh token, and a
+    session whose token can no longer be used is flushed. Requests without a
+    session cookie never touch the session store.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.spotify_token = None
+        if request.method != "OPTIONS" and settings.SESSION_COOKIE_NAME in request.COOKIES:
+            request.spotify_token = self.session_token(request)
+        return self.get_response(request)
+
+    def session_token(self, request):
+        token = request.session.get("spotify_token")
+        if token is None:
+            return None
+
+        token_info = request.session.get("token_info") or {}
+        expires_at = token_info.get("expires_at", 0)
+        if time.time() < expires_at - settings.SPOTIFY_TOKEN_REFRESH_MARGIN:
+            return token
+
+        if token_info.get("refresh_token"):
+            try:
+                token_info = spotify.refresh_user_token(token_info["refresh_token"])
+            except requests.RequestException as e:
+                logger.warning("auth.refresh_failed error=%s", e)
+            else:
+                request.session["spotify_token"] = token_info["access_token"]
+                request.session["token_info"] = token_info
+                logger.debug("auth.refreshed expires_at=%s", token_info["expires_at"])
+                return token_info["access_token"]
+
+        if time.time() < expires_at:
+            return token
+        logger.info("auth.expired")
+        request.session.flush()
+        return None
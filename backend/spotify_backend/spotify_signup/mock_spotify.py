@@ -0,0 +1,187 @@
+"""Local stand-in for the Spotify Web API and accounts service.
+
+Used by the tests and the spotify_loadtest command to exercise pagination,
+caching and token handling without network access or real rate limits.
+It serves /api/token and /v1/me/playlists, plus /v1/playlists/{id}. The
+playlist count, added latency and share of API calls answered with 429 are
+all configurable. Pages carry ETags and answer If-None-Match with 304 until
+edit() changes the playlists.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PLAYLIST_PATH = re.compile(r'^/v1/playlists/([\w-]+)$')
+
+
+class MockSpotify:
+    """Run with `with MockSpotify(...) as mock:` and point a SpotifyClient at mock.api_url and mock.accounts_url"""
+
+    def __init__(self, playlists=120, latency=0.0, throttle_rate=0.0, retry_after=0, token_lifetime=3600, seed=0):
+        self.playlists = playlists
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.version = 1
+        # The next this many API calls are throttled, for deterministic tests
+        self.throttle_next = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.throttled = 0
+        self.tokens_issued = 0
+        self.server = None
+        self.thread = None
+
+    @property
+    def accounts_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def api_url(self):
+        return self.accounts_url + "/v1"
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-spotify", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stop()
+
+    def edit(self, playlists=None):
+        """Change every playlist's snapshot (and optionally their number), as an edit on Spotify would"""
+        with self.lock:
+            self.version += 1
+            if playlists is not None:
+                self.playlists = playlists
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests.clear()
+            self.throttled = 0
+            self.tokens_issued = 0
+
+    def playlist(self, index):
+        playlist_id = f"mock{index:05d}"
+        return {
+            "id": playlist_id,
+            "name": f"Mock playlist {index}",
+            "snapshot_id": f"snapshot-{self.version}-{index}",
+            "images": [
+                {"url": f"https://i.scdn.co/image/{playlist_id}-640", "width": 640, "height": 640},
+                {"url": f"https://i.scdn.co/image/{playlist_id}-300", "width": 300, "height": 300},
+                {"url": f"https://i.scdn.co/image/{playlist_id}-60", "width": 60, "height": 60}
+            ],
+            "owner": {"display_name": "Mock user", "id": "mock-user"},
+            "tracks": {"total": 10 + index % 40, "href": f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"},
+            "external_urls": {"spotify": f"https://open.spotify.com/playlist/{playlist_id}"},
+            "public": index % 3 != 0,
+            "collaborative": False
+        }
+
+    def respond(self, method, path, query, headers, form):
+        """(status, headers, JSON body or None) for one request"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.requests[f"{method} {re.sub(r'/playlists/[^/]+$', '/playlists/{id}', path)}"] += 1
+            throttle = path.startswith("/v1/") and (self.throttle_next > 0 or self.random.random() < self.throttle_rate)
+            if throttle:
+                self.throttle_next = max(0, self.throttle_next - 1)
+                self.throttled += 1
+        if throttle:
+            return 429, {"Retry-After": str(self.retry_after)}, {"error": {"status": 429, "message": "API rate limit exceeded"}}
+
+        if method == "POST" and path == "/api/token":
+            return self.token(headers, form)
+        if not headers.get("Authorization", "").startswith("Bearer "):
+            return 401, {}, {"error": {"status": 401, "message": "No token provided"}}
+        if method == "GET" and path == "/v1/me/playlists":
+            return self.playlist_page(query, headers)
+        match = PLAYLIST_PATH.match(path)
+        if method == "GET" and match and match.group(1).startswith("mock"):
+            index = int(match.group(1)[4:] or 0)
+            if index < self.playlists:
+                return 200, {}, self.playlist(index)
+        return 404, {}, {"error": {"status": 404, "message": "Not found."}}
+
+    def token(self, headers, form):
+        if not headers.get("Authorization", "").startswith("Basic "):
+            return 400, {}, {"error": "invalid_client"}
+        grant_type = form.get("grant_type")
+        if grant_type not in ("client_credentials", "authorization_code", "refresh_token"):
+            return 400, {}, {"error": "unsupported_grant_type"}
+        with self.lock:
+            self.tokens_issued += 1
+            serial = self.tokens_issued
+        token = {"access_token": f"mock-{grant_type}-{serial}", "token_type": "Bearer", "expires_in": self.token_lifetime}
+        if grant_type == "authorization_code":
+            token["refresh_token"] = f"mock-refresh-{serial}"
+        return 200, {}, token
+
+    def playlist_page(self, query, headers):
+        limit = min(50, int(query.get("limit", 20)))
+        offset = int(query.get("offset", 0))
+        with self.lock:
+            version, total = self.version, self.playlists
+        etag = f'"{version}-{offset}-{limit}"'
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, None
+        items = [self.playlist(index) for index in range(offset, min(offset + limit, total))]
+        return 200, {"ETag": etag}, {
+            "href": f"https://api.spotify.com/v1/me/playlists?offset={offset}&limit={limit}",
+            "items": items,
+            "limit": limit,
+            "offset": offset,
+            "total": total,
+            "next": f"https://api.spotify.com/v1/me/playlists?offset={offset + limit}&limit={limit}" if offset + limit < total else None,
+            "previous": None
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real API, so the client's connection pool is exercised
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()} if length else {}
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        status, headers, payload = self.server.mock.respond(method, url.path, query, self.headers, form)
+
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
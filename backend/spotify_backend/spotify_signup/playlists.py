@@ -0,0 +1,159 @@
+"""Load a user's Spotify playlists quickly and remember them for a little while.
+
+The first page tells us how many playlists there are, so the remaining
+pages are requested in parallel by offset instead of following `next`
+links one by one. Results are cached per access token. A fresh entry is
+served straight from the cache; a stale one is revalidated with the first
+page (ETag, or the playlist count and snapshot ids) before paying for a
+full reload. Requests for one token that miss at the same time in a process
+share a single load.
+"""
+import base64
+import binascii
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .spotify_api import SpotifyClient
+
+PAGE_SIZE = 50
+THUMBNAIL_WIDTH = 300
+
+# One client for every Spotify call the app makes, so connections and the app token are reused
+spotify = SpotifyClient(
+    settings.SPOTIFY_CLIENT_ID,
+    settings.SPOTIFY_CLIENT_SECRET,
+    api_url=settings.SPOTIFY_API_URL,
+    accounts_url=settings.SPOTIFY_ACCOUNTS_URL,
+    pool_size=settings.SPOTIFY_PAGE_WORKERS,
+    max_retries=settings.SPOTIFY_MAX_RETRIES,
+    max_retry_after=settings.SPOTIFY_MAX_RETRY_AFTER
+)
+page_pool = ThreadPoolExecutor(max_workers=settings.SPOTIFY_PAGE_WORKERS, thread_name_prefix="spotify-pages")
+# Striped by cache key, so concurrent loads of one token are serialized without a lock per token
+load_locks = [threading.Lock() for _ in range(64)]
+
+
+def fetch_page(token, offset, etag=None):
+    """One page of /me/playlists and its ETag; the page is None when the ETag still matches"""
+    response = spotify.request(
+        "GET", "/me/playlists",
+        token=token,
+        params={"limit": PAGE_SIZE, "offset": offset},
+        headers={"If-None-Match": etag} if etag else None
+    )
+    if response.status_code == 304:
+        return None, etag
+    response.raise_for_status()
+    return response.json(), response.headers.get("ETag")
+
+
+def fingerprint(page):
+    """Changes whenever a playlist is added, removed, reordered or edited on this page"""
+    return [page.get("total")] + [
+        (item.get("id"), item.get("snapshot_id")) for item in page.get("items", []) if item
+    ]
+
+
+def slim(playlist):
+    """The parts of a Spotify playlist object the app uses; the rest is dropped before caching"""
+    # Spotify lists images largest first; keep the smallest one that still fills a dashboard card
+    images = playlist.get("images") or []
+    thumbnail = next((image for image in reversed(images) if (image.get("width") or THUMBNAIL_WIDTH) >= THUMBNAIL_WIDTH), None)
+    return {
+        "id": playlist.get("id"),
+        "name": playlist.get("name"),
+        "tracks": (playlist.get("tracks") or {}).get("total", 0),
+        "snapshot_id": playlist.get("snapshot_id"),
+        "image": (thumbnail or images[0]).get("url") if images else None,
+        "owner": (playlist.get("owner") or {}).get("display_name"),
+        "url": (playlist.get("external_urls") or {}).get("spotify")
+    }
+
+
+FIELDS = ("id", "name", "tracks", "snapshot_id", "image", "owner", "url")
+DEFAULT_FIELDS = ("id", "name", "tracks", "snapshot_id", "image")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(offset, playlist_id):
+    return base64.urlsafe_b64encode(f"{offset}:{playlist_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, playlists):
+    """Index to continue from; follows the last playlist seen if the list shifted since"""
+    try:
+        offset, playlist_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":", 1)
+        offset = int(offset)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+    if 0 < offset <= len(playlists) and playlists[offset - 1]["id"] == playlist_id:
+        return offset
+    for index, playlist in enumerate(playlists):
+        if playlist["id"] == playlist_id:
+            return index + 1
+    return min(max(offset, 0), len(playlists))
+
+
+def paginate(playlists, cursor=None, limit=50, fields=DEFAULT_FIELDS):
+    """One page of playlists with only the requested fields, and the cursor of the next page"""
+    start = decode_cursor(cursor, playlists) if cursor else 0
+    page = playlists[start:start + limit]
+    end = start + len(page)
+    next_cursor = encode_cursor(end, page[-1]["id"]) if page and end < len(playlists) else None
+    return [{field: playlist[field] for field in fields} for playlist in page], next_cursor
+
+
+def cache_key(token):
+    return "playlists:" + hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_user_playlists(token):
+    """Every playlist of the user the token belongs to, as slim() records"""
+    key = cache_key(token)
+    entry = cache.get(key)
+    if entry and time.time() < entry["fresh_until"]:
+        return entry["playlists"]
+
+    # Requests that miss together wait for the first one to refill the cache instead of all refetching
+    with load_locks[int(key[-8:], 16) % len(load_locks)]:
+        entry = cache.get(key)
+        now = time.time()
+        if entry and now < entry["fresh_until"]:
+            return entry["playlists"]
+        return load_playlists(token, key, entry, now)
+
+
+def load_playlists(token, key, entry, now):
+    """Revalidate or reload the cached playlists of a token and store them again"""
+    if entry:
+        first, etag = fetch_page(token, 0, entry["etag"])
+        if first is None or fingerprint(first) == entry["fingerprint"]:
+            entry.update(fresh_until=now + settings.PLAYLIST_CACHE_TTL, etag=etag)
+            cache.set(key, entry, max(1, int(entry["expires_at"] - now)))
+            return entry["playlists"]
+    else:
+        first, etag = fetch_page(token, 0)
+
+    offsets = range(PAGE_SIZE, first.get("total", 0), PAGE_SIZE)
+    pages = page_pool.map(lambda offset: fetch_page(token, offset)[0], offsets)
+    playlists = [slim(item) for item in first.get("items", []) if item]
+    for page in pages:
+        playlists.extend(slim(item) for item in page.get("items", []) if item)
+
+    # Revalidation only looks at the first page, so reload everything after PLAYLIST_CACHE_MAX_AGE
+    cache.set(key, {
+        "playlists": playlists,
+        "etag": etag,
+        "fingerprint": fingerprint(first),
+        "fresh_until": now + settings.PLAYLIST_CACHE_TTL,
+        "expires_at": now + settings.PLAYLIST_CACHE_MAX_AGE
+    }, settings.PLAYLIST_CACHE_MAX_AGE)
+    return playlists
@@ -0,0 +1,20 @@
+"""JSON responses serialized with orjson when it is installed."""
+import json
+
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def json_response(data, status=200):
+    """Compact drop-in for JsonResponse on hot endpoints"""
+    return HttpResponse(dumps(data), content_type="application/json", status=status)
@@ -0,0 +1,192 @@
+"""Spotify Web API client shared by the Django app and the downloader.
+
+Both services used to build spotipy clients per request. A SpotifyClient
+keeps one pooled keep-alive session, caches the app's client-credentials
+token until shortly before it expires, retries rate-limited calls after
+their Retry-After delay (a bounded number of times), and records latency
+per endpoint. It does not depend on Django, so the downloader can import it
+from the repository root.
+"""
+import base64
+import threading
+import time
+from collections import deque
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_URL = "https://api.spotify.com/v1"
+ACCOUNTS_URL = "https://accounts.spotify.com"
+
+
+class EndpointStats:
+    def __init__(self, samples=200):
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.recent = deque(maxlen=samples)
+
+    def record(self, elapsed, status):
+        self.requests += 1
+        self.total += elapsed
+        self.slowest = max(self.slowest, elapsed)
+        self.recent.append(elapsed)
+        if status == 429:
+            self.throttled += 1
+        elif status is None or status >= 400:
+            self.errors += 1
+
+    def snapshot(self):
+        recent = sorted(self.recent)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "avg_ms": round(self.total / self.requests * 1000, 1) if self.requests else 0,
+            "p95_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000, 1) if recent else 0,
+            "max_ms": round(self.slowest * 1000, 1)
+        }
+
+
+class SpotifyClient:
+    """Pooled, rate-limit aware access to the Web API and the accounts service"""
+
+    def __init__(self, client_id=None, client_secret=None, api_url=API_URL, accounts_url=ACCOUNTS_URL,
+                 pool_size=8, max_retries=3, max_retry_after=30, timeout=10, refresh_margin=60):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.api_url = api_url.rstrip("/")
+        self.accounts_url = accounts_url.rstrip("/")
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.token = None
+        self.token_expires_at = 0
+        self.token_refreshes = 0
+        self.token_lock = threading.Lock()
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def app_token(self):
+        """Client-credentials access token, fetched again shortly before it expires"""
+        with self.token_lock:
+            if self.token is None or time.time() >= self.token_expires_at - self.refresh_margin:
+                response = self._send(
+                    "POST /api/token", "POST", f"{self.accounts_url}/api/token",
+                    data={"grant_type": "client_credentials"},
+                    headers={"Authorization": self._basic_auth()}
+                )
+                response.raise_for_status()
+                payload = response.json()
+                self.token = payload["access_token"]
+                self.token_expires_at = time.time() + payload.get("expires_in", 3600)
+                self.token_refreshes += 1
+            return self.token
+
+    def request(self, method, path, token=None, params=None, headers=None, retries=None, timeout=None, **path_args):
+        """Call the Web API; path is a template like "/playlists/{playlist_id}" filled from path_args.
+
+        Without a user token the app token is used. Rate-limited calls are retried
+        after Retry-After; the last response is returned either way, so callers
+        decide what to do with errors (and 304s).
+        """
+        endpoint = f"{method} {path}"
+        url = self.api_url + path.format(**path_args)
+        retries = self.max_retries if retries is None else retries
+        refreshed = False
+        attempt = 0
+        while True:
+            request_headers = dict(headers or {})
+            request_headers["Authorization"] = f"Bearer {token or self.app_token()}"
+            response = self._send(endpoint, method, url, params=params, headers=request_headers, timeout=timeout)
+
+            if response.status_code == 401 and token is None and not refreshed:
+                # The app token was revoked or expired early
+                with self.token_lock:
+                    self.token = None
+                refreshed = True
+                continue
+
+            if response.status_code != 429 or attempt >= retries:
+                return response
+            delay = self._retry_after(response, attempt)
+            if delay > self.max_retry_after:
+                return response
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, path, token=None, **kwargs):
+        """JSON body of a successful GET"""
+        response = self.request("GET", path, token=token, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def authorize_url(self, redirect_uri, scope, show_dialog=False):
+        query = {
+            "client_id": self.client_id,
+            "response_type": "code",
+            "redirect_uri": redirect_uri,
+            "scope": scope
+        }
+        if show_dialog:
+            query["show_dialog"] = "true"
+        return f"{self.accounts_url}/authorize?{urlencode(query)}"
+
+    def exchange_code(self, code, redirect_uri):
+        """Token info for an authorization code, with expires_at like spotipy's"""
+        return self._user_token({"grant_type": "authorization_code", "code": code, "redirect_uri": redirect_uri})
+
+    def refresh_user_token(self, refresh_token):
+        """New token info for a user; Spotify may or may not rotate the refresh token"""
+        token_info = self._user_token({"grant_type": "refresh_token", "refresh_token": refresh_token})
+        token_info.setdefault("refresh_token", refresh_token)
+        return token_info
+
+    def metrics(self):
+        with self.stats_lock:
+            endpoints = {endpoint: stats.snapshot() for endpoint, stats in self.stats.items()}
+        return {"endpoints": endpoints, "token_refreshes": self.token_refreshes}
+
+    def _user_token(self, data):
+        response = self._send(
+            "POST /api/token", "POST", f"{self.accounts_url}/api/token",
+            data=data,
+            headers={"Authorization": self._basic_auth()}
+        )
+        response.raise_for_status()
+        token_info = response.json()
+        token_info["expires_at"] = int(time.time()) + token_info.get("expires_in", 3600)
+        return token_info
+
+    def _send(self, endpoint, method, url, timeout=None, **kwargs):
+        started = time.perf_counter()
+        status = None
+        try:
+            response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.stats_lock:
+                self.stats.setdefault(endpoint, EndpointStats()).record(elapsed, status)
+
+    def _basic_auth(self):
+        credentials = f"{self.client_id}:{self.client_secret}".encode()
+        return "Basic " + base64.b64encode(credentials).decode()
+
+    @staticmethod
+    def _retry_after(response, attempt):
+        try:
+            return max(0.0, float(response.headers["Retry-After"]))
+        except (KeyError, ValueError):
+            return 2 ** attempt
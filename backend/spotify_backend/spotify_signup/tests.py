@@ -1,3 +1,378 @@
-from django.test import TestCase
+"""Tests for playlist pagination and caching, session auth and download statuses.
 
-# Create your tests here.
+Spotify is replaced by a local MockSpotify server; the shared client is
+pointed at it for the duration of each test class.
+"""
+import os
+import runpy
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from unittest import mock
+
+import requests
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCacheClient
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+
+from . import downloads
+from .download_store import download_store
+from .mock_spotify import MockSpotify
+from .playlists import FIELDS, InvalidCursor, encode_cursor, get_user_playlists, paginate, spotify
+
+
+def make_playlists(count):
+    return [{field: f"{field}-{index}" for field in FIELDS} | {"id": f"p{index}"} for index in range(count)]
+
+
+def login(client, token="mock-user-token", expires_in=3600, refresh_token="mock-refresh"):
+    """Give the test client a session holding a Spotify token, as callback() would"""
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session["spotify_token"] = token
+    session["token_info"] = {
+        "access_token": token,
+        "refresh_token": refresh_token,
+        "expires_at": int(time.time()) + expires_in
+    }
+    session.save()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+    return session
+
+
+class MockSpotifyTestCase(TestCase):
+    playlists = 120
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.mock = MockSpotify(playlists=cls.playlists).start()
+        cls.original_client = (spotify.api_url, spotify.accounts_url, spotify.client_id, spotify.client_secret)
+        spotify.api_url, spotify.accounts_url = cls.mock.api_url, cls.mock.accounts_url
+        spotify.client_id, spotify.client_secret = "mock-client", "mock-secret"
+
+    @classmethod
+    def tearDownClass(cls):
+        spotify.api_url, spotify.accounts_url, spotify.client_id, spotify.client_secret = cls.original_client
+        cls.mock.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        spotify.token = None
+        self.mock.playlists = self.playlists
+        self.mock.throttle_next = 0
+        self.mock.reset_counts()
+
+
+class PaginationTests(SimpleTestCase):
+    def test_cursor_walks_every_playlist_once(self):
+        playlists = make_playlists(23)
+        seen, cursor = [], None
+        while True:
+            page, cursor = paginate(playlists, cursor, limit=5, fields=("id",))
+            seen.extend(playlist["id"] for playlist in page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, [playlist["id"] for playlist in playlists])
+
+    def test_cursor_follows_last_playlist_after_removal(self):
+        playlists = make_playlists(10)
+        page, cursor = paginate(playlists, limit=4, fields=("id",))
+        del playlists[1]
+        page, _ = paginate(playlists, cursor, limit=2, fields=("id",))
+        self.assertEqual([playlist["id"] for playlist in page], ["p4", "p5"])
+
+    def test_only_requested_fields_are_returned(self):
+        page, _ = paginate(make_playlists(3), limit=2, fields=("id", "name"))
+        self.assertEqual(page, [{"id": "p0", "name": "name-0"}, {"id": "p1", "name": "name-1"}])
+
+    def test_malformed_cursor_is_rejected(self):
+        with self.assertRaises(InvalidCursor):
+            paginate(make_playlists(3), "not a cursor!")
+
+    def test_stale_cursor_is_clamped(self):
+        page, cursor = paginate(make_playlists(3), encode_cursor(50, "gone"), limit=2)
+        self.assertEqual((page, cursor), ([], None))
+
+
+class PlaylistApiTests(MockSpotifyTestCase):
+    def fetch_all(self, limit=50):
+        ids, cursor = [], None
+        while True:
+            response = self.client.get("/api/playlists", {"limit": limit, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            ids.extend(playlist["id"] for playlist in body["playlists"])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                return ids, body["total"]
+
+    def test_requires_a_session(self):
+        self.assertEqual(self.client.get("/api/playlists").status_code, 401)
+
+    def test_loads_every_spotify_page(self):
+        login(self.client)
+        ids, total = self.fetch_all()
+        self.assertEqual(total, 120)
+        self.assertEqual(ids, [f"mock{index:05d}" for index in range(120)])
+        self.assertEqual(self.mock.requests["GET /v1/me/playlists"], 3)
+
+    def test_slim_records_and_fields(self):
+        login(self.client)
+        body = self.client.get("/api/playlists", {"limit": 1, "fields": "id,image,owner,tracks"}).json()
+        self.assertEqual(body["playlists"], [{
+            "id": "mock00000",
+            "image": "https://i.scdn.co/image/mock00000-300",
+            "owner": "Mock user",
+            "tracks": 10
+        }])
+
+    def test_fresh_cache_does_not_call_spotify(self):
+        login(self.client)
+        self.fetch_all()
+        self.mock.reset_counts()
+        self.fetch_all()
+        self.assertEqual(sum(self.mock.requests.values()), 0)
+
+    @override_settings(PLAYLIST_CACHE_TTL=0)
+    def test_stale_cache_is_revalidated_with_etag(self):
+        login(self.client)
+        first, _ = self.fetch_all(limit=200)
+        self.mock.reset_counts()
+        second, _ = self.fetch_all(limit=200)
+        self.assertEqual(first, second)
+        # Only the first page is asked for again, and it comes back 304
+        self.assertEqual(self.mock.requests["GET /v1/me/playlists"], 1)
+
+    @override_settings(PLAYLIST_CACHE_TTL=0)
+    def test_edited_playlists_are_reloaded(self):
+        login(self.client)
+        self.fetch_all(limit=200)
+        self.mock.edit(playlists=130)
+        ids, total = self.fetch_all(limit=200)
+        self.assertEqual((len(ids), total), (130, 130))
+
+    def test_concurrent_misses_share_one_load(self):
+        self.mock.latency = 0.02
+        self.addCleanup(setattr, self.mock, "latency", 0.0)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda _: get_user_playlists("mock-user-token"), range(8)))
+        self.assertTrue(all(len(playlists) == 120 for playlists in results))
+        self.assertEqual(self.mock.requests["GET /v1/me/playlists"], 3)
+
+    def test_throttled_pages_are_retried(self):
+        login(self.client)
+        self.mock.throttle_next = 2
+        ids, _ = self.fetch_all(limit=200)
+        self.assertEqual(len(ids), 120)
+        self.assertEqual(self.mock.throttled, 2)
+        self.assertGreaterEqual(spotify.metrics()["endpoints"]["GET /me/playlists"]["throttled"], 2)
+
+    def test_metrics_require_a_session(self):
+        self.assertEqual(self.client.get("/api/spotify-metrics").status_code, 401)
+        login(self.client)
+        self.client.get("/api/playlists")
+        metrics = self.client.get("/api/spotify-metrics").json()
+        self.assertIn("GET /me/playlists", metrics["endpoints"])
+
+    def test_large_responses_are_compressed(self):
+        login(self.client)
+        compressed = self.client.get("/api/playlists", {"limit": 200}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", compressed["Vary"])
+        plain = self.client.get("/api/playlists", {"limit": 200})
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        # Compact separators, whichever serializer is installed
+        self.assertTrue(plain.content.startswith(b'{"playlists":[{"id":"mock00000","name":'))
+
+    def test_invalid_queries_are_rejected(self):
+        login(self.client)
+        self.assertEqual(self.client.get("/api/playlists", {"limit": 0}).status_code, 400)
+        self.assertEqual(self.client.get("/api/playlists", {"fields": "id,secret"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/playlists", {"cursor": "###"}).status_code, 400)
+
+
+class SessionAuthTests(MockSpotifyTestCase):
+    def test_without_a_session(self):
+        self.assertEqual(self.client.get("/check_auth").json(), {"authenticated": False})
+
+    def test_valid_token_is_used_as_is(self):
+        login(self.client, token="valid-token")
+        self.assertEqual(self.client.get("/check_auth").json(), {"authenticated": True, "token": "valid-token"})
+        self.assertEqual(self.mock.tokens_issued, 0)
+
+    def test_expiring_token_is_refreshed_once(self):
+        login(self.client, token="old-token", expires_in=60)
+        refreshed = self.client.get("/check_auth").json()
+        self.assertTrue(refreshed["authenticated"])
+        self.assertNotEqual(refreshed["token"], "old-token")
+        # The new token was saved to the session, so the next request does not refresh again
+        self.assertEqual(self.client.get("/check_auth").json(), refreshed)
+        self.assertEqual(self.mock.tokens_issued, 1)
+
+    def test_expired_token_without_refresh_token_ends_the_session(self):
+        login(self.client, expires_in=-10, refresh_token=None)
+        self.assertEqual(self.client.get("/check_auth").json(), {"authenticated": False})
+        self.assertEqual(self.client.get("/api/playlists").status_code, 401)
+
+
+    def test_requests_without_a_cookie_skip_the_session_store(self):
+        with mock.patch.object(import_module(settings.SESSION_ENGINE).SessionStore, "load") as load:
+            self.assertEqual(self.client.get("/check_auth").json(), {"authenticated": False})
+        load.assert_not_called()
+
+    def test_failed_refresh_keeps_a_token_that_is_still_valid(self):
+        login(self.client, token="old-token", expires_in=60)
+        with mock.patch.object(spotify, "refresh_user_token", side_effect=requests.ConnectionError("down")):
+            self.assertEqual(self.client.get("/check_auth").json(), {"authenticated": True, "token": "old-token"})
+
+    def test_failed_refresh_of_an_expired_token_ends_the_session(self):
+        login(self.client, expires_in=-10)
+        with mock.patch.object(spotify, "refresh_user_token", side_effect=requests.ConnectionError("down")):
+            self.assertEqual(self.client.get("/check_auth").json(), {"authenticated": False})
+        # The session was flushed, so working refreshes cannot bring it back
+        self.assertEqual(self.client.get("/check_auth").json(), {"authenticated": False})
+        self.assertEqual(self.mock.tokens_issued, 0)
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for Django's RedisCache; every client shares one store"""
+    data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+
+class SessionBackendTests(TestCase):
+    def settings_for(self, **env):
+        """settings.py as it would load under env"""
+        with mock.patch.dict(os.environ, {"SECRET_KEY": "x", **env}):
+            return runpy.run_path(os.path.join(settings.BASE_DIR, "spotify_backend", "settings.py"))
+
+    def test_backend_names(self):
+        defaults = self.settings_for()
+        self.assertEqual(defaults["SESSION_ENGINE"], "django.contrib.sessions.backends.signed_cookies")
+        redis = self.settings_for(SESSION_BACKEND="cache", CACHE_BACKEND="redis", REDIS_URL="redis://cache:6379/1")
+        self.assertEqual(redis["SESSION_ENGINE"], "django.contrib.sessions.backends.cache")
+        self.assertEqual(redis["CACHES"]["default"]["LOCATION"], "redis://cache:6379/1")
+        with self.assertRaisesRegex(ValueError, "SESSION_BACKEND"):
+            self.settings_for(SESSION_BACKEND="memcached")
+
+    def test_sessions_work_with_every_backend(self):
+        session_files = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, session_files)
+        redis_cache = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://stub"}}
+        FakeRedis.data = {}
+
+        for backend, engine in settings.SESSION_ENGINES.items():
+            overrides = {"SESSION_ENGINE": engine, "SESSION_FILE_PATH": session_files}
+            if backend == "cache":
+                overrides["CACHES"] = redis_cache
+            with self.subTest(backend=backend), override_settings(**overrides), \
+                    mock.patch.object(RedisCacheClient, "get_client", lambda *args, **kwargs: FakeRedis()):
+                login(self.client, token=f"{backend}-token")
+                # A separate client stands in for another instance receiving the same cookie
+                other = Client()
+                other.cookies = self.client.cookies
+                self.assertEqual(other.get("/check_auth").json(), {"authenticated": True, "token": f"{backend}-token"})
+        self.assertTrue(FakeRedis.data)
+
+
+class DownloadStatusTests(TestCase):
+    def put(self, playlist_id, **fields):
+        download_store.put(playlist_id, {
+            "completed": False,
+            "error": None,
+            "state": "downloading",
+            "start_time": time.time(),
+            "progress": 40,
+            "playlist_name": "Test",
+            "playlist_url": f"https://open.spotify.com/playlist/{playlist_id}",
+            "download_token": f"token-{playlist_id}",
+            **fields
+        })
+
+    def test_running_download(self):
+        self.put("status-running")
+        body = self.client.get("/download-status/status-running").json()
+        self.assertEqual((body["status"], body["progress_message"]), ("in_progress", "Downloading tracks..."))
+
+    def test_finished_and_failed_downloads(self):
+        self.put("status-done", completed=True, progress=100)
+        self.put("status-failed", completed=True, error="spotdl exited with code 1")
+        self.assertEqual(self.client.get("/download-status/status-done").json()["status"], "completed")
+        failed = self.client.get("/download-status/status-failed").json()
+        self.assertEqual(failed["status"], "failed")
+        self.assertTrue(failed["alternative_method"])
+
+    def test_abandoned_download_times_out(self):
+        self.put("status-stuck", start_time=time.time() - settings.DOWNLOAD_TIMEOUT - 600)
+        body = self.client.get("/download-status/status-stuck").json()
+        self.assertEqual(body["status"], "failed")
+        self.assertTrue(download_store.get("status-stuck")["completed"])
+
+    def test_result_by_token_and_unknown_downloads(self):
+        self.put("status-token")
+        self.assertEqual(self.client.get("/download-result/token-status-token").json()["playlist_name"], "Test")
+        self.assertEqual(self.client.get("/download-status/nothing-here").status_code, 404)
+        self.assertEqual(self.client.get("/download-result/nothing-here").status_code, 404)
+
+    def test_only_one_concurrent_request_claims_a_playlist(self):
+        def claim(token):
+            return download_store.add("status-claimed", {"completed": False, "download_token": token}, active=lambda status: not status["completed"])
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            outcomes = list(pool.map(claim, [f"claim-{index}" for index in range(16)]))
+        winner = download_store.get("status-claimed")["download_token"]
+        self.assertEqual(outcomes.count(None), 1)
+        self.assertTrue(all(outcome["download_token"] == winner for outcome in outcomes if outcome is not None))
+        self.assertFalse(download_store.update("status-claimed", only_for_token="someone-else", progress=50))
+
+
+class DownloadRunTests(TestCase):
+    def queue(self, playlist_id, token):
+        download_store.put(playlist_id, {
+            "completed": False,
+            "error": None,
+            "state": "queued",
+            "start_time": time.time(),
+            "progress": 0,
+            "playlist_url": f"https://open.spotify.com/playlist/{playlist_id}",
+            "download_token": token
+        })
+
+    @override_settings(DOWNLOAD_ROOT="/proc/nope")
+    def test_unwritable_download_root_fails_the_download(self):
+        self.queue("run-readonly", "token-readonly")
+        with self.assertLogs("spotify_signup.downloads", "ERROR"):
+            downloads.run("run-readonly", "https://open.spotify.com/playlist/run-readonly", "token-readonly")
+        status = self.client.get("/download-status/run-readonly").json()
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("/proc/nope", status["error"])
+
+    def test_crashed_jobs_are_logged(self):
+        with mock.patch.object(downloads, "run", side_effect=RuntimeError("store unreachable")), \
+                self.assertLogs("spotify_signup.downloads", "ERROR") as captured:
+            self.assertTrue(downloads.submit("run-crash", "url", "token-crash"))
+            # The done callback logs on the worker thread
+            deadline = time.time() + 5
+            while not captured.records and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertIn("download.crashed playlist=run-crash", captured.output[0])
+        self.assertIn("store unreachable", captured.output[0])
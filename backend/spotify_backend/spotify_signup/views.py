@@ -4,72 +4,36 @@ from django.views.decorators.csrf import csrf_exempt
 import os
 import time
 import subprocess
-import threading
 import shutil
 import tempfile
 from dotenv import load_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
 import uuid
 import requests
 import json
+import logging
+from . import downloads
+from .download_store import download_store
+from .playlists import FIELDS, DEFAULT_FIELDS, InvalidCursor, get_user_playlists, paginate, spotify
+from .responses import json_response
 
 # Load environment variables from .env file
 load_dotenv()
 
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+logger = logging.getLogger(__name__)
+
 REDIRECT_URI = os.getenv("REDIRECT_URI") #, "http://localhost:8000/callback"
 FRONTEND_URL = os.getenv("FRONTEND_URL") # , "http://localhost:3000"
 
-# Add allowed origins for CORS
-ALLOWED_ORIGINS = [
-    'https://milar111.github.io',
-    'http://localhost:3000'
-]
-
-# Global dictionary to track download statuses
-download_statuses = {}
-download_tokens = {}  # To store tokens for downloads
-
-def set_cors_headers(response, request):
-    origin = request.headers.get('Origin', '')
-    if origin in ALLOWED_ORIGINS:
-        response["Access-Control-Allow-Origin"] = origin
-        response["Access-Control-Allow-Credentials"] = "true"
-        response["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
-        response["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
-    return response
-
-def get_spotify_oauth(request):
-    return SpotifyOAuth(
-        client_id=CLIENT_ID,
-        client_secret=CLIENT_SECRET,
-        redirect_uri=REDIRECT_URI,
-        scope="user-library-read playlist-read-private playlist-read-collaborative",
-        cache_handler=None,  # Disable file cache
-        show_dialog=True
-    )
+SPOTIFY_SCOPE = "user-library-read playlist-read-private playlist-read-collaborative"
 
 def index(request):
-    token_info = request.session.get("token_info")
-    if token_info and token_info.get("expires_at", 0) < time.time():
-        request.session.flush()
-        return redirect('/login')
-    
-    if "spotify_token" in request.session:
-        sp = spotipy.Spotify(auth=request.session["spotify_token"])
-        playlists = []
+    if request.spotify_token:
         try:
-            results = sp.current_user_playlists(limit=50)
+            playlists = get_user_playlists(request.spotify_token)
         except Exception as e:
             return JsonResponse({"error": "Failed to fetch playlists: " + str(e)}, status=500)
-        playlists.extend(results.get('items', []))
-        while results.get('next'):
-            results = sp.next(results)
-            playlists.extend(results.get('items', []))
         
         playlists_html = ""
         for playlist in playlists:
@@ -105,7 +69,7 @@ def index(request):
                     </script>
                 </head>
                 <body>
-                    <p>Logged in as {request.session["spotify_token"]}</p>
+                    <p>Logged in as {request.spotify_token}</p>
                     <h2>Your Library Playlists:</h2>
                     <ul>
                         {playlists_html}
@@ -118,58 +82,61 @@ def index(request):
 
 def download_playlist(request, playlist_id):
     """
-    Initiates a download for the given playlist by creating a download token
-    and triggering a GitHub Actions workflow.
+    Starts downloading the given playlist on this server and returns the token
+    its result can be looked up with. A download of the same playlist that is
+    still running is joined instead of started again.
     """
     if request.method == "POST":
         try:
             # Generate a unique token for this download
             download_token = str(uuid.uuid4())
+            playlist_url = f"https://open.spotify.com/playlist/{playlist_id}"
             
-            # Get playlist info from Spotify
-            sp = None
-            try:
-                sp = spotipy.Spotify(auth=request.session.get("spotify_token"))
-                playlist = sp.playlist(playlist_id)
-                playlist_url = playlist['external_urls']['spotify']
-                playlist_name = playlist['name']
-                total_tracks = playlist['tracks']['total']
-            except Exception as e:
-                print(f"Error getting playlist info: {str(e)}")
-                playlist_url = f"https://open.spotify.com/playlist/{playlist_id}"
-                playlist_name = f"Playlist-{playlist_id}"
-                total_tracks = 0
-            
-            # Store download info
-            download_statuses[playlist_id] = {
+            # Claim the playlist in one step, so concurrent requests cannot both start a download
+            current = download_store.add(playlist_id, {
                 'completed': False,
                 'error': None,
+                'state': 'queued',
                 'start_time': time.time(),
                 'progress': 0,
-                'total_tracks': total_tracks,
+                'total_tracks': 0,
                 'downloaded_tracks': 0,
-                'playlist_name': playlist_name,
+                'playlist_name': f"Playlist-{playlist_id}",
                 'playlist_url': playlist_url,
                 'download_token': download_token
-            }
+            }, active=lambda status: not status.get('completed') and not download_timed_out(status))
+            if current is not None:
+                return JsonResponse({
+                    'status': 'Download already in progress',
+                    'download_token': current['download_token'],
+                    'webhook_url': f"{request.build_absolute_uri('/').rstrip('/')}/download-result/{current['download_token']}"
+                })
+            
+            # Get playlist info from Spotify
+            try:
+                playlist = spotify.get(
+                    "/playlists/{playlist_id}",
+                    token=request.spotify_token,
+                    playlist_id=playlist_id
+                )
+                playlist_url = playlist['external_urls']['spotify']
+                download_store.update(
+                    playlist_id,
+                    only_for_token=download_token,
+                    playlist_url=playlist_url,
+                    playlist_name=playlist['name'],
+                    total_tracks=playlist['tracks']['total']
+                )
+            except Exception as e:
+                logger.warning("download.playlist_lookup_failed playlist=%s error=%s", playlist_id, e)
             
-            download_tokens[download_token] = playlist_id
+            if not downloads.submit(playlist_id, playlist_url, download_token):
+                download_store.update(playlist_id, only_for_token=download_token, completed=True, error='Too many downloads in progress, try again shortly.')
+                return JsonResponse({'error': 'Too many downloads in progress, try again shortly.'}, status=429)
             
             # Create download webhook URL for the client
             download_url = f"{request.build_absolute_uri('/').rstrip('/')}/download-result/{download_token}"
             
-            # For demonstration purposes, we'll just update the status after a delay
-            # In a real implementation, you would trigger a GitHub Actions workflow or similar
-            def delayed_update():
-                time.sleep(5)  # Simulate processing time
-                download_statuses[playlist_id]['progress'] = 100
-                download_statuses[playlist_id]['downloaded_tracks'] = total_tracks
-                download_statuses[playlist_id]['completed'] = True
-                
-            thread = threading.Thread(target=delayed_update)
-            thread.daemon = True
-            thread.start()
-            
             return JsonResponse({
                 'status': 'Download task created',
                 'download_token': download_token,
@@ -177,28 +144,29 @@ def download_playlist(request, playlist_id):
             })
             
         except Exception as e:
-            print(f"Error in download_playlist: {str(e)}")
+            logger.exception("download.start_failed playlist=%s", playlist_id)
             return JsonResponse({'error': str(e)}, status=500)
 
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+def download_timed_out(status):
+    """A pending download whose worker has given up on it or is gone, e.g. after a restart"""
+    started = status.get('started_at') or status.get('start_time', 0)
+    return time.time() - started > settings.DOWNLOAD_TIMEOUT + 300
+
 def check_download_status(request, playlist_id):
-    if playlist_id in download_statuses:
-        status = download_statuses[playlist_id]
+    status = download_store.get(playlist_id)
+    if status is not None:
+        if not status.get('completed') and download_timed_out(status):
+            timeout = {'completed': True, 'error': 'The download did not finish in time.'}
+            if download_store.update(playlist_id, only_if_pending=True, **timeout):
+                status.update(timeout)
+            else:
+                status = download_store.get(playlist_id) or status
         
-        # Check for timeout (30 minutes)
-        if not status.get('completed') and time.time() - status.get('start_time', 0) > 1800:
-            status.update({
-                'completed': True,
-                'error': 'The server cannot process downloads in this environment. Please use the alternative download method provided in the download dialog.'
-            })
-        
-        # Add alternative download info to response
         if not status.get('completed'):
             status['status'] = 'in_progress'
-            status['progress_message'] = "Processing download request..."
-            status['alternative_method'] = True
-            status['alt_message'] = "Use the spotdl command shown in the download dialog for best results."
+            status['progress_message'] = PROGRESS_MESSAGES.get(status.get('state'), "Processing download request...")
         else:
             status['status'] = 'completed' if not status.get('error') else 'failed'
             if status.get('error'):
@@ -208,28 +176,35 @@ def check_download_status(request, playlist_id):
         return JsonResponse(status)
     return JsonResponse({"error": "Download not found"}, status=404)
 
+PROGRESS_MESSAGES = {
+    'queued': "Waiting for a free download slot...",
+    'downloading': "Downloading tracks...",
+    'packaging': "Creating the archive..."
+}
+
 def get_download_result(request, token):
     """Endpoint to check download result by token"""
-    if token in download_tokens:
-        playlist_id = download_tokens[token]
-        if playlist_id in download_statuses:
-            status = download_statuses[playlist_id]
-            return JsonResponse(status)
+    status = download_store.get_by_token(token)
+    if status is not None:
+        return JsonResponse(status)
     return JsonResponse({"error": "Download not found"}, status=404)
 
 def get_download_archive(request, playlist_id):
     """
-    Returns alternative download instructions since direct downloads
-    are not possible in the hosted environment.
+    Sends the finished archive, or spotdl instructions when the download failed.
     """
-    if playlist_id in download_statuses:
-        status = download_statuses[playlist_id]
+    status = download_store.get(playlist_id)
+    if status is not None:
         if not status.get('completed'):
             return JsonResponse({'error': 'Download still in progress'}, status=400)
         
-        # Always return alternative instructions
+        archive = downloads.archive_path(playlist_id)
+        if not status.get('error') and archive.exists():
+            # FileResponse streams the file in blocks (sendfile under servers that support it)
+            return FileResponse(open(archive, 'rb'), as_attachment=True, filename=f"{status.get('playlist_name') or playlist_id}.zip")
+        
         return JsonResponse({
-            'error': 'Direct downloads are not available in this environment.',
+            'error': status.get('error') or 'The archive is no longer available.',
             'alternative_method': True,
             'command': f"spotdl --bitrate 192k \"{status.get('playlist_url', '')}\"",
             'playlist_name': status.get('playlist_name', ''),
@@ -239,55 +214,24 @@ def get_download_archive(request, playlist_id):
     return JsonResponse({'error': 'Download not found'}, status=404)
 
 def login(request):
-    sp_oauth = get_spotify_oauth(request)
-    auth_url = sp_oauth.get_authorize_url()
+    auth_url = spotify.authorize_url(REDIRECT_URI, SPOTIFY_SCOPE, show_dialog=True)
     return redirect(auth_url)
 
 def callback(request):
     code = request.GET.get("code")
-    sp_oauth = get_spotify_oauth(request)
     try:
-        token_info = sp_oauth.get_access_token(code, check_cache=False)
+        token_info = spotify.exchange_code(code, REDIRECT_URI)
     except Exception as e:
         return JsonResponse({"error": "Failed to get access token: " + str(e)}, status=500)
     
-    token_info["expires_in"] = 3600  
-    token_info["expires_at"] = int(time.time()) + 3600
-    
-    # Save to session
+    # Save to session; SessionMiddleware sets the cookie, SpotifyAuthMiddleware refreshes the token
     request.session["spotify_token"] = token_info["access_token"]
     request.session["token_info"] = token_info
-    request.session.save()
-    
-    print("Session keys after auth:", list(request.session.keys()))
-    print("Session key:", request.session.session_key)
+    logger.info("auth.login expires_at=%s", token_info["expires_at"])
     
     # Create the response with token in URL
     redirect_url = f"{FRONTEND_URL}/dashboard?token={token_info['access_token']}"
-    response = redirect(redirect_url)
-    
-    # Still set the session cookie as a fallback
-    response.set_cookie(
-        settings.SESSION_COOKIE_NAME,
-        request.session.session_key,
-        max_age=settings.SESSION_COOKIE_AGE,
-        expires=None,
-        domain=None,
-        path=settings.SESSION_COOKIE_PATH,
-        secure=settings.SESSION_COOKIE_SECURE,
-        httponly=settings.SESSION_COOKIE_HTTPONLY,
-        samesite='None'
-    )
-    
-    # Add CORS headers
-    origin = request.headers.get('Origin', '')
-    if origin:
-        response["Access-Control-Allow-Origin"] = origin
-        response["Access-Control-Allow-Credentials"] = "true"
-        response["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
-        response["Access-Control-Allow-Headers"] = "Content-Type, Authorization, Accept"
-    
-    return response
+    return redirect(redirect_url)
 
 def logout(request):
     request.session.flush()
@@ -295,104 +239,56 @@ def logout(request):
 
 @csrf_exempt
 def check_auth(request):
-    # Print debugging information
-    print("check_auth called")
-    print("Session keys:", list(request.session.keys()))
-    print("Cookies:", request.headers.get('Cookie', ''))
-    print("Origin:", request.headers.get('Origin', ''))
-    
-    response = None
-    if "spotify_token" in request.session:
-        token_info = request.session.get("token_info")
-        if token_info and token_info.get("expires_at", 0) < time.time():
-            print("Token expired")
-            request.session.flush()
-            response = JsonResponse({'authenticated': False})
-        else:
-            print("User is authenticated")
-            response = JsonResponse({'authenticated': True, 'token': request.session["spotify_token"]})
-    else:
-        print("No spotify_token in session")
-        response = JsonResponse({'authenticated': False})
-    
-    # Add CORS headers to the response
-    origin = request.headers.get('Origin', '')
-    if origin:
-        response["Access-Control-Allow-Origin"] = origin
-        response["Access-Control-Allow-Credentials"] = "true"
-        response["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
-        response["Access-Control-Allow-Headers"] = "Content-Type, Authorization, Accept"
-    
-    # Ensure the session cookie works cross-domain
-    if not request.session.is_empty():
-        print("Setting session cookie for cross-domain use")
-        response.set_cookie(
-            settings.SESSION_COOKIE_NAME,
-            request.session.session_key,
-            max_age=settings.SESSION_COOKIE_AGE,
-            expires=None,
-            domain=None,  # Don't restrict to a specific domain
-            path=settings.SESSION_COOKIE_PATH,
-            secure=settings.SESSION_COOKIE_SECURE,
-            httponly=settings.SESSION_COOKIE_HTTPONLY,
-            samesite='None'
-        )
-    
-    return response
+    if request.spotify_token:
+        logger.debug("auth.check authenticated=true")
+        return JsonResponse({'authenticated': True, 'token': request.spotify_token})
+    logger.debug("auth.check authenticated=false")
+    return JsonResponse({'authenticated': False})
 
 @csrf_exempt
 def options_check_auth(request):
-    response = HttpResponse()
-    return set_cors_headers(response, request)
+    # corsheaders answers preflight requests and adds the CORS headers
+    return HttpResponse()
+
+def playlist_query_error(request):
+    """Why the limit or fields of an /api/playlists request are invalid, if they are"""
+    try:
+        limit = int(request.GET.get('limit', settings.PLAYLIST_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= settings.PLAYLIST_PAGE_MAX:
+        return f"limit must be a number between 1 and {settings.PLAYLIST_PAGE_MAX}"
+    unknown = [field for field in request.GET.get('fields', '').split(',') if field and field not in FIELDS]
+    if unknown:
+        return f"Unknown fields: {', '.join(unknown)}"
+    return None
 
 @csrf_exempt
 def api_playlists(request):
-    # Debug output
-    print("api_playlists called")
-    print("Session keys:", list(request.session.keys()))
-    print("Cookies:", request.headers.get('Cookie', ''))
-    
-    token_info = request.session.get("token_info")
-    if token_info and token_info.get("expires_at", 0) < time.time():
-        request.session.flush()
-        response = JsonResponse({'error': 'Token expired'}, status=401)
-    elif "spotify_token" not in request.session:
-        response = JsonResponse({'error': 'Not authenticated'}, status=401)
-    else:
-        try:
-            sp = spotipy.Spotify(auth=request.session["spotify_token"])
-            playlists = []
-            results = sp.current_user_playlists(limit=50)
-            playlists.extend(results.get('items', []))
-            while results.get('next'):
-                results = sp.next(results)
-                playlists.extend(results.get('items', []))
-            
-            response = JsonResponse({'playlists': playlists})
-        except Exception as e:
-            print("Error fetching playlists:", str(e))
-            response = JsonResponse({'error': str(e)}, status=500)
+    if not request.spotify_token:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
     
-    # Add CORS headers
-    origin = request.headers.get('Origin', '')
-    if origin:
-        response["Access-Control-Allow-Origin"] = origin
-        response["Access-Control-Allow-Credentials"] = "true"
-        response["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
-        response["Access-Control-Allow-Headers"] = "Content-Type, Authorization, Accept"
+    error = playlist_query_error(request)
+    if error:
+        return JsonResponse({'error': error}, status=400)
     
-    # Set session cookie
-    if not request.session.is_empty():
-        response.set_cookie(
-            settings.SESSION_COOKIE_NAME,
-            request.session.session_key,
-            max_age=settings.SESSION_COOKIE_AGE,
-            expires=None,
-            domain=None,
-            path=settings.SESSION_COOKIE_PATH,
-            secure=settings.SESSION_COOKIE_SECURE,
-            httponly=settings.SESSION_COOKIE_HTTPONLY,
-            samesite='None'
+    try:
+        playlists = get_user_playlists(request.spotify_token)
+        page, next_cursor = paginate(
+            playlists,
+            cursor=request.GET.get('cursor'),
+            limit=int(request.GET.get('limit', settings.PLAYLIST_PAGE_SIZE)),
+            fields=[field for field in request.GET.get('fields', '').split(',') if field] or DEFAULT_FIELDS
         )
-    
-    return response
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        logger.exception("playlists.fetch_failed")
+        return JsonResponse({'error': str(e)}, status=500)
+    return json_response({'playlists': page, 'next_cursor': next_cursor, 'total': len(playlists)})
+
+def api_spotify_metrics(request):
+    """Call counts and latency per Spotify endpoint for this process; logged-in users only"""
+    if not request.spotify_token:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+    return JsonResponse(spotify.metrics())
@@ -0,0 +1,365 @@
+"""Throughput and latency of the download pipeline, without Spotify or YouTube.
+
+Starts downloader.py under uvicorn in a scratch directory with
+benchmarks/fake_spotdl.py as its spotdl executable, submits --jobs playlists
+at once and polls each one's status until it finishes. Reports job latency
+percentiles (end to end and per phase, from the jobs' phase_times), status
+endpoint latency while the jobs run, peak RSS of the server and peak disk
+use of its downloads folder.
+
+    python benchmarks/download_pipeline.py --jobs 20 --tracks 30 --track-bytes 2097152
+    python benchmarks/download_pipeline.py --output after.json --compare before.json
+
+--output saves the configuration and results as JSON and --compare prints
+how the key numbers moved against such a file, so runs before and after a
+change can be compared. The fake spotdl is configured through FAKE_SPOTDL_*
+variables derived from the options below.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parents[1]
+FAKE_SPOTDL = Path(__file__).resolve().with_name("fake_spotdl.py")
+
+PHASES = ("queued", "analyzing", "downloading", "packaging")
+FINISHED = ("completed", "error")
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    return {
+        "count": len(ordered),
+        "p50": at(0.50),
+        "p90": at(0.90),
+        "p99": at(0.99),
+        "max": ordered[-1],
+        "mean": sum(ordered) / len(ordered)
+    }
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def directory_size(path):
+    total = 0
+    for folder, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                # Tracks are moved into archives while we walk
+                pass
+    return total
+
+
+def peak_rss(pid):
+    """Peak resident set of a process in bytes, where /proc reports it"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class Sampler:
+    """Records the largest disk footprint of the downloads folder while jobs run"""
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.peak_disk = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak_disk = max(self.peak_disk, directory_size(self.path))
+            self.stopped.wait(self.interval)
+
+
+def start_server(args, work_dir, port):
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")])),
+        "SPOTDL_ENGINE": "cli",
+        "SPOTDL_BIN": str(FAKE_SPOTDL),
+        # Only checked for existence; the fake spotdl ignores --ffmpeg
+        "FFMPEG_BIN": str(FAKE_SPOTDL),
+        "CLIENT_ID": "",
+        "CLIENT_SECRET": "",
+        "JOB_STORE": args.store,
+        "ARCHIVE_MODE": args.archive_mode,
+        "MAX_CONCURRENT_DOWNLOADS": str(args.workers),
+        "MAX_QUEUED_DOWNLOADS": str(max(args.jobs, 20)),
+        "JANITOR_INTERVAL": "3600",
+        "FAKE_SPOTDL_TRACKS": str(args.tracks),
+        "FAKE_SPOTDL_TRACK_BYTES": str(args.track_bytes),
+        "FAKE_SPOTDL_TRACK_SECONDS": str(args.track_seconds),
+        "FAKE_SPOTDL_JITTER": str(args.jitter),
+        "FAKE_SPOTDL_ANALYZE_SECONDS": str(args.analyze_seconds),
+        "FAKE_SPOTDL_THREADS": str(args.spotdl_threads),
+        "FAKE_SPOTDL_FAILURE_RATE": str(args.failure_rate)
+    }
+    with open(work_dir / "server.log", "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "downloader:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=work_dir,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}, see {work_dir / 'server.log'}")
+        try:
+            health = requests.get(f"{base_url}/health", timeout=1).json()
+            if health["status"] != "healthy":
+                raise RuntimeError(f"Server is {health['status']}: {health['toolchain']['error']}")
+            return server, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("Server did not start within 60 seconds")
+
+
+def run_job(base_url, index, poll_interval, status_latencies, download_ids):
+    """Submit one playlist and poll it to the end; returns its timings"""
+    session = requests.Session()
+    submitted = time.perf_counter()
+    response = session.post(f"{base_url}/download", json={
+        "playlist_url": f"https://open.spotify.com/playlist/benchmark{index:05d}",
+        "playlist_name": f"Benchmark {index}"
+    }, timeout=30)
+    response.raise_for_status()
+    download_id = response.json()["download_id"]
+    download_ids.append(download_id)
+
+    while True:
+        time.sleep(poll_interval)
+        started = time.perf_counter()
+        status = session.get(f"{base_url}/download/{download_id}/status", timeout=30).json()
+        status_latencies.append(time.perf_counter() - started)
+        if status["status"] in FINISHED:
+            break
+    return {
+        "download_id": download_id,
+        "status": status["status"],
+        "latency": time.perf_counter() - submitted,
+        "phase_times": status.get("phase_times") or {}
+    }
+
+
+def hammer_status(base_url, download_ids, stopped, status_latencies):
+    """Extra status polling with no pause, for latency under heavier load"""
+    session = requests.Session()
+    while not stopped.is_set():
+        if not download_ids:
+            time.sleep(0.05)
+            continue
+        started = time.perf_counter()
+        session.get(f"{base_url}/download/{random.choice(download_ids)}/status", timeout=30)
+        status_latencies.append(time.perf_counter() - started)
+
+
+def phase_durations(jobs):
+    """Seconds each job spent in each phase, taken from consecutive phase_times"""
+    durations = {phase: [] for phase in PHASES}
+    for job in jobs:
+        entered = sorted(job["phase_times"].items(), key=lambda item: item[1])
+        for (phase, started), (_, ended) in zip(entered, entered[1:]):
+            if phase in durations:
+                durations[phase].append(ended - started)
+    return durations
+
+
+def metric_value(metrics, name):
+    return next((float(line.split()[-1]) for line in metrics.splitlines() if line.startswith(name + " ")), None)
+
+
+def benchmark(args):
+    work_dir = Path(tempfile.mkdtemp(prefix="reed-bench-"))
+    server, base_url = start_server(args, work_dir, free_port())
+    sampler = Sampler(work_dir / "downloads", args.sample_interval)
+    status_latencies = []
+    download_ids = []
+    stopped = threading.Event()
+    try:
+        sampler.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.jobs + args.pollers) as pool:
+            running = [
+                pool.submit(run_job, base_url, index, args.poll_interval, status_latencies, download_ids)
+                for index in range(args.jobs)
+            ]
+            pollers = [pool.submit(hammer_status, base_url, download_ids, stopped, status_latencies) for _ in range(args.pollers)]
+            try:
+                jobs = [future.result() for future in running]
+            finally:
+                stopped.set()
+            for poller in pollers:
+                poller.result()
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+        metrics = requests.get(f"{base_url}/metrics", timeout=10).text
+        # Read before the process goes away and takes its /proc entry with it
+        rss = peak_rss(server.pid)
+    finally:
+        stopped.set()
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        if args.keep:
+            print(f"Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    completed = [job for job in jobs if job["status"] == "completed"]
+    return {
+        "elapsed": elapsed,
+        "jobs_completed": len(completed),
+        "jobs_failed": len(jobs) - len(completed),
+        "jobs_per_second": len(completed) / elapsed,
+        "tracks_per_second": len(completed) * args.tracks / elapsed,
+        "job_latency": percentiles([job["latency"] for job in jobs]),
+        "phases": {phase: percentiles(values) for phase, values in phase_durations(jobs).items()},
+        "status_latency": percentiles(status_latencies),
+        "status_requests_per_second": len(status_latencies) / elapsed,
+        "peak_rss_bytes": rss,
+        "peak_disk_bytes": sampler.peak_disk,
+        "archive_bytes_written": metric_value(metrics, "reed_archive_bytes_written_total")
+    }
+
+
+def describe(summary, unit=1000, suffix="ms"):
+    if summary is None:
+        return "-"
+    return (
+        f"p50 {summary['p50'] * unit:.1f}{suffix}  p90 {summary['p90'] * unit:.1f}{suffix}  "
+        f"p99 {summary['p99'] * unit:.1f}{suffix}  max {summary['max'] * unit:.1f}{suffix}  (n={summary['count']})"
+    )
+
+
+def mebibytes(value):
+    return f"{value / 1024 ** 2:.1f} MiB" if value is not None else "-"
+
+
+def report(results):
+    print(
+        f"jobs            {results['jobs_completed']} completed, {results['jobs_failed']} failed in {results['elapsed']:.2f}s "
+        f"({results['jobs_per_second']:.2f} jobs/s, {results['tracks_per_second']:.1f} tracks/s)"
+    )
+    print(f"job latency     {describe(results['job_latency'], 1, 's')}")
+    for phase, summary in results["phases"].items():
+        print(f"  {phase:<13} {describe(summary)}")
+    print(f"status latency  {describe(results['status_latency'])}  {results['status_requests_per_second']:.0f} req/s")
+    print(f"peak rss        {mebibytes(results['peak_rss_bytes'])} (server process)")
+    print(f"peak disk       {mebibytes(results['peak_disk_bytes'])}")
+    print(f"archived        {mebibytes(results['archive_bytes_written'])}")
+
+
+# (label, path into the results, higher is better)
+COMPARED = [
+    ("jobs/s", ("jobs_per_second",), True),
+    ("job latency p50", ("job_latency", "p50"), False),
+    ("job latency p99", ("job_latency", "p99"), False),
+    ("packaging p50", ("phases", "packaging", "p50"), False),
+    ("status latency p50", ("status_latency", "p50"), False),
+    ("status latency p99", ("status_latency", "p99"), False),
+    ("peak rss", ("peak_rss_bytes",), False),
+    ("peak disk", ("peak_disk_bytes",), False)
+]
+
+
+def compare(results, baseline):
+    print(f"\nagainst {baseline['label']}:")
+    for label, path, higher_is_better in COMPARED:
+        before, after = baseline["results"], results
+        for key in path:
+            before = (before or {}).get(key)
+            after = (after or {}).get(key)
+        if not before or after is None:
+            continue
+        change = (after - before) / before * 100
+        better = change > 0 if higher_is_better else change < 0
+        verdict = "better" if better else "worse" if abs(change) >= 1 else "same"
+        print(f"  {label:<20} {change:+6.1f}%  {verdict}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--jobs", type=int, default=10, help="playlists submitted at once")
+    parser.add_argument("--workers", type=int, default=2, help="MAX_CONCURRENT_DOWNLOADS of the server")
+    parser.add_argument("--tracks", type=int, default=20, help="tracks per playlist")
+    parser.add_argument("--track-bytes", type=int, default=4 * 1024 ** 2, help="size of each fake track")
+    parser.add_argument("--track-seconds", type=float, default=0.5, help="time to download one track")
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- fraction applied to --track-seconds")
+    parser.add_argument("--analyze-seconds", type=float, default=0.5, help="time to resolve a playlist")
+    parser.add_argument("--spotdl-threads", type=int, default=4, help="tracks each fake spotdl downloads at once")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of tracks that fail")
+    parser.add_argument("--archive-mode", choices=("incremental", "stream"), default="incremental")
+    parser.add_argument("--store", choices=("memory", "sqlite"), default="memory", help="JOB_STORE of the server")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="seconds between status polls of each job")
+    parser.add_argument("--pollers", type=int, default=0, help="extra clients polling status without pause")
+    parser.add_argument("--sample-interval", type=float, default=0.25, help="seconds between disk usage samples")
+    parser.add_argument("--label", default=None, help="name of this run in saved results")
+    parser.add_argument("--output", help="save configuration and results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory and server log")
+    args = parser.parse_args()
+
+    results = benchmark(args)
+    report(results)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "keep", "label")}
+        with open(args.output, "w") as file:
+            json.dump({
+                "label": args.label or time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": config,
+                "results": results
+            }, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
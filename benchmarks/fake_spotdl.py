@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Stand-in for the spotdl executable, for benchmarking the downloader offline.
+
+Understands the calls downloader.py makes (`--version`, `<url> --list-only`
+and `<url> --output <dir> ...`), prints the same lines spotdl does and
+writes fake audio files of a chosen size at a chosen pace. Configured with
+environment variables, which the downloader passes on to its subprocesses:
+
+    FAKE_SPOTDL_TRACKS            tracks per playlist (default 20)
+    FAKE_SPOTDL_TRACK_BYTES       size of every track (default 4 MiB)
+    FAKE_SPOTDL_TRACK_SECONDS     time to "download" one track (default 0.5)
+    FAKE_SPOTDL_JITTER            +/- fraction applied to that time (default 0.2)
+    FAKE_SPOTDL_ANALYZE_SECONDS   time to resolve the playlist (default 0.5)
+    FAKE_SPOTDL_THREADS           tracks downloaded at once, like --threads (default 4)
+    FAKE_SPOTDL_FAILURE_RATE      share of tracks that fail (default 0)
+    FAKE_SPOTDL_NOT_FOUND_RATE    share of tracks with no match (default 0)
+"""
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TRACKS = int(os.getenv("FAKE_SPOTDL_TRACKS", "20"))
+TRACK_BYTES = int(os.getenv("FAKE_SPOTDL_TRACK_BYTES", str(4 * 1024 ** 2)))
+TRACK_SECONDS = float(os.getenv("FAKE_SPOTDL_TRACK_SECONDS", "0.5"))
+JITTER = float(os.getenv("FAKE_SPOTDL_JITTER", "0.2"))
+ANALYZE_SECONDS = float(os.getenv("FAKE_SPOTDL_ANALYZE_SECONDS", "0.5"))
+THREADS = int(os.getenv("FAKE_SPOTDL_THREADS", "4"))
+FAILURE_RATE = float(os.getenv("FAKE_SPOTDL_FAILURE_RATE", "0"))
+NOT_FOUND_RATE = float(os.getenv("FAKE_SPOTDL_NOT_FOUND_RATE", "0"))
+
+# Written over and over; random so nothing downstream can compress it
+BLOCK = os.urandom(1024 ** 2)
+
+output_lock = threading.Lock()
+
+
+def say(line):
+    with output_lock:
+        print(line, flush=True)
+
+
+def playlist_name(url):
+    return f"Benchmark {url.rstrip('/').rsplit('/', 1)[-1].split('?')[0]}"
+
+
+def track_names():
+    return [f"Bench Artist {index % 7} - Track {index:04d}" for index in range(TRACKS)]
+
+
+def download_track(name, output, audio_format, rng):
+    time.sleep(max(0.0, TRACK_SECONDS * (1 + rng.uniform(-JITTER, JITTER))))
+    roll = rng.random()
+    if roll < NOT_FOUND_RATE:
+        say(f"LookupError: No results found for song: {name}")
+        return
+    if roll < NOT_FOUND_RATE + FAILURE_RATE:
+        say(f"AudioProviderError: YT-DLP download error - https://music.youtube.com/watch?v=fake: {name}")
+        return
+
+    path = os.path.join(output, f"{name}.{audio_format}")
+    if os.path.exists(path):
+        say(f"Skipping {name} (file already exists) (duplicate)")
+        return
+    with open(path, "wb") as file:
+        remaining = TRACK_BYTES
+        while remaining > 0:
+            remaining -= file.write(BLOCK[:min(len(BLOCK), remaining)])
+    say(f'Downloaded "{name}": https://music.youtube.com/watch?v=fake')
+
+
+def main(args):
+    if args[:1] == ["--version"]:
+        say("4.2.11 (fake)")
+        return 0
+    if not args:
+        say("usage: fake_spotdl.py <url> [--list-only | --output DIR] [--format FORMAT]")
+        return 2
+
+    url = args[0]
+    time.sleep(ANALYZE_SECONDS)
+    say(f"Found {TRACKS} songs in {playlist_name(url)} (Playlist)")
+    if "--list-only" in args:
+        for name in track_names():
+            say(name)
+        return 0
+
+    output = args[args.index("--output") + 1] if "--output" in args else "."
+    audio_format = args[args.index("--format") + 1] if "--format" in args else "mp3"
+    # Seeded per playlist, so reruns of the same job fail the same tracks
+    seed = random.Random(url).random()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        downloads = [
+            pool.submit(download_track, name, output, audio_format, random.Random(f"{seed}:{index}"))
+            for index, name in enumerate(track_names())
+        ]
+    for download in downloads:
+        download.result()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import subprocess
@@ -7,15 +7,32 @@ import shutil
 import time
 import json
 import platform
-from fastapi.responses import FileResponse, JSONResponse
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
 import logging
 from pathlib import Path
-import zipfile
+from typing import Dict, Literal, Optional
 import random
 import string
+import asyncio
+import threading
+import re
+import importlib.util
+import zipfile
+import hashlib
+import mimetypes
+from importlib import metadata
+from spotdl_engine import LibraryEngine
+from track_cache import TrackCache, link_or_copy
+from archive import (
+    IncrementalArchive, content_disposition, data_offset, entry_sha256, file_crc32, file_sha256, iter_zip_stream,
+    list_audio_files, read_entries
+)
+from file_delivery import RangeFileResponse
+from job_store import FINISHED_STATUSES, QUEUED, RUNNING_STATUSES, create_job_store
+from job_events import JobEvents
+from metrics import RATE_BUCKETS, SIZE_BUCKETS, Registry
+from backend.spotify_backend.spotify_signup.spotify_api import SpotifyClient
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -42,72 +59,1005 @@ logger.info(f"Client Secret available: {'Yes' if client_secret else 'No'}")
 os.environ['SPOTIFY_CLIENT_ID'] = client_id
 os.environ['SPOTIFY_CLIENT_SECRET'] = client_secret
 
+# Shared with the Django app: pooled connections, a cached app token and
+# bounded retries when Spotify rate limits us
+spotify = SpotifyClient(
+    client_id,
+    client_secret,
+    api_url=os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1"),
+    accounts_url=os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com"),
+    max_retries=int(os.getenv("SPOTIFY_MAX_RETRIES", "3")),
+    max_retry_after=float(os.getenv("SPOTIFY_MAX_RETRY_AFTER", "30"))
+)
+
 # Create downloads directory if it doesn't exist
 download_root = Path("downloads")
 download_root.mkdir(exist_ok=True)
 
-# Store active downloads
-active_downloads = {}
+# Job state: "memory" is private to this process, "sqlite" is shared by every
+# worker process and keeps queued and running jobs across restarts
+JOB_STORE = os.getenv("JOB_STORE", "memory").lower()
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", str(download_root / "jobs.sqlite3"))
+jobs = create_job_store(JOB_STORE, JOB_STORE_PATH)
+
+# Identifies the jobs this process is running; running jobs that stop
+# heartbeating for JOB_STALE_AFTER seconds are put back in the queue
+WORKER_ID = f"{platform.node()}-{os.getpid()}"
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "60"))
+
+# Identical requests share one job while it runs, and a finished archive is
+# handed out again for this many seconds if the playlist snapshot is unchanged
+ARCHIVE_REUSE_TTL = float(os.getenv("ARCHIVE_REUSE_TTL", "3600"))
+coalescing = {"joined": 0, "reused": 0}
+
+# Progress pushed to /download/{id}/events subscribers. Streams also re-read the
+# store when idle this long, which picks up jobs running in other processes
+events = JobEvents()
+EVENT_STORE_CHECK_INTERVAL = float(os.getenv("EVENT_STORE_CHECK_INTERVAL", "5"))
+
+# Minimum seconds between progress log lines for a single job
+PROGRESS_LOG_INTERVAL = float(os.getenv("PROGRESS_LOG_INTERVAL", "5"))
+
+# "cli" runs the spotdl executable for every job, "library" drives spotdl's Python
+# API in long-lived engine processes, "auto" prefers the library when it is importable
+SPOTDL_ENGINE = os.getenv("SPOTDL_ENGINE", "auto").lower()
+SPOTDL_THREADS = int(os.getenv("SPOTDL_THREADS", "4"))
+
+# Library engine track pipeline: network fetches and ffmpeg transcodes are sized separately
+PIPELINE_FETCH_WORKERS = int(os.getenv("PIPELINE_FETCH_WORKERS", str(SPOTDL_THREADS)))
+PIPELINE_TRANSCODE_WORKERS = int(os.getenv("PIPELINE_TRANSCODE_WORKERS", str(os.cpu_count() or 1)))
+PIPELINE_RETRIES = int(os.getenv("PIPELINE_RETRIES", "2"))
+PIPELINE_RETRY_BACKOFF = float(os.getenv("PIPELINE_RETRY_BACKOFF", "1.0"))
+
+# Finished tracks shared across jobs; a size of 0 disables the cache
+TRACK_CACHE_DIR = Path(os.getenv("TRACK_CACHE_DIR", str(download_root / ".track-cache")))
+TRACK_CACHE_MAX_BYTES = int(os.getenv("TRACK_CACHE_MAX_BYTES", str(1024 ** 3)))
+track_cache = TrackCache(TRACK_CACHE_DIR, TRACK_CACHE_MAX_BYTES)
+
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.flac', '.ogg', '.opus', '.wav')
+
+# "incremental" appends each track to an on-disk zip as soon as it lands and drops
+# the loose file, "stream" builds the zip on the fly whenever /file is requested
+ARCHIVE_MODE = os.getenv("ARCHIVE_MODE", "incremental").lower()
+if ARCHIVE_MODE not in ("incremental", "stream"):
+    raise ValueError(f"Unknown archive mode '{ARCHIVE_MODE}'")
+
+# Archives of jobs that are still appending tracks, readable mid-job
+open_archives = {}
+
+# Per-connection cap in bytes per second on archive downloads; 0 leaves them unthrottled
+DOWNLOAD_BANDWIDTH_LIMIT = int(os.getenv("DOWNLOAD_BANDWIDTH_LIMIT", "0"))
+
+# Finished jobs and their files are deleted JOB_TTL seconds after they finish. When
+# less than DISK_FREE_LOW of the disk is free, the oldest finished jobs go early
+# until DISK_FREE_HIGH is free again. Folders and zips in downloads/ that no job
+# owns are deleted at startup once they are ORPHAN_GRACE seconds old, which leaves
+# alone a job another process is just creating
+JOB_TTL = float(os.getenv("JOB_TTL", str(24 * 3600)))
+DISK_FREE_LOW = float(os.getenv("DISK_FREE_LOW", "0.10"))
+DISK_FREE_HIGH = float(os.getenv("DISK_FREE_HIGH", "0.20"))
+JANITOR_INTERVAL = float(os.getenv("JANITOR_INTERVAL", "300"))
+ORPHAN_GRACE = float(os.getenv("ORPHAN_GRACE", "600"))
+
+# Worker pool sizing
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "2"))
+MAX_QUEUED_DOWNLOADS = int(os.getenv("MAX_QUEUED_DOWNLOADS", "20"))
+
+# Prometheus metrics served on /metrics. Counters and histograms cover the jobs and
+# requests of this process; gauges are refreshed from their sources on every scrape
+registry = Registry()
+job_phase_seconds = registry.histogram("reed_job_phase_seconds", "Time jobs spent in each phase", labels=("phase",))
+job_duration_seconds = registry.histogram("reed_job_duration_seconds", "Time from queueing to finishing a job", labels=("status",))
+jobs_finished = registry.counter("reed_jobs_finished_total", "Jobs that finished, by outcome", labels=("status",))
+job_errors = registry.counter("reed_job_errors_total", "Failed jobs, by reason", labels=("reason",))
+tracks_processed = registry.counter("reed_tracks_total", "Tracks processed, by outcome", labels=("state",))
+track_errors = registry.counter("reed_track_errors_total", "Tracks that failed, by error", labels=("reason",))
+tracks_per_second = registry.histogram("reed_job_tracks_per_second", "Tracks downloaded per second of the downloading phase", RATE_BUCKETS)
+archive_bytes_written = registry.counter("reed_archive_bytes_written_total", "Bytes of audio appended to incremental archives")
+archive_size_bytes = registry.histogram("reed_archive_size_bytes", "Size of finished downloads on disk", SIZE_BUCKETS)
+queue_depth = registry.gauge("reed_queue_depth", "Jobs waiting for a download worker")
+running_jobs = registry.gauge("reed_running_jobs", "Jobs running on any worker")
+busy_workers = registry.gauge("reed_busy_workers", "Download workers of this process running a job")
+event_subscribers = registry.gauge("reed_event_subscribers", "Clients subscribed to job events")
+coalesced_requests = registry.counter("reed_coalesced_requests_total", "Requests served by another job", labels=("kind",))
+track_cache_lookups = registry.counter("reed_track_cache_lookups_total", "Track cache lookups", labels=("result",))
+track_cache_hit_ratio = registry.gauge("reed_track_cache_hit_ratio", "Share of track cache lookups that hit")
+track_cache_bytes = registry.gauge("reed_track_cache_bytes", "Size of the track cache")
+spotify_requests = registry.counter("reed_spotify_requests_total", "Spotify API calls, by endpoint and outcome", labels=("endpoint", "outcome"))
+janitor_jobs_removed = registry.counter("reed_janitor_jobs_removed_total", "Jobs deleted by the janitor")
+janitor_bytes_reclaimed = registry.counter("reed_janitor_bytes_reclaimed_total", "Disk space freed by the janitor")
+disk_free_ratio = registry.gauge("reed_disk_free_ratio", "Free share of the downloads disk")
+toolchain_ready = registry.gauge("reed_toolchain_ready", "Whether spotdl and ffmpeg were found")
+toolchain_check_seconds = registry.gauge("reed_toolchain_check_seconds", "How long verifying spotdl and ffmpeg took at startup")
+
+# Resolved once at startup and shared by every job
+toolchain = {
+    "ready": False,
+    "engine": None,
+    "spotdl": None,
+    "spotdl_version": None,
+    "ffmpeg": None,
+    "error": "Toolchain has not been checked yet",
+    "checked_at": None
+}
 
 class DownloadRequest(BaseModel):
     playlist_url: str
-    playlist_name: str = None
+    playlist_name: Optional[str] = None
+    audio_format: Literal["mp3", "m4a", "flac", "ogg", "opus", "wav"] = "mp3"
+    bitrate: Optional[str] = None
+    # Build on the last finished download of this playlist and only fetch tracks added since;
+    # "full" returns the whole playlist, "delta" only the new tracks
+    sync: bool = False
+    sync_archive: Literal["delta", "full"] = "full"
 
 class DownloadStatusResponse(BaseModel):
     status: str
     message: str
     progress: float = 0.0
-    filename: str = None
-    download_id: str = None
+    filename: Optional[str] = None
+    download_id: Optional[str] = None
+    queue_position: Optional[int] = None
+    # When the job last entered each status, as Unix timestamps
+    phase_times: Optional[Dict[str, float]] = None
+
+class DownloadScheduler:
+    """FIFO download queue kept in the job store and drained by a fixed pool of worker threads.
+
+    Each worker runs its job on a private event loop, so a blocking spotdl
+    call only ties up that worker and never the API's event loop. Workers in
+    other processes claim from the same store, so each job runs exactly once.
+    """
+
+    def __init__(self, workers, max_queued):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.running = set()
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def start(self):
+        if self.threads:
+            return
+        requeued = jobs.requeue_stale(time.time() - JOB_STALE_AFTER)
+        if requeued:
+            logger.info(f"Requeued {len(requeued)} interrupted downloads: {', '.join(requeued)}")
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"download-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name="download-heartbeat", daemon=True)
+        heartbeat.start()
+        self.threads.append(heartbeat)
+        logger.info(f"Started {self.workers} download workers as {WORKER_ID} (queue limit {self.max_queued})")
+
+    def full(self):
+        return jobs.count(QUEUED) >= self.max_queued
+
+    def submit(self, download_id, **fields):
+        """Create a queued job, returning False when the queue is full"""
+        with self.condition:
+            if self.full():
+                return False
+            jobs.create(download_id, status=QUEUED, **fields)
+            self.condition.notify()
+            return True
+
+    def resume(self, download_id):
+        """Queue a finished job again, returning False if it is no longer finished"""
+        with self.condition:
+            job = jobs.get(download_id)
+            # The janitor may have deleted it since the caller looked it up
+            if job is None:
+                return False
+            resumed = jobs.transition(
+                download_id,
+                FINISHED_STATUSES,
+                status=QUEUED,
+                message="Waiting for a free download worker",
+                owner=None,
+                filename=None,
+                resumes=job.get("resumes", 0) + 1
+            )
+            if resumed:
+                self.condition.notify()
+        if resumed:
+            notify_queue()
+        return resumed
+
+    def position(self, download_id):
+        """1-based position of a queued job, or None once it has started"""
+        return jobs.queue_position(download_id)
+
+    def stats(self):
+        with self.condition:
+            local_running = len(self.running)
+        return {
+            "workers": self.workers,
+            "running": jobs.count(*RUNNING_STATUSES),
+            "running_here": local_running,
+            "queued": jobs.count(QUEUED),
+            "max_queued": self.max_queued,
+            "store": JOB_STORE
+        }
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_INTERVAL)
+            try:
+                jobs.heartbeat(WORKER_ID)
+                requeued = jobs.requeue_stale(time.time() - JOB_STALE_AFTER)
+                if requeued:
+                    logger.warning(f"Requeued stalled downloads: {', '.join(requeued)}")
+                    with self.condition:
+                        self.condition.notify_all()
+                    notify_queue()
+            except Exception as e:
+                logger.error(f"Job heartbeat failed: {str(e)}")
+
+    def _work(self):
+        while True:
+            with self.condition:
+                job = jobs.claim_next(WORKER_ID)
+                while job is None:
+                    # Jobs queued by other processes only show up in the store, so poll as well
+                    self.condition.wait(timeout=1.0)
+                    job = jobs.claim_next(WORKER_ID)
+                self.running.add(job["id"])
+            notify(job["id"])
+            notify_queue()
+            try:
+                asyncio.run(download_playlist_task(
+                    job["id"],
+                    job["playlist_url"],
+                    job["download_dir"],
+                    job.get("requested_name"),
+                    job.get("options")
+                ))
+            except Exception as e:
+                logger.error(f"Download worker crashed on {job['id']}: {str(e)}")
+            finally:
+                with self.condition:
+                    self.running.discard(job["id"])
+                record_finished_job(job["id"])
+                notify(job["id"])
+
+scheduler = DownloadScheduler(MAX_CONCURRENT_DOWNLOADS, MAX_QUEUED_DOWNLOADS)
+
+# open.spotify.com/playlist/<id>, optionally with a locale segment and query string
+SPOTIFY_URL_PATTERN = re.compile(r'open\.spotify\.com/(?:intl-[\w-]+/)?(playlist|album|artist|track)/(\w+)')
+
+def coalesce_key(playlist_url, audio_format, bitrate):
+    """Jobs with the same key produce the same archive"""
+    match = SPOTIFY_URL_PATTERN.search(playlist_url)
+    source = f"{match.group(1)}:{match.group(2)}" if match else playlist_url.split("?")[0].rstrip("/")
+    return f"{source}|{audio_format}|{bitrate or 'auto'}"
+
+def playlist_snapshot(playlist_url):
+    """Spotify's snapshot id for a playlist, which changes with every edit; None if unavailable"""
+    match = SPOTIFY_URL_PATTERN.search(playlist_url)
+    if not match or match.group(1) != "playlist" or not (client_id and client_secret):
+        return None
+    try:
+        # Runs while the client waits for its job id, so no retries
+        return spotify.get(
+            "/playlists/{playlist_id}",
+            playlist_id=match.group(2),
+            params={"fields": "snapshot_id"},
+            retries=0,
+            timeout=5
+        ).get("snapshot_id")
+    except Exception as e:
+        logger.warning(f"Could not fetch playlist snapshot: {str(e)}")
+        return None
+
+def find_shared_job(key, snapshot_id):
+    """A job already producing the requested archive, or a recent enough finished one"""
+    job = jobs.find(key, QUEUED, *RUNNING_STATUSES)
+    if job is not None and (snapshot_id is None or job.get("snapshot_id") in (None, snapshot_id)):
+        return job
+    
+    # Without a snapshot there is no telling whether the playlist changed since
+    if snapshot_id is None or ARCHIVE_REUSE_TTL <= 0:
+        return None
+    job = jobs.find(key, "completed")
+    if job is None or job.get("snapshot_id") != snapshot_id or job.get("failed_tracks"):
+        return None
+    if time.time() - job["updated_at"] > ARCHIVE_REUSE_TTL:
+        return None
+    return job if archive_exists(job) else None
+
+def archive_exists(download_info):
+    """Whether a finished job's tracks are still on disk"""
+    archive_path = download_info["download_dir"] if download_info["archive_mode"] == "stream" else download_info.get("archive_path")
+    return bool(archive_path) and os.path.exists(archive_path)
+
+def resolve_job(download_id):
+    """(job id, job) behind a download id, following coalesced aliases; the job is None if unknown"""
+    download_info = jobs.get(download_id)
+    if download_info is not None and download_info.get("alias_of"):
+        return download_info["alias_of"], jobs.get(download_info["alias_of"])
+    return download_id, download_info
+
+def status_payload(download_id, download_info):
+    """Public status fields of a job, as served by the status and events endpoints"""
+    return {
+        "status": download_info["status"],
+        "message": download_info["message"],
+        "progress": download_info["progress"],
+        "filename": download_info["filename"],
+        "download_id": download_id,
+        "queue_position": scheduler.position(download_id) if download_info["status"] == QUEUED else None,
+        "phase_times": download_info.get("phase_times")
+    }
+
+def notify(download_id):
+    """Push the job's current status to its event subscribers, if it has any"""
+    if not events.has_subscribers(download_id):
+        return
+    download_info = jobs.get(download_id)
+    if download_info is not None:
+        events.publish(download_id, "status", status_payload(download_id, download_info))
+
+def notify_queue():
+    """Queue positions move whenever a job starts, so refresh every waiting subscriber"""
+    for download_id in events.topics():
+        download_info = jobs.get(download_id)
+        if download_info is not None and download_info["status"] == QUEUED:
+            events.publish(download_id, "status", status_payload(download_id, download_info))
+
+def archive_filename(download_id, playlist_name):
+    safe_name = playlist_name.replace(" ", "_")
+    return f"{safe_name}_{download_id}.zip"
+
+def normalize_track_name(name):
+    return re.sub(r'\W+', '', name).casefold()
 
 def generate_download_id():
     """Generate a unique download ID"""
     return ''.join(random.choices(string.ascii_lowercase + string.digits, k=10))
 
+def resolve_spotdl():
+    """Locate the spotdl executable, honouring SPOTDL_BIN when set"""
+    configured = os.getenv("SPOTDL_BIN")
+    if configured:
+        return shutil.which(configured) or (configured if os.path.isfile(configured) else None)
+    return shutil.which("spotdl")
+
+def resolve_ffmpeg():
+    """Locate ffmpeg on PATH or the copy installed by `spotdl --download-ffmpeg`"""
+    configured = os.getenv("FFMPEG_BIN")
+    if configured:
+        return shutil.which(configured) or (configured if os.path.isfile(configured) else None)
+    
+    system_ffmpeg = shutil.which("ffmpeg")
+    if system_ffmpeg:
+        return system_ffmpeg
+    
+    local_ffmpeg = Path.home() / ".spotdl" / ("ffmpeg.exe" if platform.system() == "Windows" else "ffmpeg")
+    if local_ffmpeg.is_file():
+        return str(local_ffmpeg)
+    return None
+
+def resolve_engine():
+    """Pick the download engine from SPOTDL_ENGINE"""
+    if SPOTDL_ENGINE == "auto":
+        return "library" if importlib.util.find_spec("spotdl") else "cli"
+    return SPOTDL_ENGINE
+
+def check_toolchain():
+    """Verify spotdl and ffmpeg once and cache the result in `toolchain`"""
+    toolchain.update({
+        "ready": False,
+        "engine": resolve_engine(),
+        "spotdl": None,
+        "spotdl_version": None,
+        "ffmpeg": None,
+        "error": None,
+        "checked_at": time.time()
+    })
+    
+    if toolchain["engine"] == "library":
+        try:
+            spotdl_version = metadata.version("spotdl")
+        except metadata.PackageNotFoundError:
+            toolchain["error"] = "spotdl package is not installed"
+            logger.error(toolchain["error"])
+            return toolchain
+        spotdl_path = None
+    elif toolchain["engine"] == "cli":
+        spotdl_path = resolve_spotdl()
+        if not spotdl_path:
+            toolchain["error"] = "spotdl executable not found"
+            logger.error(toolchain["error"])
+            return toolchain
+        
+        try:
+            version_result = subprocess.run(
+                [spotdl_path, '--version'],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=60
+            )
+        except Exception as e:
+            toolchain["error"] = f"Failed to verify spotdl installation: {str(e)}"
+            logger.error(toolchain["error"])
+            return toolchain
+        spotdl_version = version_result.stdout.strip()
+    else:
+        toolchain["error"] = f"Unknown SPOTDL_ENGINE '{toolchain['engine']}'"
+        logger.error(toolchain["error"])
+        return toolchain
+    
+    ffmpeg_path = resolve_ffmpeg()
+    if not ffmpeg_path:
+        toolchain["error"] = "ffmpeg not found, run `spotdl --download-ffmpeg` or set FFMPEG_BIN"
+        logger.error(toolchain["error"])
+        return toolchain
+    
+    toolchain.update({
+        "ready": True,
+        "spotdl": spotdl_path,
+        "spotdl_version": spotdl_version,
+        "ffmpeg": ffmpeg_path
+    })
+    logger.info(f"Spotdl version: {spotdl_version} ({toolchain['engine']} engine), ffmpeg: {ffmpeg_path}")
+    return toolchain
+
+def spotdl_command(*args):
+    """Build a spotdl command line using the toolchain resolved at startup"""
+    command = [toolchain["spotdl"], *args]
+    if toolchain["ffmpeg"]:
+        command += ['--ffmpeg', toolchain["ffmpeg"]]
+    return command
+
+# spotdl log lines that describe what happened to a track, checked in order
+SPOTDL_EVENT_PATTERNS = [
+    ("found", re.compile(r'Found (\d+) songs in (.+?)(?: \((?:Playlist|Album|Artist)\))?\s*$')),
+    ("downloaded", re.compile(r'Downloaded "(.+)"')),
+    ("skipped", re.compile(r'Skipping (.+?) \((?:file already exists|skip file found)\)')),
+    ("lookup_error", re.compile(r'LookupError: No results found for song: (.+)')),
+    ("failed", re.compile(r'\b(\w+Error): (.+)')),
+]
+
+def parse_spotdl_line(line):
+    """Turn one line of spotdl output into an (event, track, detail) tuple, or None"""
+    for event, pattern in SPOTDL_EVENT_PATTERNS:
+        match = pattern.search(line)
+        if not match:
+            continue
+        if event == "found":
+            return event, match.group(2).strip(), int(match.group(1))
+        if event == "failed":
+            return event, match.group(2).strip(), match.group(1)
+        return event, match.group(1).strip(), None
+    return None
+
+class ThrottledLogger:
+    """Emit at most one line per interval and count what was dropped in between"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_emit = 0.0
+        self.suppressed = 0
+
+    def log(self, level, message, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_emit < self.interval:
+            self.suppressed += 1
+            return
+        if self.suppressed:
+            message = f"{message} ({self.suppressed} similar lines suppressed)"
+        logger.log(level, message)
+        self.last_emit = now
+        self.suppressed = 0
+
+async def run_spotdl(*args):
+    """Start spotdl as an asyncio subprocess with stdout and stderr merged"""
+    return await asyncio.create_subprocess_exec(
+        *spotdl_command(*args),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        limit=1024 * 1024
+    )
+
+# Track state recorded for each spotdl event, and the job counter it feeds
+TRACK_STATES = {
+    "downloaded": "downloaded",
+    "skipped": "skipped",
+    "lookup_error": "not_found",
+    "failed": "failed"
+}
+TRACK_COUNTERS = {
+    "downloaded": "downloaded_tracks",
+    "skipped": "skipped_tracks",
+    "not_found": "failed_tracks",
+    "failed": "failed_tracks"
+}
+
+def record_track_event(download_info, tracks, event, track, detail):
+    """Apply a parsed spotdl event to the job's per-track states and counters.
+
+    Returns the track's new state, or None when nothing changed. A track that
+    finished in an earlier run of the job keeps its state when the rerun
+    reports it as skipped.
+    """
+    state = TRACK_STATES.get(event)
+    if state is None:
+        return None
+    previous = tracks.get(track)
+    if state == "skipped" and previous in ("downloaded", "skipped"):
+        return None
+    
+    if previous:
+        download_info[TRACK_COUNTERS[previous]] -= 1
+    download_info[TRACK_COUNTERS[state]] += 1
+    tracks[track] = state
+    if event == "failed":
+        download_info["errors"].append(f"{detail}: {track}")
+    return state
+
+class JobReporter:
+    """Apply engine events for one job to its status and throttled logs.
+
+    Counters are kept here and written to the job store as absolute values,
+    so a store shared between processes never sees lost increments. Track
+    states are checkpointed in the store once a track is safely packed, and
+    a rerun of the job starts from that checkpoint.
+
+    Tracks the job should not download again are laid out as empty
+    placeholders, which spotdl skips as existing files and pack() discards.
+    """
+
+    def __init__(self, download_id, playlist_name=None):
+        self.download_id = download_id
+        self.playlist_name = playlist_name
+        self.progress_log = ThrottledLogger(PROGRESS_LOG_INTERVAL)
+        self.error_log = ThrottledLogger(1.0)
+        self.archive = None
+        self.placeholders = set()
+        self.job = jobs.get(download_id)
+        self.tracks = jobs.tracks(download_id)
+        self.state = {
+            "total_tracks": 0,
+            "downloaded_tracks": 0,
+            "skipped_tracks": 0,
+            "failed_tracks": 0,
+            "errors": []
+        }
+        for track_state in self.tracks.values():
+            self.state[TRACK_COUNTERS[track_state]] += 1
+
+    def open_archive(self):
+        if self.job["archive_mode"] != "incremental" or self.archive is not None:
+            return
+        archive_path = self.job.get("archive_path") or os.path.join(
+            os.path.dirname(self.job["download_dir"]),
+            archive_filename(self.download_id, self.job["playlist_name"])
+        )
+        self.archive = IncrementalArchive(archive_path, resume=True)
+        jobs.update(self.download_id, archive_path=archive_path)
+        open_archives[self.download_id] = self.archive
+        
+        # Packed tracks are no longer in the job folder, so a rerun must not fetch them again
+        for arcname in self.archive.names():
+            self.add_placeholder(arcname)
+
+    def add_placeholder(self, arcname):
+        path = os.path.join(self.job["download_dir"], arcname)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+            self.placeholders.add(os.path.abspath(path))
+        elif not os.path.getsize(path):
+            self.placeholders.add(os.path.abspath(path))
+
+    def seed(self):
+        """Start a sync job from the tracks of the download it builds on"""
+        previous = jobs.get(self.job["sync_of"]) if self.job.get("sync_of") else None
+        if previous is None or not archive_exists(previous):
+            return
+        full = self.job.get("sync_archive") == "full"
+        download_dir = self.job["download_dir"]
+        
+        if previous["archive_mode"] == "stream":
+            sources = list_audio_files(previous["download_dir"], AUDIO_EXTENSIONS)
+            names = [arcname for _, arcname in sources]
+            if full and self.archive is not None:
+                for file_path, arcname in sources:
+                    self.archive.add(file_path, arcname)
+            elif full:
+                for file_path, arcname in sources:
+                    if not os.path.exists(os.path.join(download_dir, arcname)):
+                        link_or_copy(file_path, os.path.join(download_dir, arcname))
+        else:
+            with zipfile.ZipFile(previous["archive_path"]) as source:
+                names = source.namelist()
+                if full and self.archive is None:
+                    source.extractall(download_dir)
+            if full and self.archive is not None:
+                self.archive.copy_from(previous["archive_path"])
+        
+        for arcname in names:
+            self.add_placeholder(arcname)
+        logger.info(f"[{self.download_id}] Syncing against {previous['id']} with {len(names)} known tracks")
+
+    def pack(self, track=None, path=None, final=False):
+        """Move finished tracks from the job folder into the archive.
+
+        A track is matched by the path the engine reported or by its name, so
+        files that spotdl is still writing for other tracks are left alone;
+        `final` sweeps up whatever is left once the engine has exited.
+        """
+        candidates = list_audio_files(self.job["download_dir"], AUDIO_EXTENSIONS)
+        if self.archive is None:
+            # Stream mode zips the folder as it is, so only placeholders need clearing
+            if final:
+                self.drop_placeholders(candidates)
+            return
+        if final:
+            ready = candidates
+        elif path:
+            ready = [item for item in candidates if os.path.abspath(item[0]) == os.path.abspath(path)]
+        else:
+            ready = [item for item in candidates if normalize_track_name(Path(item[1]).stem) == normalize_track_name(track)]
+        
+        for file_path, arcname in self.drop_placeholders(ready):
+            archive_bytes_written.inc(self.archive.add(file_path, arcname))
+            os.remove(file_path)
+
+    def drop_placeholders(self, files):
+        """Delete the placeholders among (path, arcname) pairs and return the rest"""
+        remaining = []
+        for file_path, arcname in files:
+            if os.path.abspath(file_path) in self.placeholders:
+                os.remove(file_path)
+                self.placeholders.discard(os.path.abspath(file_path))
+            else:
+                remaining.append((file_path, arcname))
+        return remaining
+
+    def finish(self):
+        """Sweep remaining tracks and write the central directory"""
+        self.pack(final=True)
+        if self.archive is None:
+            return
+        self.archive.close()
+        open_archives.pop(self.download_id, None)
+
+    def __call__(self, event, track, detail):
+        state = self.state
+        if event == "found":
+            if track and not self.playlist_name:
+                self.job["playlist_name"] = track
+            state["total_tracks"] = detail
+            done = state["downloaded_tracks"] + state["skipped_tracks"]
+            jobs.update(
+                self.download_id,
+                playlist_name=self.job["playlist_name"],
+                total_tracks=detail,
+                status="downloading",
+                message=f"Resuming, {done}/{detail} tracks already downloaded" if done else f"Downloading {detail} tracks..."
+            )
+            logger.info(f"Playlist has {detail} tracks" + (f", {done} already downloaded" if done else ""))
+            self.open_archive()
+            self.seed()
+            notify(self.download_id)
+            return
+        
+        track_state = record_track_event(state, self.tracks, event, track, detail)
+        if event in ("downloaded", "skipped"):
+            self.pack(track, detail if event == "downloaded" else None)
+        if track_state:
+            jobs.set_track(self.download_id, track, track_state)
+            tracks_processed.inc(state=track_state)
+        if event in ("lookup_error", "failed"):
+            track_errors.inc(reason=detail if event == "failed" else "not_found")
+            self.error_log.log(logging.WARNING, f"[{self.download_id}] {event}: {track}")
+        
+        track_count = state["total_tracks"]
+        finished = state["downloaded_tracks"] + state["skipped_tracks"] + state["failed_tracks"]
+        update = dict(state)
+        if track_count > 0:
+            update["progress"] = min(0.95, finished / track_count)
+            update["message"] = f"Downloaded {state['downloaded_tracks']}/{track_count} tracks"
+        jobs.update(self.download_id, **update)
+        if track_state:
+            events.publish(self.download_id, "track", {"track": track, "state": track_state})
+        notify(self.download_id)
+        self.progress_log.log(logging.INFO, f"[{self.download_id}] {finished}/{track_count} tracks processed")
+
+# Scheduler worker threads each keep their own library engine process
+worker_state = threading.local()
+
+def get_library_engine():
+    engine = getattr(worker_state, "engine", None)
+    if engine is None:
+        engine = LibraryEngine({
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "ffmpeg": toolchain["ffmpeg"],
+            "threads": SPOTDL_THREADS,
+            "fetch_workers": PIPELINE_FETCH_WORKERS,
+            "transcode_workers": PIPELINE_TRANSCODE_WORKERS,
+            "retries": PIPELINE_RETRIES,
+            "retry_backoff": PIPELINE_RETRY_BACKOFF,
+            "cache_dir": str(TRACK_CACHE_DIR),
+            "cache_max_bytes": TRACK_CACHE_MAX_BYTES
+        })
+        worker_state.engine = engine
+    return engine
+
+async def download_with_cli(download_id, playlist_url, download_dir, report, options):
+    """Resolve the playlist with `--list-only`, then stream a full spotdl run"""
+    info_process = await run_spotdl(playlist_url, '--list-only')
+    info_output, _ = await info_process.communicate()
+    info_output = info_output.decode(errors="replace")
+    
+    if "not found" in info_output.lower() or "error" in info_output.lower():
+        job_errors.inc(reason="playlist_not_found")
+        jobs.update(download_id, status="error", message=f"Invalid playlist URL or playlist not found")
+        return False
+    
+    found = next((parsed for parsed in map(parse_spotdl_line, info_output.splitlines()) if parsed and parsed[0] == "found"), None)
+    report(*(found or ("found", None, 0)))
+    
+    # Stream spotdl output without blocking the worker's event loop
+    format_args = ['--format', options["format"]]
+    if options["bitrate"]:
+        format_args += ['--bitrate', options["bitrate"]]
+    process = await run_spotdl(playlist_url, '--output', download_dir, *format_args)
+    async for raw_line in process.stdout:
+        line = raw_line.decode(errors="replace").strip()
+        logger.debug(line)
+        parsed = parse_spotdl_line(line)
+        if parsed and parsed[0] != "found":
+            report(*parsed)
+    
+    await process.wait()
+    report.progress_log.log(logging.INFO, f"[{download_id}] spotdl exited with code {process.returncode}", force=True)
+    
+    if process.returncode != 0:
+        job_errors.inc(reason="spotdl_exit")
+        jobs.update(download_id, status="error", message="Download failed")
+        return False
+    return True
+
+async def download_with_library(download_id, playlist_url, download_dir, report, options):
+    """Resolve and download in this worker's engine process, reusing its warm clients"""
+    summary = await asyncio.to_thread(get_library_engine().run, playlist_url, download_dir, report, options)
+    track_cache.record(summary.get("cache_hits", 0), summary.get("cache_misses", 0))
+    logger.info(f"[{download_id}] spotdl engine finished: {summary}")
+    return True
+
+def path_size(path):
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(folder, name))
+            for folder, _, names in os.walk(path) for name in names
+            if os.path.isfile(os.path.join(folder, name))
+        )
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def job_paths(job):
+    """Everything a job keeps on disk"""
+    paths = {job["download_dir"]} if job.get("download_dir") else set()
+    if job.get("archive_path"):
+        paths.add(job["archive_path"])
+    if job.get("download_dir") and job.get("filename"):
+        paths.add(os.path.join(os.path.dirname(job["download_dir"]), job["filename"]))
+    return paths
+
+class DownloadJanitor:
+    """Delete expired jobs with their files, and free disk space when it runs low.
+
+    A job is first moved from a finished status to "expired" atomically, so a
+    resume that requeues it at the same time wins. Jobs that a queued or
+    running sync builds on are kept, and aliases go with the job they point to.
+    """
+
+    def __init__(self, root, ttl, free_low, free_high, interval):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.free_low = free_low
+        self.free_high = free_high
+        self.interval = interval
+        self.thread = None
+        self.lock = threading.Lock()
+        self.totals = {"sweeps": 0, "jobs_removed": 0, "orphans_removed": 0, "bytes_reclaimed": 0, "last_sweep": None}
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.remove_orphans()
+        self.thread = threading.Thread(target=self._run, name="download-janitor", daemon=True)
+        self.thread.start()
+
+    def free_fraction(self):
+        usage = shutil.disk_usage(self.root)
+        return usage.free / usage.total if usage.total else 1.0
+
+    def sweep(self):
+        """One pass: expired jobs, then the oldest finished jobs while the disk is short on space"""
+        now = time.time()
+        pinned = {job.get("sync_of") for job in jobs.list(QUEUED, *RUNNING_STATUSES)}
+        finished = sorted(
+            (job for job in jobs.list(*FINISHED_STATUSES) if job["id"] not in pinned),
+            key=lambda job: job["updated_at"]
+        )
+        removed = reclaimed = 0
+        # Jobs a crashed sweep had already claimed
+        for job in jobs.list("expired"):
+            reclaimed += self.delete_job(job)
+            removed += 1
+        
+        # Oldest first, so once the expired jobs are gone only disk pressure removes more
+        under_pressure = self.free_fraction() < self.free_low
+        for job in finished:
+            expired = job["updated_at"] < now - self.ttl
+            if not expired and (not under_pressure or self.free_fraction() >= self.free_high):
+                break
+            if jobs.transition(job["id"], FINISHED_STATUSES, status="expired"):
+                reclaimed += self.delete_job(job)
+                removed += 1
+        
+        # Aliases whose job is gone can never resolve again
+        for alias in jobs.list("alias"):
+            if jobs.get(alias["alias_of"]) is None:
+                jobs.delete(alias["id"])
+        
+        with self.lock:
+            self.totals["sweeps"] += 1
+            self.totals["jobs_removed"] += removed
+            self.totals["bytes_reclaimed"] += reclaimed
+            self.totals["last_sweep"] = now
+        if removed:
+            logger.info(f"Janitor removed {removed} jobs and reclaimed {reclaimed / 1024 ** 2:.1f} MiB")
+        return removed, reclaimed
+
+    def delete_job(self, job):
+        """Delete a job claimed as "expired" with its aliases and files, returning the bytes freed"""
+        freed = 0
+        for path in job_paths(job):
+            freed += path_size(path)
+            remove_path(path)
+        for alias in jobs.list("alias"):
+            if alias.get("alias_of") == job["id"]:
+                jobs.delete(alias["id"])
+        jobs.delete(job["id"])
+        return freed
+
+    def remove_orphans(self):
+        """Delete job folders and archives left behind by jobs the store no longer knows"""
+        owned = {os.path.abspath(path) for job in jobs.list() for path in job_paths(job)}
+        cutoff = time.time() - ORPHAN_GRACE
+        removed = reclaimed = 0
+        for entry in self.root.iterdir():
+            # Dot entries are the track cache and friends, other files are the job store
+            if entry.name.startswith(".") or entry.resolve() == TRACK_CACHE_DIR.resolve():
+                continue
+            if not (entry.is_dir() or entry.suffix in (".zip", ".part")):
+                continue
+            if os.path.abspath(entry) in owned or entry.stat().st_mtime > cutoff:
+                continue
+            reclaimed += path_size(entry)
+            remove_path(entry)
+            removed += 1
+        with self.lock:
+            self.totals["orphans_removed"] += removed
+            self.totals["bytes_reclaimed"] += reclaimed
+        if removed:
+            logger.info(f"Janitor removed {removed} orphaned downloads ({reclaimed / 1024 ** 2:.1f} MiB)")
+        return removed, reclaimed
+
+    def stats(self):
+        with self.lock:
+            return {**self.totals, "free_fraction": round(self.free_fraction(), 3)}
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Janitor sweep failed: {str(e)}")
+            time.sleep(self.interval)
+
+janitor = DownloadJanitor(download_root, JOB_TTL, DISK_FREE_LOW, DISK_FREE_HIGH, JANITOR_INTERVAL)
+
+@app.on_event("startup")
+async def verify_toolchain():
+    started = time.monotonic()
+    check_toolchain()
+    toolchain_check_seconds.set(time.monotonic() - started)
+    scheduler.start()
+    janitor.start()
+
 @app.get("/")
 async def root():
     return {"status": "ok", "message": "REED Downloader Service is running"}
 
 @app.post("/download", response_model=DownloadStatusResponse)
-async def start_download(request: DownloadRequest, background_tasks: BackgroundTasks):
+async def start_download(request: DownloadRequest):
     try:
         logger.info(f"Received download request for URL: {request.playlist_url}")
         
         # Generate a unique ID for this download
         download_id = generate_download_id()
         
+        # A sync builds on the last finished download of the same playlist and format
+        key = coalesce_key(request.playlist_url, request.audio_format, request.bitrate)
+        previous = jobs.find(key, "completed") if request.sync else None
+        if previous is not None and not archive_exists(previous):
+            previous = None
+        if request.sync and previous is None:
+            logger.info(f"No earlier download to sync {request.playlist_url} against, fetching every track")
+        elif previous is not None and request.sync_archive == "delta":
+            key = f"{key}|delta:{previous['id']}"
+        
+        # Share a job that is already downloading, or has just downloaded, the same playlist
+        snapshot_id = await asyncio.to_thread(playlist_snapshot, request.playlist_url)
+        shared = find_shared_job(key, snapshot_id)
+        if shared is not None:
+            jobs.create(
+                download_id,
+                status="alias",
+                alias_of=shared["id"],
+                message="",
+                progress=0.0,
+                filename=None,
+                playlist_url=request.playlist_url,
+                playlist_name=request.playlist_name or "Spotify Playlist"
+            )
+            coalescing["reused" if shared["status"] == "completed" else "joined"] += 1
+            logger.info(f"Download {download_id} shares job {shared['id']} ({shared['status']})")
+            return DownloadStatusResponse(**{**status_payload(shared["id"], shared), "download_id": download_id})
+        
         # Create a unique folder for this download
         download_dir = download_root / download_id
         download_dir.mkdir(exist_ok=True)
         logger.info(f"Created folder: {download_dir}")
         
-        # Set initial status
-        active_downloads[download_id] = {
-            "status": "initialized",
-            "message": "Download initialized",
-            "progress": 0.0,
-            "filename": None,
-            "playlist_url": request.playlist_url,
-            "playlist_name": request.playlist_name or "Spotify Playlist",
-            "start_time": time.time(),
-            "total_tracks": 0,
-            "downloaded_tracks": 0,
-            "download_dir": str(download_dir)
-        }
-        
-        # Start the download process in the background
-        background_tasks.add_task(
-            download_playlist_task, 
-            download_id, 
-            request.playlist_url, 
-            str(download_dir),
-            request.playlist_name
+        # Queue the job for the worker pool, rejecting it if the queue is full
+        queued = scheduler.submit(
+            download_id,
+            message="Waiting for a free download worker",
+            progress=0.0,
+            filename=None,
+            playlist_url=request.playlist_url,
+            playlist_name=request.playlist_name or "Spotify Playlist",
+            requested_name=request.playlist_name,
+            key=key,
+            snapshot_id=snapshot_id,
+            sync_of=previous["id"] if previous else None,
+            sync_archive=request.sync_archive,
+            options={"format": request.audio_format, "bitrate": request.bitrate},
+            start_time=time.time(),
+            total_tracks=0,
+            downloaded_tracks=0,
+            download_dir=str(download_dir),
+            archive_mode=ARCHIVE_MODE
         )
+        if not queued:
+            shutil.rmtree(download_dir, ignore_errors=True)
+            logger.warning(f"Download queue full, rejected {request.playlist_url}")
+            return JSONResponse(
+                status_code=429,
+                content={"status": "error", "message": "Download queue is full, please try again later"},
+                headers={"Retry-After": "30"}
+            )
         
         return DownloadStatusResponse(
-            status="initialized",
-            message="Download initialized. Check status endpoint for updates.",
-            download_id=download_id
+            status="queued",
+            message="Download queued. Check status endpoint for updates.",
+            download_id=download_id,
+            queue_position=scheduler.position(download_id)
         )
         
     except Exception as e:
@@ -117,160 +1067,237 @@ async def start_download(request: DownloadRequest, background_tasks: BackgroundT
             content={"status": "error", "message": str(e)}
         )
 
-async def download_playlist_task(download_id, playlist_url, download_dir, playlist_name=None):
-    """Background task to download a playlist"""
+async def download_playlist_task(download_id, playlist_url, download_dir, playlist_name=None, options=None):
+    """Download a playlist; runs on a scheduler worker's own event loop"""
     try:
-        # Update status
-        active_downloads[download_id]["status"] = "installing"
-        active_downloads[download_id]["message"] = "Installing spotdl..."
-        
-        # Install spotdl if not already installed
-        logger.info("Installing spotdl...")
-        subprocess.run(['pip', 'install', '--force-reinstall', 'spotdl==4.2.0'], check=True)
-        
-        # Verify spotdl is installed
-        try:
-            version_result = subprocess.run(['spotdl', '--version'], capture_output=True, text=True, check=True)
-            logger.info(f"Spotdl version: {version_result.stdout.strip()}")
-        except Exception as e:
-            logger.error(f"Failed to check spotdl version: {str(e)}")
-            active_downloads[download_id]["status"] = "error"
-            active_downloads[download_id]["message"] = f"Failed to verify spotdl installation: {str(e)}"
+        # Fail fast if the startup check could not find a working spotdl/ffmpeg
+        if not toolchain["ready"]:
+            job_errors.inc(reason="toolchain")
+            jobs.update(download_id, status="error", message=f"Downloader unavailable: {toolchain['error']}")
             return
         
-        # Get playlist information
-        active_downloads[download_id]["status"] = "analyzing"
-        active_downloads[download_id]["message"] = "Analyzing playlist..."
-        
+        # The job was claimed as "analyzing"; a rerun keeps the tracks that finished
+        # and retries the rest, whose failures may not map back to a track name
+        jobs.forget_tracks(download_id, "failed", "not_found")
         try:
-            # Get playlist info
-            info_result = subprocess.run(
-                ['spotdl', playlist_url, '--list-only'], 
-                capture_output=True, 
-                text=True
-            )
-            
-            if "not found" in info_result.stdout.lower() or "error" in info_result.stdout.lower():
-                active_downloads[download_id]["status"] = "error"
-                active_downloads[download_id]["message"] = f"Invalid playlist URL or playlist not found"
+            options = {"format": "mp3", "bitrate": None, **(options or {})}
+            report = JobReporter(download_id, playlist_name)
+            if toolchain["engine"] == "library":
+                succeeded = await download_with_library(download_id, playlist_url, download_dir, report, options)
+            else:
+                succeeded = await download_with_cli(download_id, playlist_url, download_dir, report, options)
+            if not succeeded:
                 return
             
-            # Extract track count and playlist name
-            extract_name = playlist_name
-            track_count = 0
-            
-            for line in info_result.stdout.split('\n'):
-                if "Found" in line and "songs in" in line:
-                    parts = line.split("Found")
-                    if len(parts) > 1:
-                        count_parts = parts[1].split("songs")
-                        if count_parts and count_parts[0].strip().isdigit():
-                            track_count = int(count_parts[0].strip())
-                    
-                    if not extract_name and "songs in" in line:
-                        name_parts = line.split("songs in")
-                        if len(name_parts) > 1:
-                            extract_name = name_parts[1].strip().replace("(Playlist)", "").strip()
-                    break
+            # Tracks were appended as they landed, only the central directory is left
+            jobs.transition(download_id, RUNNING_STATUSES, status="packaging", message="Packaging tracks...")
+            notify(download_id)
+            zip_filename = archive_filename(download_id, report.job["playlist_name"])
+            report.finish()
             
-            if extract_name:
-                active_downloads[download_id]["playlist_name"] = extract_name
-            
-            active_downloads[download_id]["total_tracks"] = track_count
-            logger.info(f"Playlist has {track_count} tracks")
-            
-            # Start the actual download
-            active_downloads[download_id]["status"] = "downloading"
-            active_downloads[download_id]["message"] = f"Downloading {track_count} tracks..."
-            
-            # Run spotdl to download the playlist
-            process = subprocess.Popen(
-                ['spotdl', playlist_url, '--output', download_dir],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
+            # Update status, unless the job was requeued away from this worker meanwhile
+            jobs.transition(
+                download_id,
+                RUNNING_STATUSES,
+                status="completed",
+                message="Download completed",
+                progress=1.0,
+                filename=zip_filename
             )
             
-            downloaded_count = 0
-            for line in iter(process.stdout.readline, ''):
-                logger.info(line.strip())
-                if "Downloaded" in line:
-                    downloaded_count += 1
-                    active_downloads[download_id]["downloaded_tracks"] = downloaded_count
-                    if track_count > 0:
-                        progress = min(0.95, downloaded_count / track_count)
-                        active_downloads[download_id]["progress"] = progress
-                        active_downloads[download_id]["message"] = f"Downloaded {downloaded_count}/{track_count} tracks"
-            
-            process.wait()
-            
-            if process.returncode != 0:
-                active_downloads[download_id]["status"] = "error"
-                active_downloads[download_id]["message"] = "Download failed"
-                return
-            
-            # Create a zip file of the downloaded music
-            active_downloads[download_id]["status"] = "packaging"
-            active_downloads[download_id]["message"] = "Packaging files for download..."
-            active_downloads[download_id]["progress"] = 0.95
-            
-            safe_name = active_downloads[download_id]["playlist_name"].replace(" ", "_")
-            zip_filename = f"{safe_name}_{download_id}.zip"
-            zip_path = os.path.join(os.path.dirname(download_dir), zip_filename)
-            
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for root, _, files in os.walk(download_dir):
-                    for file in files:
-                        if file.endswith(('.mp3', '.m4a', '.flac', '.ogg', '.wav')):
-                            file_path = os.path.join(root, file)
-                            zipf.write(file_path, arcname=os.path.basename(file_path))
-            
-            # Update status
-            active_downloads[download_id]["status"] = "completed"
-            active_downloads[download_id]["message"] = "Download completed"
-            active_downloads[download_id]["progress"] = 1.0
-            active_downloads[download_id]["filename"] = zip_filename
-            
         except Exception as e:
             logger.error(f"Error during download: {str(e)}")
-            active_downloads[download_id]["status"] = "error"
-            active_downloads[download_id]["message"] = f"Error during download: {str(e)}"
+            job_errors.inc(reason="exception")
+            jobs.transition(download_id, RUNNING_STATUSES, status="error", message=f"Error during download: {str(e)}")
+        
+        finally:
+            # Keep whatever was packed before a failure readable
+            archive = open_archives.pop(download_id, None)
+            if archive is not None:
+                archive.close()
     
     except Exception as e:
         logger.error(f"Unexpected error in download task: {str(e)}")
-        active_downloads[download_id]["status"] = "error"
-        active_downloads[download_id]["message"] = f"Unexpected error: {str(e)}"
+        job_errors.inc(reason="unexpected")
+        jobs.update(download_id, status="error", message=f"Unexpected error: {str(e)}")
 
 @app.get("/download/{download_id}/status", response_model=DownloadStatusResponse)
 async def check_download_status(download_id: str):
     """Check the status of a download"""
-    if download_id not in active_downloads:
+    job_id, download_info = resolve_job(download_id)
+    if download_info is None:
+        return JSONResponse(
+            status_code=404,
+            content={"status": "error", "message": "Download not found"}
+        )
+    
+    return DownloadStatusResponse(**{**status_payload(job_id, download_info), "download_id": download_id})
+
+async def job_event_stream(download_id):
+    """Yield (kind, data) events for a job until it finishes.
+
+    Starts with a status snapshot; a (None, None) pair marks an interval with
+    nothing new, which callers can use as a keepalive. Coalesced downloads
+    follow their shared job but keep their own id in status events.
+    """
+    job_id = resolve_job(download_id)[0]
+    queue = events.subscribe(job_id)
+    try:
+        # Read the job only after subscribing, so no update falls in between
+        download_info = jobs.get(job_id)
+        if download_info is None:
+            return
+        last_status = {**status_payload(job_id, download_info), "download_id": download_id}
+        yield "status", last_status
+        
+        while last_status["status"] not in FINISHED_STATUSES:
+            try:
+                kind, data = await asyncio.wait_for(queue.get(), EVENT_STORE_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                download_info = jobs.get(job_id)
+                if download_info is None:
+                    return
+                kind, data = "status", status_payload(job_id, download_info)
+                if {**data, "download_id": download_id} == last_status:
+                    yield None, None
+                    continue
+            if kind == "status":
+                data = last_status = {**data, "download_id": download_id}
+            yield kind, data
+    finally:
+        events.unsubscribe(job_id, queue)
+
+@app.get("/download/{download_id}/events")
+async def download_events(download_id: str):
+    """Server-sent events with the job's status and per-track progress, closed once it finishes"""
+    if resolve_job(download_id)[1] is None:
+        return JSONResponse(
+            status_code=404,
+            content={"status": "error", "message": "Download not found"}
+        )
+    
+    async def stream():
+        async for kind, data in job_event_stream(download_id):
+            if kind is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/download/{download_id}/events")
+async def download_events_socket(websocket: WebSocket, download_id: str):
+    """The same events as the SSE stream, as {"event": kind, "data": data} messages"""
+    if resolve_job(download_id)[1] is None:
+        await websocket.close(code=4404)
+        return
+    
+    await websocket.accept()
+    stream = job_event_stream(download_id)
+    try:
+        async for kind, data in stream:
+            await websocket.send_json({"event": kind or "keepalive", "data": data})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Unsubscribes right away instead of whenever the generator is collected
+        await stream.aclose()
+
+@app.post("/download/{download_id}/resume", response_model=DownloadStatusResponse)
+async def resume_download(download_id: str):
+    """Re-run a failed or partly failed job, downloading only the tracks it is missing"""
+    job_id, download_info = resolve_job(download_id)
+    if download_info is None:
         return JSONResponse(
             status_code=404,
             content={"status": "error", "message": "Download not found"}
         )
     
-    download_info = active_downloads[download_id]
+    if download_info["status"] not in FINISHED_STATUSES:
+        return JSONResponse(
+            status_code=409,
+            content={"status": "error", "message": f"Download is {download_info['status']}, only finished downloads can be resumed"}
+        )
+    
+    if download_info["status"] == "completed" and not download_info.get("failed_tracks"):
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "message": "Every track was downloaded, nothing to resume"}
+        )
+    
+    if scheduler.full():
+        return JSONResponse(
+            status_code=429,
+            content={"status": "error", "message": "Download queue is full, please try again later"},
+            headers={"Retry-After": "30"}
+        )
+    
+    if not scheduler.resume(job_id):
+        return JSONResponse(
+            status_code=409,
+            content={"status": "error", "message": "Download was resumed by another request"}
+        )
     
+    logger.info(f"Resuming download {job_id}")
     return DownloadStatusResponse(
-        status=download_info["status"],
-        message=download_info["message"],
-        progress=download_info["progress"],
-        filename=download_info["filename"],
-        download_id=download_id
+        status="queued",
+        message="Download queued to resume. Check status endpoint for updates.",
+        download_id=download_id,
+        queue_position=scheduler.position(job_id)
     )
 
-@app.get("/download/{download_id}/file")
-async def get_download_file(download_id: str):
-    """Get the downloaded zip file"""
-    if download_id not in active_downloads:
+def finished_files(download_id, download_info):
+    """(path, arcname) of the loose files of a stream mode job that spotdl has reported as done"""
+    files = list_audio_files(download_info["download_dir"], AUDIO_EXTENSIONS)
+    if download_info["status"] == "completed":
+        return files
+    # Files that are still being written are left out
+    finished = {
+        normalize_track_name(track)
+        for track, state in jobs.tracks(download_id).items()
+        if state in ("downloaded", "skipped")
+    }
+    return [(file_path, arcname) for file_path, arcname in files if normalize_track_name(Path(arcname).stem) in finished]
+
+def partial_archive_response(download_id, download_info):
+    """Zip of the tracks that have finished so far in a running job"""
+    safe_name = download_info["playlist_name"].replace(" ", "_")
+    headers = {"Content-Disposition": content_disposition(f"{safe_name}_partial.zip")}
+    
+    if download_info["archive_mode"] == "stream":
+        files = finished_files(download_id, download_info)
+        return StreamingResponse(iter_zip_stream(files), media_type='application/zip', headers=headers)
+    
+    archive = open_archives.get(download_id)
+    if archive is None:
+        # The archive only accepts readers in the process that is writing it
+        message = "No tracks have been packaged yet" if download_info.get("owner") in (None, WORKER_ID) else "Download is running on another worker, try again later"
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "message": message}
+        )
+    return StreamingResponse(archive.iter_partial(), media_type='application/zip', headers=headers)
+
+@app.api_route("/download/{download_id}/file", methods=["GET", "HEAD"])
+async def get_download_file(download_id: str, request: Request, partial: bool = False):
+    """Get the downloaded zip file, or with `partial` the tracks finished so far.
+
+    Finished archives honour Range and If-Range, so interrupted downloads resume.
+    """
+    job_id, download_info = resolve_job(download_id)
+    if download_info is None:
         return JSONResponse(
             status_code=404,
             content={"status": "error", "message": "Download not found"}
         )
     
-    download_info = active_downloads[download_id]
+    if partial and download_info["status"] in ("downloading", "packaging"):
+        return partial_archive_response(job_id, download_info)
     
     if download_info["status"] != "completed":
         return JSONResponse(
@@ -285,6 +1312,15 @@ async def get_download_file(download_id: str):
         )
     
     safe_name = download_info["playlist_name"].replace(" ", "_")
+    
+    if download_info["archive_mode"] == "stream":
+        files = list_audio_files(download_info["download_dir"], AUDIO_EXTENSIONS)
+        return StreamingResponse(
+            iter_zip_stream(files),
+            media_type='application/zip',
+            headers={"Content-Disposition": content_disposition(f"{safe_name}.zip")}
+        )
+    
     zip_path = os.path.join(os.path.dirname(download_info["download_dir"]), download_info["filename"])
     
     if not os.path.exists(zip_path):
@@ -293,16 +1329,193 @@ async def get_download_file(download_id: str):
             content={"status": "error", "message": "File not found on server"}
         )
     
-    return FileResponse(
+    return RangeFileResponse(
         zip_path,
+        request.headers,
         media_type='application/zip',
-        filename=f"{safe_name}.zip"
+        content_disposition=content_disposition(f"{safe_name}.zip"),
+        bandwidth=DOWNLOAD_BANDWIDTH_LIMIT
+    )
+
+def track_id(arcname):
+    """Stable, URL-safe id of a track within its job"""
+    return hashlib.sha1(arcname.encode("utf-8")).hexdigest()[:16]
+
+def finished_tracks(download_id, download_info):
+    """Every track of a job whose bytes are complete on disk, in the order they landed.
+
+    Incremental archives store tracks uncompressed, so each one is a byte range
+    of the zip and its CRC-32 comes from the zip entry for free; loose files in
+    stream mode are checksummed once and cached until they change. The CRC-32
+    only checks a transfer; track_digests() identifies tracks.
+    """
+    if download_info["archive_mode"] == "stream":
+        return [
+            {"name": arcname, "path": file_path, "entry": None, "size": os.path.getsize(file_path), "crc32": file_crc32(file_path)}
+            for file_path, arcname in finished_files(download_id, download_info)
+        ]
+    
+    archive = open_archives.get(download_id)
+    if archive is not None:
+        archive_path, entries = archive.path, archive.entries()
+    else:
+        archive_path = download_info.get("archive_path")
+        if not archive_path and download_info["filename"]:
+            archive_path = os.path.join(os.path.dirname(download_info["download_dir"]), download_info["filename"])
+        if not archive_path or not os.path.exists(archive_path):
+            return []
+        # Another worker may still be appending; only entries with complete data are listed
+        entries = read_entries(archive_path)
+    return [
+        {"name": info.filename, "path": archive_path, "entry": info, "size": info.file_size, "crc32": info.CRC}
+        for info in entries
+    ]
+
+def track_digests(tracks):
+    """SHA-256 of each finished track, read once per track and then cached"""
+    return [
+        entry_sha256(track["path"], track["entry"]) if track["entry"] is not None else file_sha256(track["path"])
+        for track in tracks
+    ]
+
+@app.get("/download/{download_id}/tracks")
+async def get_download_tracks(download_id: str):
+    """Manifest of the tracks that can be fetched individually right now.
+
+    `sha256` identifies a track, e.g. to skip one a client already has;
+    `crc32` is only there to check a transfer.
+    """
+    job_id, download_info = resolve_job(download_id)
+    if download_info is None:
+        return JSONResponse(
+            status_code=404,
+            content={"status": "error", "message": "Download not found"}
+        )
+    
+    tracks = await asyncio.to_thread(finished_tracks, job_id, download_info)
+    digests = await asyncio.to_thread(track_digests, tracks)
+    return {
+        "download_id": download_id,
+        "status": download_info["status"],
+        "complete": download_info["status"] == "completed",
+        "total_tracks": download_info.get("total_tracks"),
+        "tracks": [
+            {
+                "id": track_id(track["name"]),
+                "name": track["name"],
+                "size": track["size"],
+                "crc32": f"{track['crc32']:08x}",
+                "sha256": digest,
+                "url": f"/download/{download_id}/tracks/{track_id(track['name'])}"
+            }
+            for track, digest in zip(tracks, digests)
+        ]
+    }
+
+@app.api_route("/download/{download_id}/tracks/{track}", methods=["GET", "HEAD"])
+async def get_download_track(download_id: str, track: str, request: Request):
+    """One finished track, available as soon as it lands; honours Range like /file"""
+    job_id, download_info = resolve_job(download_id)
+    if download_info is None:
+        return JSONResponse(
+            status_code=404,
+            content={"status": "error", "message": "Download not found"}
+        )
+    
+    tracks = await asyncio.to_thread(finished_tracks, job_id, download_info)
+    found = next((item for item in tracks if track_id(item["name"]) == track), None)
+    if found is None:
+        return JSONResponse(
+            status_code=404,
+            content={"status": "error", "message": "Track not found or not finished yet"}
+        )
+    
+    offset = 0
+    if found["entry"] is not None:
+        offset = await asyncio.to_thread(data_offset, found["path"], found["entry"])
+    # The bytes of a finished track never change, even while its archive keeps growing
+    return RangeFileResponse(
+        found["path"],
+        request.headers,
+        media_type=mimetypes.guess_type(found["name"])[0] or "application/octet-stream",
+        content_disposition=content_disposition(os.path.basename(found["name"])),
+        bandwidth=DOWNLOAD_BANDWIDTH_LIMIT,
+        offset=offset,
+        length=found["size"],
+        etag=f'"{found["crc32"]:08x}-{found["size"]:x}"'
     )
 
+def record_finished_job(download_id):
+    """Feed a job that just finished on this worker into the job metrics"""
+    job = jobs.get(download_id)
+    if job is None or job["status"] not in FINISHED_STATUSES:
+        # Requeued away from this worker meanwhile; whoever finishes it records it
+        return
+    jobs_finished.inc(status=job["status"])
+    
+    phase_times = job.get("phase_times") or {}
+    phases = sorted(phase_times.items(), key=lambda item: item[1])
+    for (phase, entered), (_, left) in zip(phases, phases[1:]):
+        job_phase_seconds.observe(left - entered, phase=phase)
+    if QUEUED in phase_times:
+        job_duration_seconds.observe(phase_times[job["status"]] - phase_times[QUEUED], status=job["status"])
+    
+    if job["status"] != "completed":
+        return
+    downloading = phase_times.get("downloading")
+    if downloading and job.get("downloaded_tracks"):
+        finished_at = phase_times.get("packaging", phase_times["completed"])
+        tracks_per_second.observe(job["downloaded_tracks"] / max(finished_at - downloading, 0.001))
+    archive = job["download_dir"] if job["archive_mode"] == "stream" else job.get("archive_path")
+    if archive:
+        archive_size_bytes.observe(path_size(archive))
+
+def collect_metrics():
+    """Refresh the gauges and the totals that other components keep themselves"""
+    queue = scheduler.stats()
+    queue_depth.set(queue["queued"])
+    running_jobs.set(queue["running"])
+    busy_workers.set(queue["running_here"])
+    event_subscribers.set(events.stats()["subscribers"])
+    for kind, count in coalescing.items():
+        coalesced_requests.set(count, kind=kind)
+    
+    cache = track_cache.stats()
+    track_cache_lookups.set(cache["hits"], result="hit")
+    track_cache_lookups.set(cache["misses"], result="miss")
+    track_cache_hit_ratio.set(cache["hit_ratio"])
+    track_cache_bytes.set(cache["bytes"])
+    
+    for endpoint, stats in spotify.metrics()["endpoints"].items():
+        spotify_requests.set(stats["requests"] - stats["errors"] - stats["throttled"], endpoint=endpoint, outcome="ok")
+        spotify_requests.set(stats["errors"], endpoint=endpoint, outcome="error")
+        spotify_requests.set(stats["throttled"], endpoint=endpoint, outcome="throttled")
+    
+    cleanup = janitor.stats()
+    janitor_jobs_removed.set(cleanup["jobs_removed"] + cleanup["orphans_removed"])
+    janitor_bytes_reclaimed.set(cleanup["bytes_reclaimed"])
+    disk_free_ratio.set(cleanup["free_fraction"])
+    toolchain_ready.set(1 if toolchain["ready"] else 0)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics in the text exposition format"""
+    await asyncio.to_thread(collect_metrics)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
     logger.info("Health check requested")
-    return {"status": "healthy"}
+    return {
+        "status": "healthy" if toolchain["ready"] else "degraded",
+        "toolchain": toolchain,
+        "queue": scheduler.stats(),
+        "events": events.stats(),
+        "coalescing": coalescing,
+        "track_cache": track_cache.stats(),
+        "janitor": janitor.stats(),
+        "spotify": spotify.metrics()
+    }
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
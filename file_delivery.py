@@ -0,0 +1,151 @@
+"""Resumable delivery of finished archives.
+
+RangeFileResponse answers single-range `Range` requests with 206 and honours
+`If-Range`, so an interrupted download resumes from the bytes it already has
+instead of starting over; a changed file (different ETag) gets the whole body
+again. When the ASGI server offers the `http.response.zerocopysend` extension
+the kernel copies the file straight to the socket; otherwise chunks are read
+on a worker thread so the event loop never blocks on disk. An optional
+per-connection bandwidth cap paces either path. A response can also cover
+just a window of a file, such as one stored track inside a zip.
+"""
+import asyncio
+import os
+import re
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+from starlette.responses import Response
+
+CHUNK_SIZE = 256 * 1024
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Unix only; elsewhere reads seek the response's own file object
+pread = getattr(os, "pread", None)
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def read_at(file, offset, count):
+    """count bytes of file starting at offset"""
+    if pread is not None:
+        return pread(file.fileno(), count, offset)
+    file.seek(offset)
+    return file.read(count)
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single byte range, None to send everything, or "unsatisfiable"."""
+    match = RANGE_PATTERN.match(header.replace(" ", ""))
+    if not match or match.groups() == ("", ""):
+        # Malformed and multi-range requests get the full body, which RFC 9110 allows
+        return None
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "unsatisfiable"
+    return start, end
+
+
+class RangeFileResponse(Response):
+    """FileResponse with Range, If-Range, ETag and an optional bandwidth cap"""
+
+    def __init__(self, path, request_headers, media_type="application/octet-stream",
+                 content_disposition=None, bandwidth=0, chunk_size=CHUNK_SIZE,
+                 offset=0, length=None, etag=None):
+        """Serve the whole file, or the `length` bytes at `offset` as if they were one file"""
+        self.path = path
+        self.bandwidth = bandwidth
+        # Smaller chunks under a cap keep the pacing smooth instead of bursty
+        self.chunk_size = max(16 * 1024, min(chunk_size, bandwidth // 4)) if bandwidth else chunk_size
+        self.background = None
+
+        stat = os.stat(path)
+        size = stat.st_size - offset if length is None else length
+        etag = etag or file_etag(stat)
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+        self.status_code = 200
+        self.start, self.end = 0, size - 1
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": last_modified,
+            "content-type": media_type
+        }
+        if content_disposition:
+            headers["content-disposition"] = content_disposition
+
+        requested = request_headers.get("range")
+        if etag in [tag.strip() for tag in request_headers.get("if-none-match", "").split(",")]:
+            self.status_code = 304
+        elif requested and self._if_range_matches(request_headers.get("if-range"), etag, stat):
+            byte_range = parse_range(requested, size)
+            if byte_range == "unsatisfiable":
+                self.status_code = 416
+                headers["content-range"] = f"bytes */{size}"
+            elif byte_range is not None:
+                self.status_code = 206
+                self.start, self.end = byte_range
+                headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+
+        self.length = self.end - self.start + 1 if self.status_code in (200, 206) else 0
+        self.start += offset
+        if self.status_code != 304:
+            headers["content-length"] = str(self.length)
+        self.init_headers(headers)
+
+    @staticmethod
+    def _if_range_matches(if_range, etag, stat):
+        """A Range applies only if If-Range names this version of the file, by ETag or exact Last-Modified"""
+        if not if_range:
+            return True
+        if if_range.startswith(('"', 'W/')):
+            # Only strong validators may be used for ranges
+            return if_range == etag
+        try:
+            return int(parsedate_to_datetime(if_range).timestamp()) == int(stat.st_mtime)
+        except (TypeError, ValueError):
+            return False
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.length == 0 or scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        # The zero-copy extension takes a file object and sends from its fileno()
+        with open(self.path, "rb") as file:
+            offset, remaining = self.start, self.length
+            started = time.monotonic()
+            while remaining:
+                count = min(self.chunk_size, remaining)
+                remaining -= count
+                if zerocopy:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": offset,
+                        "count": count,
+                        "more_body": bool(remaining)
+                    })
+                else:
+                    body = await asyncio.to_thread(read_at, file, offset, count)
+                    await send({"type": "http.response.body", "body": body, "more_body": bool(remaining)})
+                offset += count
+
+                if self.bandwidth:
+                    # Sleep off whatever the connection got ahead of its allowance
+                    ahead = (offset - self.start) / self.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
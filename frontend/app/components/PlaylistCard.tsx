@@ -12,9 +12,9 @@ export default function PlaylistCard({ playlist, isDownloading, onDownload }: Pl
       className="bg-slate-800 rounded-xl overflow-hidden shadow-lg transition-all hover:shadow-emerald-400/10 hover:scale-[1.02]"
     >
       <div className="h-48 bg-slate-700 relative">
-        {playlist.images && playlist.images[0] ? (
+        {playlist.image ? (
           <img 
-            src={playlist.images[0].url} 
+            src={playlist.image} 
             alt={`${playlist.name} cover`} 
             className="w-full h-full object-cover"
           />
@@ -29,7 +29,7 @@ export default function PlaylistCard({ playlist, isDownloading, onDownload }: Pl
       <div className="p-5">
         <h3 className="text-xl font-semibold text-white truncate">{playlist.name}</h3>
         <p className="text-slate-400 mt-2 mb-4">
-          {playlist.tracks.total} tracks • By {playlist.owner.display_name}
+          {playlist.tracks} tracks{playlist.owner ? ` • By ${playlist.owner}` : ''}
         </p>
         <button 
           onClick={() => onDownload(playlist.id)}
@@ -7,6 +7,7 @@ import Footer from '../components/Footer';
 import PlaylistCard from '../components/PlaylistCard';
 import DownloadModal from './download-modal';
 import { Playlist } from '../types';
+import { Playlist as SpotifyPlaylistObject } from '../types/index';
 import { useRouter } from 'next/navigation';
 import { useAuth } from '@/app/providers/AuthProvider';
 import { Playlist as PlaylistInterface } from '@/app/interfaces/Playlist';
@@ -19,6 +20,23 @@ declare global {
   }
 }
 
+type SpotifyPlaylist = SpotifyPlaylistObject & { snapshot_id?: string; external_urls?: { spotify: string } };
+
+// Same shape as the backend's /api/playlists records, for playlists fetched from Spotify directly
+function slimPlaylist(item: SpotifyPlaylist): Playlist {
+  const images = item.images || [];
+  const thumbnail = [...images].reverse().find((image) => (image.width ?? 300) >= 300) ?? images[0];
+  return {
+    id: item.id,
+    name: item.name,
+    tracks: item.tracks?.total ?? 0,
+    snapshot_id: item.snapshot_id ?? null,
+    image: thumbnail ? thumbnail.url : null,
+    owner: item.owner?.display_name ?? null,
+    url: item.external_urls?.spotify ?? null,
+  };
+}
+
 export default function Dashboard() {
   const [playlists, setPlaylists] = useState<Playlist[]>([]);
   const [isLoading, setIsLoading] = useState(true);
@@ -77,7 +95,8 @@ export default function Dashboard() {
       }
 
       console.log('Starting direct download process...');
-      console.log('Playlist URL:', playlist.external_urls.spotify);
+      const playlistUrl = playlist.url || `https://open.spotify.com/playlist/${playlist.id}`;
+      console.log('Playlist URL:', playlistUrl);
 
       try {
         // Show initial download status
@@ -94,7 +113,7 @@ export default function Dashboard() {
             'Content-Type': 'application/json',
           },
           body: JSON.stringify({
-            playlist_url: playlist.external_urls.spotify,
+            playlist_url: playlistUrl,
             playlist_name: playlist.name
           })
         });
@@ -109,83 +128,69 @@ export default function Dashboard() {
           throw new Error('Invalid response from server: No download ID');
         }
 
-        // Poll for download status
+        // Follow the download over server-sent events instead of polling
         const downloadId = data.download_id;
-        let isCompleted = false;
-        let attempts = 0;
-        const MAX_ATTEMPTS = 300; // 10 minutes (2s * 300)
+        const events = new EventSource(`https://reed-downloader.onrender.com/download/${downloadId}/events`);
         
-        const pollInterval = setInterval(async () => {
-          try {
-            attempts++;
-            
-            if (attempts >= MAX_ATTEMPTS) {
-              clearInterval(pollInterval);
-              setDownloadStatus({
-                isDownloading: false,
-                message: 'Download timed out. Please try again later.',
-                progress: 0,
-              });
-              return;
-            }
+        events.addEventListener('status', (event) => {
+          const statusData = JSON.parse((event as MessageEvent).data);
+          console.log('Download status:', statusData);
+          
+          // Update the UI with progress
+          setDownloadStatus({
+            isDownloading: true,
+            message: statusData.message || 'Processing...',
+            progress: statusData.progress || 0,
+          });
 
-            const statusResponse = await fetch(`https://reed-downloader.onrender.com/download/${downloadId}/status`);
-            
-            if (!statusResponse.ok) {
-              throw new Error(`Status check failed: ${statusResponse.status}`);
-            }
+          // Check if download is completed
+          if (statusData.status === 'completed' && statusData.filename) {
+            events.close();
             
-            const statusData = await statusResponse.json();
-            console.log('Download status:', statusData);
-            
-            // Update the UI with progress
+            // Show completed message
             setDownloadStatus({
               isDownloading: true,
-              message: statusData.message || 'Processing...',
-              progress: statusData.progress || 0,
+              message: 'Download completed! Starting file download...',
+              progress: 1,
             });
-
-            // Check if download is completed
-            if (statusData.status === 'completed' && statusData.filename) {
-              clearInterval(pollInterval);
-              isCompleted = true;
-              
-              // Show completed message
-              setDownloadStatus({
-                isDownloading: true,
-                message: 'Download completed! Starting file download...',
-                progress: 1,
-              });
-              
-              // Trigger file download
-              window.location.href = `https://reed-downloader.onrender.com/download/${downloadId}/file`;
-              
-              // Reset status after a delay
-              setTimeout(() => {
-                setDownloadStatus({
-                  isDownloading: false,
-                  message: '',
-                  progress: 0,
-                });
-              }, 3000);
-            }
             
-            // Check for errors
-            if (statusData.status === 'error') {
-              clearInterval(pollInterval);
-              throw new Error(`Download error: ${statusData.message}`);
-            }
+            // Trigger file download
+            window.location.href = `https://reed-downloader.onrender.com/download/${downloadId}/file`;
             
-          } catch (error) {
-            clearInterval(pollInterval);
-            console.error('Error checking download status:', error);
+            // Reset status after a delay
+            setTimeout(() => {
+              setDownloadStatus({
+                isDownloading: false,
+                message: '',
+                progress: 0,
+              });
+            }, 3000);
+          }
+          
+          // Check for errors
+          if (statusData.status === 'error') {
+            events.close();
+            console.error('Download error:', statusData.message);
+            setDownloadStatus({
+              isDownloading: false,
+              message: `Error: Download error: ${statusData.message}`,
+              progress: 0,
+            });
+          }
+        });
+        
+        // EventSource reconnects by itself after a dropped connection and gets a
+        // fresh status snapshot; it only gives up when the server refuses the stream
+        events.onerror = () => {
+          if (events.readyState === EventSource.CLOSED) {
+            console.error('Lost the download event stream');
             setDownloadStatus({
               isDownloading: false,
-              message: `Error: ${error instanceof Error ? error.message : 'Unknown error'}`,
+              message: 'Error: Lost connection to the download server',
               progress: 0,
             });
           }
-        }, 2000); // Check every 2 seconds
+        };
         
       } catch (error) {
         console.error('Download error:', error);
@@ -235,7 +240,7 @@ export default function Dashboard() {
           
           const data = await playlistsResponse.json();
           console.log('Playlists fetched directly from Spotify API');
-          setPlaylists(data.items);
+          setPlaylists(data.items.filter(Boolean).map(slimPlaylist));
           
           // Clear token from URL for security
           window.history.replaceState({}, document.title, window.location.pathname);
@@ -274,23 +279,33 @@ export default function Dashboard() {
         }
 
         console.log('Authentication successful, fetching playlists...');
-        const playlistsResponse = await fetch('https://reed-gilt.vercel.app/api/playlists', {
-          credentials: 'include',
-        });
-        
-        if (!playlistsResponse.ok) {
-          if (playlistsResponse.status === 401) {
-            console.error('Playlists fetch returned 401 unauthorized');
-            const basePath = process.env.NODE_ENV === 'production' ? '/REED' : '';
-            window.location.href = `${basePath}/login`;
-            return;
+        const loaded: Playlist[] = [];
+        let cursor: string | null = null;
+        do {
+          const query = new URLSearchParams({ limit: '200', fields: 'id,name,tracks,snapshot_id,image,owner,url' });
+          if (cursor) {
+            query.set('cursor', cursor);
           }
-          throw new Error('Failed to load playlists');
-        }
-        
-        const data = await playlistsResponse.json();
-        console.log('Playlists received:', data);
-        setPlaylists(data.playlists);
+          const playlistsResponse = await fetch(`https://reed-gilt.vercel.app/api/playlists?${query}`, {
+            credentials: 'include',
+          });
+          
+          if (!playlistsResponse.ok) {
+            if (playlistsResponse.status === 401) {
+              console.error('Playlists fetch returned 401 unauthorized');
+              const basePath = process.env.NODE_ENV === 'production' ? '/REED' : '';
+              window.location.href = `${basePath}/login`;
+              return;
+            }
+            throw new Error('Failed to load playlists');
+          }
+          
+          const data = await playlistsResponse.json();
+          loaded.push(...data.playlists);
+          cursor = data.next_cursor;
+        } while (cursor);
+        console.log('Playlists received:', loaded.length);
+        setPlaylists(loaded);
       } catch (err) {
         console.error('Error in fetchPlaylists:', err);
         setError(err instanceof Error ? err.message : 'An unknown error occurred');
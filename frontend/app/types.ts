@@ -1,17 +1,10 @@
+// Slim playlist record served by /api/playlists
 export interface Playlist {
   id: string;
   name: string;
-  description: string;
-  images: { url: string; height: number | null; width: number | null }[];
-  tracks: {
-    total: number;
-    href: string;
-  };
-  external_urls: {
-    spotify: string;
-  };
-  owner: {
-    display_name: string;
-    id: string;
-  };
-} 
\ No newline at end of file
+  tracks: number;
+  snapshot_id: string | null;
+  image: string | null;
+  owner: string | null;
+  url: string | null;
+}
@@ -0,0 +1,65 @@
+"""In-process pub/sub for job progress.
+
+Download workers run on their own threads and event loops, while SSE and
+WebSocket handlers wait on the API's loop. publish() can be called from any
+thread; each subscriber gets the event on its own loop through
+call_soon_threadsafe, so a slow client never blocks a download worker.
+"""
+import asyncio
+import threading
+
+
+class JobEvents:
+    """Fan out (kind, data) events for a job to every subscribed client"""
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, job_id):
+        """Queue receiving the job's events on the calling event loop"""
+        queue = asyncio.Queue(self.max_pending)
+        with self.lock:
+            self.subscribers.setdefault(job_id, []).append((queue, asyncio.get_running_loop()))
+        return queue
+
+    def unsubscribe(self, job_id, queue):
+        with self.lock:
+            remaining = [subscriber for subscriber in self.subscribers.get(job_id, []) if subscriber[0] is not queue]
+            if remaining:
+                self.subscribers[job_id] = remaining
+            else:
+                self.subscribers.pop(job_id, None)
+
+    def has_subscribers(self, job_id):
+        with self.lock:
+            return job_id in self.subscribers
+
+    def topics(self):
+        with self.lock:
+            return list(self.subscribers)
+
+    def publish(self, job_id, kind, data):
+        with self.lock:
+            subscribers = list(self.subscribers.get(job_id, []))
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_deliver, queue, (kind, data))
+            except RuntimeError:
+                # The client's loop has shut down, it will unsubscribe on its way out
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "jobs": len(self.subscribers),
+                "subscribers": sum(len(subscribers) for subscribers in self.subscribers.values())
+            }
+
+
+def _deliver(queue, event):
+    # A client that stops reading loses its oldest events rather than stalling the rest
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
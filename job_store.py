@@ -0,0 +1,364 @@
+"""Job state backends for the downloader.
+
+Every job is a flat dict of JSON-friendly fields plus a separate map of
+per-track states. MemoryJobStore keeps them in this process, which is all a
+single uvicorn worker needs. SQLiteJobStore keeps them in a WAL-mode SQLite
+file so several workers can share one FIFO queue and jobs survive restarts.
+
+Every status change is stamped into the job's `phase_times`, a map of
+status to when the job last entered it, so time spent in each phase can be
+read back; going back to the queue starts a fresh set.
+
+A job may carry a lookup `key` (the downloader uses playlist plus format)
+so that find() can locate the newest job doing the same work.
+
+Queued jobs are claimed with claim_next(), which atomically moves the oldest
+one to "analyzing" and stamps it with the claiming worker's id. Running jobs
+are kept alive with heartbeat(); requeue_stale() hands jobs whose worker
+stopped heartbeating back to the queue.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+QUEUED = "queued"
+RUNNING_STATUSES = ("analyzing", "downloading", "packaging")
+FINISHED_STATUSES = ("completed", "error")
+
+
+def _with_phase_time(job, fields, now):
+    """fields, plus updated phase_times if they change the job's status"""
+    status = fields.get("status")
+    if status is None or status == job.get("status"):
+        return fields
+    phase_times = {} if status == QUEUED else dict(job.get("phase_times") or {})
+    phase_times[status] = now
+    return {**fields, "phase_times": phase_times}
+
+
+class MemoryJobStore:
+    """Process-local job store"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.track_states = {}
+        self.lock = threading.Lock()
+
+    def create(self, job_id, **fields):
+        now = time.time()
+        with self.lock:
+            self.jobs[job_id] = {
+                **_with_phase_time({}, fields, now), "id": job_id, "owner": None, "created_at": now, "updated_at": now
+            }
+            self.track_states[job_id] = {}
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            now = time.time()
+            job.update(_with_phase_time(job, fields, now), updated_at=now)
+            return True
+
+    def transition(self, job_id, from_statuses, **fields):
+        """Apply fields only if the job's status is one of from_statuses"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] not in from_statuses:
+                return False
+            now = time.time()
+            job.update(_with_phase_time(job, fields, now), updated_at=now)
+            return True
+
+    def delete(self, job_id):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+            self.track_states.pop(job_id, None)
+
+    def claim_next(self, owner):
+        """Move the oldest queued job to "analyzing" for owner and return it"""
+        with self.lock:
+            queued = [job for job in self.jobs.values() if job["status"] == QUEUED]
+            if not queued:
+                return None
+            job = min(queued, key=lambda job: job["created_at"])
+            now = time.time()
+            fields = {"status": "analyzing", "message": "Analyzing playlist...", "owner": owner}
+            job.update(_with_phase_time(job, fields, now), updated_at=now)
+            return dict(job)
+
+    def queue_position(self, job_id):
+        """1-based FIFO position of a queued job, or None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                return None
+            return 1 + sum(
+                1 for other in self.jobs.values()
+                if other["status"] == QUEUED and other["created_at"] < job["created_at"]
+            )
+
+    def count(self, *statuses):
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job["status"] in statuses)
+
+    def list(self, *statuses):
+        with self.lock:
+            return [dict(job) for job in self.jobs.values() if not statuses or job["status"] in statuses]
+
+    def find(self, key, *statuses):
+        """Newest job with the given key and one of statuses, or None"""
+        with self.lock:
+            matches = [job for job in self.jobs.values() if job.get("key") == key and job["status"] in statuses]
+            return dict(max(matches, key=lambda job: job["created_at"])) if matches else None
+
+    def heartbeat(self, owner):
+        now = time.time()
+        with self.lock:
+            for job in self.jobs.values():
+                if job["owner"] == owner and job["status"] in RUNNING_STATUSES:
+                    job["updated_at"] = now
+
+    def requeue_stale(self, older_than):
+        """Return running jobs not updated since older_than to the queue"""
+        with self.lock:
+            stale = [
+                job for job in self.jobs.values()
+                if job["status"] in RUNNING_STATUSES and job["updated_at"] < older_than
+            ]
+            for job in stale:
+                fields = {"status": QUEUED, "message": "Requeued after the worker stopped responding", "owner": None}
+                job.update(_with_phase_time(job, fields, time.time()))
+            return [job["id"] for job in stale]
+
+    def set_track(self, job_id, track, state):
+        with self.lock:
+            self.track_states.setdefault(job_id, {})[track] = state
+
+    def tracks(self, job_id):
+        with self.lock:
+            return dict(self.track_states.get(job_id, {}))
+
+    def forget_tracks(self, job_id, *states):
+        """Drop the tracks of a job that are in any of states"""
+        with self.lock:
+            tracks = self.track_states.get(job_id, {})
+            for track in [track for track, state in tracks.items() if state in states]:
+                del tracks[track]
+
+
+class SQLiteJobStore:
+    """Job store in a WAL-mode SQLite database shared by every worker process"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+        connection = self._connection().connection
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                owner TEXT,
+                key TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+            CREATE INDEX IF NOT EXISTS jobs_key_created ON jobs (key, created_at);
+            CREATE TABLE IF NOT EXISTS job_tracks (
+                job_id TEXT NOT NULL,
+                track TEXT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (job_id, track)
+            );
+        """)
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return _Transaction(connection)
+
+    @staticmethod
+    def _row_to_job(row):
+        job = json.loads(row["data"])
+        job.update(
+            id=row["id"],
+            status=row["status"],
+            owner=row["owner"],
+            key=row["key"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"]
+        )
+        return job
+
+    def _write(self, connection, job):
+        columns = ("id", "status", "owner", "key", "created_at", "updated_at")
+        data = {field: value for field, value in job.items() if field not in columns}
+        connection.execute(
+            "INSERT OR REPLACE INTO jobs (id, status, owner, key, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job["id"], job["status"], job.get("owner"), job.get("key"), job["created_at"], job["updated_at"], json.dumps(data))
+        )
+
+    def create(self, job_id, **fields):
+        now = time.time()
+        with self._connection() as connection:
+            self._write(connection, {
+                **_with_phase_time({}, fields, now), "id": job_id, "owner": None, "created_at": now, "updated_at": now
+            })
+
+    def get(self, job_id):
+        row = self._connection().connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def _modify(self, job_id, from_statuses, fields):
+        with self._connection() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or (from_statuses is not None and row["status"] not in from_statuses):
+                return False
+            job = self._row_to_job(row)
+            now = time.time()
+            job.update(_with_phase_time(job, fields, now), updated_at=now)
+            self._write(connection, job)
+            return True
+
+    def update(self, job_id, **fields):
+        return self._modify(job_id, None, fields)
+
+    def transition(self, job_id, from_statuses, **fields):
+        """Apply fields only if the job's status is one of from_statuses"""
+        return self._modify(job_id, from_statuses, fields)
+
+    def delete(self, job_id):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            connection.execute("DELETE FROM job_tracks WHERE job_id = ?", (job_id,))
+
+    def claim_next(self, owner):
+        """Move the oldest queued job to "analyzing" for owner and return it"""
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            job = self._row_to_job(row)
+            now = time.time()
+            fields = {"status": "analyzing", "message": "Analyzing playlist...", "owner": owner}
+            job.update(_with_phase_time(job, fields, now), updated_at=now)
+            self._write(connection, job)
+            return job
+
+    def queue_position(self, job_id):
+        """1-based FIFO position of a queued job, or None"""
+        connection = self._connection().connection
+        row = connection.execute("SELECT status, created_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["status"] != QUEUED:
+            return None
+        return 1 + connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, row["created_at"])
+        ).fetchone()[0]
+
+    def count(self, *statuses):
+        placeholders = ", ".join("?" for _ in statuses)
+        return self._connection().connection.execute(
+            f"SELECT COUNT(*) FROM jobs WHERE status IN ({placeholders})", statuses
+        ).fetchone()[0]
+
+    def list(self, *statuses):
+        connection = self._connection().connection
+        if statuses:
+            placeholders = ", ".join("?" for _ in statuses)
+            rows = connection.execute(f"SELECT * FROM jobs WHERE status IN ({placeholders})", statuses)
+        else:
+            rows = connection.execute("SELECT * FROM jobs")
+        return [self._row_to_job(row) for row in rows]
+
+    def find(self, key, *statuses):
+        """Newest job with the given key and one of statuses, or None"""
+        placeholders = ", ".join("?" for _ in statuses)
+        row = self._connection().connection.execute(
+            f"SELECT * FROM jobs WHERE key = ? AND status IN ({placeholders}) ORDER BY created_at DESC LIMIT 1",
+            (key, *statuses)
+        ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def heartbeat(self, owner):
+        placeholders = ", ".join("?" for _ in RUNNING_STATUSES)
+        with self._connection() as connection:
+            connection.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE owner = ? AND status IN ({placeholders})",
+                (time.time(), owner, *RUNNING_STATUSES)
+            )
+
+    def requeue_stale(self, older_than):
+        """Return running jobs not updated since older_than to the queue"""
+        placeholders = ", ".join("?" for _ in RUNNING_STATUSES)
+        with self._connection() as connection:
+            rows = connection.execute(
+                f"SELECT * FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+                (*RUNNING_STATUSES, older_than)
+            ).fetchall()
+            for row in rows:
+                job = self._row_to_job(row)
+                fields = {"status": QUEUED, "message": "Requeued after the worker stopped responding", "owner": None}
+                job.update(_with_phase_time(job, fields, time.time()))
+                self._write(connection, job)
+            return [row["id"] for row in rows]
+
+    def set_track(self, job_id, track, state):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO job_tracks (job_id, track, state) VALUES (?, ?, ?)",
+                (job_id, track, state)
+            )
+
+    def tracks(self, job_id):
+        rows = self._connection().connection.execute(
+            "SELECT track, state FROM job_tracks WHERE job_id = ?", (job_id,)
+        )
+        return {row["track"]: row["state"] for row in rows}
+
+    def forget_tracks(self, job_id, *states):
+        """Drop the tracks of a job that are in any of states"""
+        placeholders = ", ".join("?" for _ in states)
+        with self._connection() as connection:
+            connection.execute(
+                f"DELETE FROM job_tracks WHERE job_id = ? AND state IN ({placeholders})", (job_id, *states)
+            )
+
+
+class _Transaction:
+    """`BEGIN IMMEDIATE ... COMMIT` around a block, so read-modify-write is atomic across processes"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def create_job_store(backend, path=None):
+    """Build the store named by JOB_STORE ("memory" or "sqlite")"""
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore(path)
+    raise ValueError(f"Unknown job store backend '{backend}'")
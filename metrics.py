@@ -0,0 +1,142 @@
+"""Prometheus metrics for the downloader, rendered without a client library.
+
+Counters, gauges and histograms are kept in this process and written out in
+the text exposition format by /metrics. With several uvicorn workers every
+process reports its own counters, so scrape each one and sum across
+instances in queries; gauges filled from the shared job store at scrape
+time, such as the queue depth, read the same from any process.
+"""
+import math
+import threading
+
+# Seconds, spanning quick cache hits to hour-long playlists
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+SIZE_BUCKETS = tuple(1024 ** 2 * size for size in (1, 10, 50, 100, 250, 500, 1024, 2048, 4096))
+RATE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 25)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        if not self.labels and self.kind in ("counter", "gauge"):
+            # Exported as 0 from the start, so rates work before the first event
+            self.values[()] = 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) for every series"""
+        with self.lock:
+            return [("", key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Mirror a running total that is kept elsewhere"""
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=DURATION_BUCKETS, labels=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, series in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    samples.append(("_bucket", key, (("le", _format_value(bound)),), cumulative))
+                samples.append(("_sum", key, (), series["sum"]))
+                samples.append(("_count", key, (), series["count"]))
+        return samples
+
+
+class Registry:
+    """The metrics one process exposes, in the order they were declared"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, buckets=DURATION_BUCKETS, labels=()):
+        return self._register(Histogram(name, documentation, buckets, labels))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
@@ -0,0 +1,314 @@
+"""Drive spotdl through its Python API inside long-lived worker processes.
+
+The CLI engine in downloader.py starts two spotdl processes per job and
+resolves the playlist twice. A LibraryEngine keeps one process alive with
+an initialised `Spotdl` instance, so the Spotify/YouTube clients stay warm
+across jobs and each playlist is resolved exactly once.
+"""
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from track_cache import TrackCache, track_key
+
+logger = logging.getLogger(__name__)
+
+
+class EngineError(Exception):
+    """Raised when the worker process fails or dies mid-job"""
+
+
+class TrackPipeline:
+    """Per-track download pipeline with independently sized fetch and transcode pools.
+
+    `fetch(item)` does the network work and `transcode(item, fetched)` the CPU
+    work. A stage that raises is retried with exponential backoff, except for
+    LookupError, which means there is nothing to retry. `on_result(item, event,
+    detail)` is called from the pool threads as each track finishes.
+    """
+
+    def __init__(self, fetch, transcode, fetch_workers=4, transcode_workers=2, retries=2, backoff=1.0):
+        self.fetch = fetch
+        self.transcode = transcode
+        self.fetch_workers = max(1, fetch_workers)
+        self.transcode_workers = max(1, transcode_workers)
+        self.retries = retries
+        self.backoff = backoff
+
+    def _attempt(self, name, stage, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return stage(*args)
+            except LookupError:
+                raise
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"{name} failed ({e.__class__.__name__}: {str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def run(self, items, on_result):
+        """Push every item through both stages and block until all have finished"""
+        remaining = len(items)
+        finished = threading.Event()
+        lock = threading.Lock()
+        if not remaining:
+            return
+
+        def report(item, event, detail):
+            nonlocal remaining
+            try:
+                on_result(item, event, detail)
+            finally:
+                with lock:
+                    remaining -= 1
+                    if remaining == 0:
+                        finished.set()
+
+        def convert(item, fetched):
+            try:
+                report(item, "downloaded", self._attempt("transcode", self.transcode, item, fetched))
+            except Exception as e:
+                report(item, "failed", e.__class__.__name__)
+
+        def download(item):
+            try:
+                fetched = self._attempt("fetch", self.fetch, item)
+            except LookupError:
+                report(item, "lookup_error", None)
+                return
+            except Exception as e:
+                report(item, "failed", e.__class__.__name__)
+                return
+            if fetched is None:
+                report(item, "skipped", None)
+                return
+            transcoders.submit(convert, item, fetched)
+
+        with ThreadPoolExecutor(self.transcode_workers, thread_name_prefix="transcode") as transcoders:
+            with ThreadPoolExecutor(self.fetch_workers, thread_name_prefix="fetch") as fetchers:
+                for item in items:
+                    fetchers.submit(download, item)
+            finished.wait()
+
+
+class LibraryEngine:
+    """Owns one spotdl worker process and feeds it one job at a time"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.process = None
+        self.connection = None
+
+    def _ensure_started(self):
+        if self.process is not None and self.process.is_alive():
+            return
+        # spawn keeps the worker independent of the API's threads and event loops
+        context = multiprocessing.get_context("spawn")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_connection, self.settings),
+            name="spotdl-engine",
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        logger.info(f"Started spotdl engine process {self.process.pid}")
+
+    def run(self, playlist_url, output_dir, on_event, options=None):
+        """Download a playlist, calling on_event(event, track, detail) as tracks finish.
+
+        `options` may set the job's audio "format" and "bitrate". Blocks until
+        the job is done and returns the worker's summary dict.
+        """
+        self._ensure_started()
+        self.connection.send(("download", playlist_url, output_dir, options or {}))
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError) as e:
+                self.close()
+                raise EngineError(f"spotdl engine process exited: {str(e)}")
+
+            kind = message[0]
+            if kind == "event":
+                on_event(*message[1:])
+            elif kind == "done":
+                return message[1]
+            elif kind == "error":
+                raise EngineError(message[1])
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.send(("stop",))
+            except (OSError, ValueError):
+                pass
+            self.connection.close()
+            self.connection = None
+        if self.process is not None:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+            self.process = None
+
+
+def _worker_main(connection, settings):
+    """Entry point of the engine process: build spotdl once, then serve jobs"""
+    logging.basicConfig(level=settings.get("log_level", logging.INFO))
+    logging.getLogger("spotdl").setLevel(logging.WARNING)
+
+    from spotdl import Spotdl
+    from spotdl.utils.config import SPOTIFY_OPTIONS
+
+    spotdl = Spotdl(
+        client_id=settings.get("client_id") or SPOTIFY_OPTIONS["client_id"],
+        client_secret=settings.get("client_secret") or SPOTIFY_OPTIONS["client_secret"],
+        downloader_settings={
+            "ffmpeg": settings.get("ffmpeg") or "ffmpeg",
+            "threads": settings.get("threads", 4),
+            "simple_tui": True
+        }
+    )
+    cache = TrackCache(settings["cache_dir"], settings.get("cache_max_bytes", 0)) if settings.get("cache_dir") else None
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message[0] == "stop":
+            return
+
+        _, playlist_url, output_dir, options = message
+        try:
+            summary = _download(spotdl, cache, playlist_url, output_dir, options, connection, settings)
+            connection.send(("done", summary))
+        except Exception as e:
+            connection.send(("error", f"{e.__class__.__name__}: {str(e)}"))
+
+
+def _download(spotdl, cache, playlist_url, output_dir, options, connection, settings):
+    """Resolve the playlist once and run its songs through the track pipeline"""
+    downloader = spotdl.downloader
+    # The engine serves one job at a time, so output settings can be swapped per job
+    downloader.settings["output"] = os.path.join(output_dir, "{artists} - {title}.{output-ext}")
+    downloader.settings["format"] = options.get("format") or "mp3"
+    downloader.settings["bitrate"] = options.get("bitrate")
+    hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+
+    songs = spotdl.search([playlist_url])
+    playlist_name = next((song.list_name for song in songs if song.list_name), None)
+    connection.send(("event", "found", playlist_name, len(songs)))
+
+    summary = {}
+    send_lock = threading.Lock()
+
+    def on_result(song, event, detail):
+        with send_lock:
+            summary[event] = summary.get(event, 0) + 1
+            connection.send(("event", event, song.display_name, detail))
+
+    pipeline = TrackPipeline(
+        fetch=lambda song: _fetch_song(downloader, cache, song),
+        transcode=lambda song, fetched: _transcode_song(downloader, cache, song, fetched),
+        fetch_workers=settings.get("fetch_workers", downloader.settings["threads"]),
+        transcode_workers=settings.get("transcode_workers", os.cpu_count() or 1),
+        retries=settings.get("retries", 2),
+        backoff=settings.get("retry_backoff", 1.0)
+    )
+    pipeline.run(songs, on_result)
+    if cache:
+        summary["cache_hits"] = cache.hits - hits
+        summary["cache_misses"] = cache.misses - misses
+    return summary
+
+
+def _output_file(downloader, song):
+    from spotdl.utils.formatter import create_file_name
+
+    return create_file_name(
+        song=song,
+        template=downloader.settings["output"],
+        file_extension=downloader.settings["format"],
+        restrict=downloader.settings["restrict"],
+        file_name_length=downloader.settings["max_filename_length"],
+    )
+
+
+def _cache_key(downloader, song):
+    return track_key(song.song_id, downloader.settings["format"], downloader.settings["bitrate"])
+
+
+def _fetch_song(downloader, cache, song):
+    """Network stage: find the audio source and download it to spotdl's temp folder.
+
+    Returns None when the song is already on disk and links it in from the
+    track cache instead of downloading when another job already fetched it.
+    """
+    from spotdl.providers.audio import AudioProvider
+    from spotdl.utils.config import get_temp_path
+
+    output_file = _output_file(downloader, song)
+    if output_file.exists() and downloader.settings["overwrite"] == "skip":
+        return None
+    if cache and song.song_id and cache.materialize(_cache_key(downloader, song), downloader.settings["format"], output_file):
+        return "cached", output_file
+
+    download_url = song.download_url or downloader.search(song)
+    try:
+        song.lyrics = downloader.search_lyrics(song)
+    except Exception as e:
+        logger.debug(f"Could not search for lyrics: {str(e)}")
+
+    audio_provider = AudioProvider(
+        output_format=downloader.settings["format"],
+        cookie_file=downloader.settings["cookie_file"],
+        search_query=downloader.settings["search_query"],
+        filter_results=downloader.settings["filter_results"],
+        yt_dlp_args=downloader.settings["yt_dlp_args"],
+    )
+    download_info = audio_provider.get_download_metadata(download_url, download=True)
+    return "downloaded", get_temp_path() / f"{download_info['id']}.{download_info['ext']}", download_info
+
+
+def _transcode_song(downloader, cache, song, fetched):
+    """CPU stage: convert the fetched audio with ffmpeg, embed metadata and cache it"""
+    from spotdl.utils.ffmpeg import FFmpegError, convert
+    from spotdl.utils.metadata import embed_metadata
+
+    if fetched[0] == "cached":
+        return str(fetched[1])
+
+    _, temp_file, download_info = fetched
+    output_file = _output_file(downloader, song)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    bitrate = downloader.settings["bitrate"]
+    if bitrate in ("auto", None):
+        bitrate = f"{int(download_info['abr'])}k" if download_info.get("abr") else "copy"
+    elif bitrate == "disable":
+        bitrate = None
+
+    success, result = convert(
+        input_file=temp_file,
+        output_file=output_file,
+        ffmpeg=downloader.ffmpeg,
+        output_format=downloader.settings["format"],
+        bitrate=bitrate,
+        ffmpeg_args=downloader.settings["ffmpeg_args"],
+    )
+    if not success:
+        raise FFmpegError(f"Failed to convert {song.display_name}: {(result or {}).get('error')}")
+
+    temp_file.unlink(missing_ok=True)
+    embed_metadata(output_file=output_file, song=song, skip_album_art=downloader.settings["skip_album_art"])
+    if cache and song.song_id:
+        cache.put(_cache_key(downloader, song), output_file)
+    return str(output_file)
@@ -0,0 +1,133 @@
+"""Shared setup for the downloader tests.
+
+downloader.py reads its configuration from the environment when it is
+imported, so it is imported once here with an offline configuration. Each
+test then gets a scratch downloads folder and a fresh in-memory job store
+by patching the module globals the code under test looks up.
+
+    python -m pytest tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+FAKE_SPOTDL = ROOT / "benchmarks" / "fake_spotdl.py"
+
+os.environ.update({
+    "CLIENT_ID": "",
+    "CLIENT_SECRET": "",
+    "SPOTDL_ENGINE": "cli",
+    "JOB_STORE": "memory",
+    "ARCHIVE_MODE": "incremental",
+    "TRACK_CACHE_MAX_BYTES": "0"
+})
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import downloader  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from job_store import MemoryJobStore  # noqa: E402
+
+# Tracks the fake spotdl writes; small and quick so end to end jobs take a second
+FAKE_SPOTDL_ENV = {
+    "FAKE_SPOTDL_TRACKS": "4",
+    "FAKE_SPOTDL_TRACK_BYTES": "2048",
+    "FAKE_SPOTDL_TRACK_SECONDS": "0.01",
+    "FAKE_SPOTDL_JITTER": "0",
+    "FAKE_SPOTDL_ANALYZE_SECONDS": "0",
+    "FAKE_SPOTDL_THREADS": "2",
+    "FAKE_SPOTDL_FAILURE_RATE": "0",
+    "FAKE_SPOTDL_NOT_FOUND_RATE": "0"
+}
+
+
+def write_file(path, data=b"audio"):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+class ScratchTestCase(unittest.TestCase):
+    """A temporary directory per test, removed afterwards"""
+
+    def setUp(self):
+        super().setUp()
+        self.scratch = Path(tempfile.mkdtemp(prefix="reed-test-"))
+        self.addCleanup(shutil.rmtree, self.scratch, ignore_errors=True)
+
+
+class DownloaderTestCase(ScratchTestCase):
+    """downloader.py wired to a scratch downloads folder, a fresh job store and the fake spotdl"""
+
+    def setUp(self):
+        super().setUp()
+        self.downloads = self.scratch / "downloads"
+        self.downloads.mkdir()
+        self.jobs = MemoryJobStore()
+        self.patch(downloader, "jobs", self.jobs)
+        self.patch(downloader, "download_root", self.downloads)
+        self.patch(downloader, "open_archives", {})
+        self.patch(downloader, "coalescing", {"joined": 0, "reused": 0})
+        self.patch(downloader, "toolchain", {
+            "ready": True,
+            "engine": "cli",
+            "spotdl": str(FAKE_SPOTDL),
+            "spotdl_version": "4.2.11 (fake)",
+            "ffmpeg": None,
+            "error": None,
+            "checked_at": None
+        })
+        self.patch_env(FAKE_SPOTDL_ENV)
+        # Not used as a context manager, so startup never starts workers or the janitor
+        self.client = TestClient(downloader.app)
+
+    def patch(self, target, attribute, value):
+        patcher = mock.patch.object(target, attribute, value)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def patch_env(self, values):
+        patcher = mock.patch.dict(os.environ, values)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_job(self, download_id="job0000001", status="queued", archive_mode="incremental", **fields):
+        """A job as start_download() creates it, with its folder"""
+        download_dir = self.downloads / download_id
+        download_dir.mkdir(exist_ok=True)
+        self.jobs.create(download_id, **{
+            "status": status,
+            "message": "",
+            "progress": 0.0,
+            "filename": None,
+            "playlist_url": f"https://open.spotify.com/playlist/{download_id}",
+            "playlist_name": "Test Playlist",
+            "requested_name": None,
+            "key": downloader.coalesce_key(f"https://open.spotify.com/playlist/{download_id}", "mp3", None),
+            "snapshot_id": None,
+            "sync_of": None,
+            "sync_archive": "full",
+            "options": {"format": "mp3", "bitrate": None},
+            "start_time": 0,
+            "total_tracks": 0,
+            "downloaded_tracks": 0,
+            "download_dir": str(download_dir),
+            "archive_mode": archive_mode,
+            **fields
+        })
+        return self.jobs.get(download_id)
+
+    def run_job(self, download_id):
+        """Claim a queued job and run it to the end on this thread, as a scheduler worker would"""
+        job = self.jobs.claim_next("test-worker")
+        self.assertEqual(job["id"], download_id)
+        downloader.asyncio.run(downloader.download_playlist_task(
+            job["id"], job["playlist_url"], job["download_dir"], job.get("requested_name"), job.get("options")
+        ))
+        return self.jobs.get(download_id)
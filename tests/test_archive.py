@@ -0,0 +1,173 @@
+"""Tests for streamed and incremental ZIP packaging."""
+import hashlib
+import io
+import struct
+import zipfile
+from unittest import mock
+
+from archive import (
+    IncrementalArchive, _recover_entries, content_disposition, entry_sha256, file_crc32, file_sha256, iter_zip_stream,
+    read_entries
+)
+from tests.support import ScratchTestCase, write_file
+
+
+class ZipStreamTests(ScratchTestCase):
+    def test_stream_is_a_valid_stored_zip(self):
+        files = [
+            (write_file(self.scratch / "a.mp3", b"a" * 300_000), "Artist - A.mp3"),
+            (write_file(self.scratch / "b.mp3", b"b" * 10), "Artist - B.mp3")
+        ]
+        chunks = list(iter_zip_stream(files, chunk_size=64 * 1024))
+        self.assertGreater(len(chunks), 2)
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ["Artist - A.mp3", "Artist - B.mp3"])
+            self.assertEqual(archive.read("Artist - A.mp3"), b"a" * 300_000)
+            self.assertEqual({info.compress_type for info in archive.infolist()}, {zipfile.ZIP_STORED})
+
+    def test_empty_stream(self):
+        with zipfile.ZipFile(io.BytesIO(b"".join(iter_zip_stream([])))) as archive:
+            self.assertEqual(archive.namelist(), [])
+
+    def test_content_disposition(self):
+        self.assertEqual(content_disposition("Road_Trip.zip"), 'attachment; filename="Road_Trip.zip"')
+        self.assertEqual(content_disposition("Café.zip"), "attachment; filename*=utf-8''Caf%C3%A9.zip")
+
+
+class IncrementalArchiveTests(ScratchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tracks = [
+            (write_file(self.scratch / "tracks" / f"{index}.mp3", bytes([65 + index]) * (3000 + index)), f"Artist - Song {index}.mp3")
+            for index in range(3)
+        ]
+
+    def crashed_archive(self, complete, torn_bytes=0):
+        """An archive whose writer died after `complete` tracks, partway into the next"""
+        path = self.scratch / "live.zip"
+        archive = IncrementalArchive(path)
+        self.addCleanup(archive.close)
+        for source, arcname in self.tracks[:complete]:
+            archive.add(source, arcname)
+        end = archive.end
+        if torn_bytes:
+            archive.add(*self.tracks[complete])
+        # Copying the flushed bytes is what a killed process leaves on disk
+        crashed = self.scratch / "crashed.zip"
+        crashed.write_bytes(path.read_bytes()[:end + torn_bytes])
+        return crashed
+
+    def test_tracks_are_appended_once(self):
+        path = self.scratch / "playlist.zip"
+        archive = IncrementalArchive(path)
+        self.assertEqual(archive.add(*self.tracks[0]), 3000)
+        self.assertEqual(archive.add(*self.tracks[0]), 0)
+        archive.add(*self.tracks[1])
+        self.assertEqual(archive.names(), ["Artist - Song 0.mp3", "Artist - Song 1.mp3"])
+        self.assertEqual(len(archive), 2)
+        archive.close()
+
+        with zipfile.ZipFile(path) as result:
+            self.assertIsNone(result.testzip())
+            self.assertEqual(result.read("Artist - Song 1.mp3"), b"B" * 3001)
+            self.assertEqual({info.compress_type for info in result.infolist()}, {zipfile.ZIP_STORED})
+
+    def test_partial_zip_of_a_growing_archive(self):
+        archive = IncrementalArchive(self.scratch / "playlist.zip")
+        self.addCleanup(archive.close)
+        archive.add(*self.tracks[0])
+        archive.add(*self.tracks[1])
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(archive.iter_partial(chunk_size=1024)))) as partial:
+            self.assertIsNone(partial.testzip())
+            self.assertEqual(partial.namelist(), ["Artist - Song 0.mp3", "Artist - Song 1.mp3"])
+        # The live archive keeps growing after a reader took its snapshot
+        archive.add(*self.tracks[2])
+        self.assertEqual(len(archive), 3)
+
+    def test_recover_entries_drops_a_torn_track(self):
+        crashed = self.crashed_archive(2, torn_bytes=100)
+        with open(crashed, "rb") as file:
+            entries, end = _recover_entries(file)
+        self.assertEqual([info.filename for info in entries], ["Artist - Song 0.mp3", "Artist - Song 1.mp3"])
+        self.assertEqual([info.file_size for info in entries], [3000, 3001])
+        self.assertEqual(end, crashed.stat().st_size - 100)
+
+    def test_recover_entries_stops_at_corrupt_data(self):
+        crashed = self.crashed_archive(2)
+        data = bytearray(crashed.read_bytes())
+        # Flip a byte inside the second track
+        data[-10] ^= 0xFF
+        crashed.write_bytes(data)
+        with open(crashed, "rb") as file:
+            entries, _ = _recover_entries(file)
+        self.assertEqual([info.filename for info in entries], ["Artist - Song 0.mp3"])
+
+    def test_resume_after_a_crash(self):
+        crashed = self.crashed_archive(2, torn_bytes=100)
+        self.assertFalse(zipfile.is_zipfile(crashed))
+        self.assertEqual([info.filename for info in read_entries(crashed)], ["Artist - Song 0.mp3", "Artist - Song 1.mp3"])
+
+        archive = IncrementalArchive(crashed, resume=True)
+        self.assertEqual(archive.names(), ["Artist - Song 0.mp3", "Artist - Song 1.mp3"])
+        archive.add(*self.tracks[2])
+        archive.close()
+
+        with zipfile.ZipFile(crashed) as result:
+            self.assertIsNone(result.testzip())
+            self.assertEqual(len(result.namelist()), 3)
+            self.assertEqual(result.read("Artist - Song 2.mp3"), b"C" * 3002)
+
+    def test_resume_a_finished_archive(self):
+        path = self.scratch / "playlist.zip"
+        archive = IncrementalArchive(path)
+        archive.add(*self.tracks[0])
+        archive.close()
+
+        archive = IncrementalArchive(path, resume=True)
+        archive.add(*self.tracks[1])
+        archive.close()
+        with zipfile.ZipFile(path) as result:
+            self.assertIsNone(result.testzip())
+            self.assertEqual(len(result.namelist()), 2)
+
+    def test_zip64_archive(self):
+        # Shrinking the limits makes zipfile write the ZIP64 records it uses past 4 GiB
+        with mock.patch.object(zipfile, "ZIP64_LIMIT", 1024), mock.patch.object(zipfile, "ZIP_FILECOUNT_LIMIT", 2):
+            crashed = self.crashed_archive(2, torn_bytes=100)
+            data = crashed.read_bytes()
+            self.assertIn(struct.pack("<HH", 0x0001, 16), data)
+
+            archive = IncrementalArchive(crashed, resume=True)
+            self.assertEqual(archive.names(), ["Artist - Song 0.mp3", "Artist - Song 1.mp3"])
+            archive.add(*self.tracks[2])
+            partial = b"".join(archive.iter_partial())
+            archive.close()
+
+        for result in (zipfile.ZipFile(crashed), zipfile.ZipFile(io.BytesIO(partial))):
+            with result:
+                self.assertIsNone(result.testzip())
+                self.assertEqual([info.file_size for info in result.infolist()], [3000, 3001, 3002])
+        self.assertIn(zipfile.stringEndArchive64, crashed.read_bytes())
+
+
+class ChecksumTests(ScratchTestCase):
+    def test_entry_digest_matches_the_source_file(self):
+        source = write_file(self.scratch / "a.mp3", b"a" * 5000)
+        archive = IncrementalArchive(self.scratch / "playlist.zip")
+        self.addCleanup(archive.close)
+        archive.add(write_file(self.scratch / "b.mp3", b"b" * 10), "Artist - B.mp3")
+        archive.add(source, "Artist - A.mp3")
+
+        entry = archive.entries()[1]
+        self.assertEqual(entry_sha256(archive.path, entry), hashlib.sha256(b"a" * 5000).hexdigest())
+        self.assertEqual(entry_sha256(archive.path, entry), file_sha256(source))
+        self.assertEqual(file_crc32(source), entry.CRC)
+
+    def test_file_digest_follows_changes(self):
+        path = write_file(self.scratch / "a.mp3", b"first")
+        self.assertEqual(file_sha256(path), hashlib.sha256(b"first").hexdigest())
+        write_file(path, b"second version")
+        self.assertEqual(file_sha256(path), hashlib.sha256(b"second version").hexdigest())
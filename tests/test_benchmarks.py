@@ -0,0 +1,95 @@
+"""Tests for the pipeline benchmark and its fake spotdl."""
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import unittest
+
+from benchmarks import download_pipeline
+from tests.support import FAKE_SPOTDL, FAKE_SPOTDL_ENV, ScratchTestCase
+
+
+class SummaryTests(unittest.TestCase):
+    def test_percentiles(self):
+        summary = download_pipeline.percentiles(range(100, 0, -1))
+        self.assertEqual(summary, {"count": 100, "p50": 51, "p90": 91, "p99": 100, "max": 100, "mean": 50.5})
+        self.assertIsNone(download_pipeline.percentiles([]))
+
+    def test_phase_durations(self):
+        jobs = [
+            {"phase_times": {"queued": 0, "analyzing": 2, "downloading": 3, "packaging": 7, "completed": 7.5}},
+            {"phase_times": {"queued": 0, "analyzing": 1, "error": 4}}
+        ]
+        self.assertEqual(download_pipeline.phase_durations(jobs), {
+            "queued": [2, 1], "analyzing": [1, 3], "downloading": [4], "packaging": [0.5]
+        })
+
+    def test_metric_value(self):
+        metrics = "# TYPE reed_archive_bytes_written_total counter\nreed_archive_bytes_written_total 2048\n"
+        self.assertEqual(download_pipeline.metric_value(metrics, "reed_archive_bytes_written_total"), 2048.0)
+        self.assertIsNone(download_pipeline.metric_value(metrics, "reed_archive"))
+
+    def test_compare(self):
+        baseline = {"label": "before", "results": {"jobs_per_second": 2.0, "job_latency": {"p50": 10.0, "p99": 20.0}}}
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            download_pipeline.compare({"jobs_per_second": 3.0, "job_latency": {"p50": 10.05, "p99": 30.0}}, baseline)
+        self.assertEqual(output.getvalue().strip().splitlines(), [
+            "against before:",
+            "  jobs/s                +50.0%  better",
+            "  job latency p50        +0.5%  same",
+            "  job latency p99       +50.0%  worse"
+        ])
+
+
+class FakeSpotdlTests(ScratchTestCase):
+    def spotdl(self, *args, **env):
+        return subprocess.run(
+            [sys.executable, str(FAKE_SPOTDL), *args],
+            env={**os.environ, **FAKE_SPOTDL_ENV, **env}, capture_output=True, text=True, check=True
+        ).stdout.splitlines()
+
+    def test_lists_the_playlist(self):
+        self.assertEqual(self.spotdl("https://open.spotify.com/playlist/abc", "--list-only"), [
+            "Found 4 songs in Benchmark abc (Playlist)",
+            "Bench Artist 0 - Track 0000",
+            "Bench Artist 1 - Track 0001",
+            "Bench Artist 2 - Track 0002",
+            "Bench Artist 3 - Track 0003"
+        ])
+
+    def test_downloads_then_skips_existing_tracks(self):
+        output = str(self.scratch)
+        lines = self.spotdl("https://open.spotify.com/playlist/abc", "--output", output, "--format", "m4a")
+        self.assertEqual(sum(line.startswith("Downloaded") for line in lines), 4)
+        self.assertEqual(sorted(path.stat().st_size for path in self.scratch.glob("*.m4a")), [2048] * 4)
+
+        lines = self.spotdl("https://open.spotify.com/playlist/abc", "--output", output, "--format", "m4a")
+        self.assertEqual(sum(line.startswith("Skipping") for line in lines), 4)
+
+    def test_failures_repeat_per_playlist(self):
+        runs = []
+        for run in range(2):
+            output = self.scratch / f"run{run}"
+            output.mkdir()
+            lines = self.spotdl("https://open.spotify.com/playlist/abc", "--output", str(output), FAKE_SPOTDL_FAILURE_RATE="0.5")
+            runs.append(sorted(line for line in lines if "Error" in line))
+        self.assertTrue(runs[0])
+        self.assertEqual(runs[0], runs[1])
+
+
+class BenchmarkTests(unittest.TestCase):
+    def test_small_run_end_to_end(self):
+        args = argparse.Namespace(
+            jobs=2, workers=2, tracks=3, track_bytes=4096, track_seconds=0.01, jitter=0, analyze_seconds=0,
+            spotdl_threads=2, failure_rate=0, archive_mode="incremental", store="memory", poll_interval=0.05,
+            pollers=1, sample_interval=0.05, keep=False
+        )
+        results = download_pipeline.benchmark(args)
+        self.assertEqual((results["jobs_completed"], results["jobs_failed"]), (2, 0))
+        self.assertEqual(results["job_latency"]["count"], 2)
+        self.assertEqual(results["phases"]["downloading"]["count"], 2)
+        self.assertEqual(results["archive_bytes_written"], 2 * 3 * 4096)
+        self.assertGreater(results["status_latency"]["count"], 0)
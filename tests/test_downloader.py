@@ -0,0 +1,544 @@
+"""Tests for the downloader service: toolchain, jobs and HTTP endpoints."""
+import hashlib
+import io
+import os
+import json
+import threading
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+from tests.support import FAKE_SPOTDL, DownloaderTestCase, downloader, write_file
+
+
+class ToolchainTests(DownloaderTestCase):
+    def check(self, **env):
+        self.patch_env({"SPOTDL_BIN": "", "FFMPEG_BIN": "", **env})
+        with mock.patch.object(downloader, "SPOTDL_ENGINE", "cli"):
+            return downloader.check_toolchain()
+
+    def test_cli_toolchain_is_verified_once(self):
+        ffmpeg = write_file(self.scratch / "ffmpeg")
+        toolchain = self.check(SPOTDL_BIN=str(FAKE_SPOTDL), FFMPEG_BIN=str(ffmpeg))
+        self.assertTrue(toolchain["ready"])
+        self.assertEqual(toolchain["spotdl_version"], "4.2.11 (fake)")
+        self.assertEqual(
+            downloader.spotdl_command("url", "--list-only"),
+            [str(FAKE_SPOTDL), "url", "--list-only", "--ffmpeg", str(ffmpeg)]
+        )
+
+    def test_missing_spotdl(self):
+        toolchain = self.check(SPOTDL_BIN=str(self.scratch / "nowhere"))
+        self.assertFalse(toolchain["ready"])
+        self.assertEqual(toolchain["error"], "spotdl executable not found")
+
+    def test_missing_ffmpeg(self):
+        with mock.patch.object(downloader, "resolve_ffmpeg", return_value=None):
+            toolchain = self.check(SPOTDL_BIN=str(FAKE_SPOTDL))
+        self.assertFalse(toolchain["ready"])
+        self.assertIn("ffmpeg not found", toolchain["error"])
+
+    def test_jobs_fail_fast_without_a_toolchain(self):
+        downloader.toolchain.update(ready=False, error="spotdl executable not found")
+        self.create_job()
+        job = self.run_job("job0000001")
+        self.assertEqual(job["status"], "error")
+        self.assertEqual(job["message"], "Downloader unavailable: spotdl executable not found")
+        self.assertEqual(self.client.get("/health").json()["status"], "degraded")
+
+
+class SchedulerTests(DownloaderTestCase):
+    def submit(self, index):
+        return self.client.post("/download", json={"playlist_url": f"https://open.spotify.com/playlist/queue{index}"})
+
+    def test_jobs_queue_in_order(self):
+        ids = [self.submit(index).json()["download_id"] for index in range(3)]
+        self.assertEqual([downloader.scheduler.position(download_id) for download_id in ids], [1, 2, 3])
+        self.assertEqual(self.jobs.claim_next("test-worker")["id"], ids[0])
+        self.assertEqual(
+            self.client.get(f"/download/{ids[2]}/status").json()["queue_position"], 2
+        )
+
+    def test_full_queue_rejects_new_jobs(self):
+        with mock.patch.object(downloader.scheduler, "max_queued", 2):
+            self.assertEqual(self.submit(0).status_code, 200)
+            self.assertEqual(self.submit(1).status_code, 200)
+            rejected = self.submit(2)
+        self.assertEqual(rejected.status_code, 429)
+        self.assertEqual(rejected.headers["Retry-After"], "30")
+        # The rejected job's folder is not left behind
+        self.assertEqual(len(list(self.downloads.iterdir())), 2)
+
+    def test_stats(self):
+        self.submit(0)
+        self.submit(1)
+        self.jobs.claim_next("test-worker")
+        stats = downloader.scheduler.stats()
+        self.assertEqual((stats["queued"], stats["running"]), (1, 1))
+
+
+class SpotdlOutputTests(DownloaderTestCase):
+    def test_parse_spotdl_lines(self):
+        cases = {
+            "Found 12 songs in Road Trip (Playlist)": ("found", "Road Trip", 12),
+            'Downloaded "Artist - Song": https://music.youtube.com/watch?v=x': ("downloaded", "Artist - Song", None),
+            "Skipping Artist - Song (file already exists) (duplicate)": ("skipped", "Artist - Song", None),
+            "LookupError: No results found for song: Artist - Song": ("lookup_error", "Artist - Song", None),
+            "AudioProviderError: YT-DLP download error": ("failed", "YT-DLP download error", "AudioProviderError"),
+            "Processing query: Artist - Song": None
+        }
+        for line, expected in cases.items():
+            self.assertEqual(downloader.parse_spotdl_line(line), expected, line)
+
+    def test_track_events_update_counters_once(self):
+        state = {"downloaded_tracks": 0, "skipped_tracks": 0, "failed_tracks": 0, "errors": []}
+        tracks = {}
+        self.assertEqual(downloader.record_track_event(state, tracks, "failed", "A", "HTTPError"), "failed")
+        # A retry that succeeds moves the track from failed to downloaded
+        self.assertEqual(downloader.record_track_event(state, tracks, "downloaded", "A", None), "downloaded")
+        # and spotdl skipping it on a rerun keeps it downloaded
+        self.assertIsNone(downloader.record_track_event(state, tracks, "skipped", "A", None))
+        self.assertEqual((state["downloaded_tracks"], state["failed_tracks"]), (1, 0))
+        self.assertEqual(state["errors"], ["HTTPError: A"])
+
+    def test_throttled_logger_counts_suppressed_lines(self):
+        log = downloader.ThrottledLogger(3600)
+        with self.assertLogs(downloader.logger) as captured:
+            for index in range(5):
+                log.log(downloader.logging.INFO, f"line {index}")
+            log.log(downloader.logging.INFO, "last", force=True)
+        self.assertEqual([record.getMessage() for record in captured.records], [
+            "line 0", "last (4 similar lines suppressed)"
+        ])
+
+    def test_cli_job_streams_progress(self):
+        self.create_job(requested_name=None)
+        job = self.run_job("job0000001")
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["playlist_name"], "Benchmark job0000001")
+        self.assertEqual((job["total_tracks"], job["downloaded_tracks"], job["failed_tracks"]), (4, 4, 0))
+        self.assertEqual(job["progress"], 1.0)
+        self.assertEqual(set(self.jobs.tracks("job0000001").values()), {"downloaded"})
+
+    def test_unresolvable_playlist(self):
+        # The fake spotdl crashes with a traceback, as spotdl does on a bad URL
+        self.patch_env({"FAKE_SPOTDL_TRACKS": "not a number"})
+        self.create_job()
+        job = self.run_job("job0000001")
+        self.assertEqual((job["status"], job["message"]), ("error", "Invalid playlist URL or playlist not found"))
+
+
+class LibraryEngineJobTests(DownloaderTestCase):
+    def test_auto_prefers_the_library(self):
+        with mock.patch.object(downloader, "SPOTDL_ENGINE", "auto"), \
+                mock.patch.object(downloader.importlib.util, "find_spec", return_value=object()):
+            self.assertEqual(downloader.resolve_engine(), "library")
+        with mock.patch.object(downloader, "SPOTDL_ENGINE", "auto"), \
+                mock.patch.object(downloader.importlib.util, "find_spec", return_value=None):
+            self.assertEqual(downloader.resolve_engine(), "cli")
+
+    def test_library_job_runs_on_the_worker_engine(self):
+        class Engine:
+            def run(self, playlist_url, output_dir, on_event, options):
+                on_event("found", "Engine Playlist", 1)
+                write_file(f"{output_dir}/Artist - Song.mp3")
+                on_event("downloaded", "Artist - Song", f"{output_dir}/Artist - Song.mp3")
+                return {"downloaded": 1, "cache_hits": 0, "cache_misses": 1}
+
+        downloader.toolchain["engine"] = "library"
+        self.create_job()
+        with mock.patch.object(downloader, "get_library_engine", return_value=Engine()):
+            job = self.run_job("job0000001")
+        self.assertEqual((job["status"], job["playlist_name"], job["downloaded_tracks"]), ("completed", "Engine Playlist", 1))
+
+
+class StreamArchiveTests(DownloaderTestCase):
+    def test_finished_job_is_zipped_on_the_fly(self):
+        self.create_job(archive_mode="stream")
+        job = self.run_job("job0000001")
+        self.assertEqual(job["status"], "completed")
+        # Nothing is packaged on disk, the tracks stay in the job folder
+        self.assertEqual(list(self.downloads.glob("*.zip")), [])
+
+        response = self.client.get("/download/job0000001/file")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-disposition"], 'attachment; filename="Benchmark_job0000001.zip"')
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            self.assertEqual(len(archive.namelist()), 4)
+            self.assertIsNone(archive.testzip())
+
+    def test_unfinished_job_has_no_file(self):
+        self.create_job(archive_mode="stream", status="downloading")
+        self.assertEqual(self.client.get("/download/job0000001/file").status_code, 400)
+        self.assertEqual(self.client.get("/download/unknown/file").status_code, 404)
+
+
+class IncrementalArchiveJobTests(DownloaderTestCase):
+    def test_tracks_are_packed_as_they_finish(self):
+        self.create_job()
+        job = self.run_job("job0000001")
+        self.assertEqual(job["status"], "completed")
+        with zipfile.ZipFile(job["archive_path"]) as archive:
+            self.assertEqual(len(archive.namelist()), 4)
+            self.assertIsNone(archive.testzip())
+        # Packed tracks leave the job folder
+        self.assertEqual(list((self.downloads / "job0000001").glob("*.mp3")), [])
+        self.assertNotIn("job0000001", downloader.open_archives)
+
+        response = self.client.get("/download/job0000001/file")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, open(job["archive_path"], "rb").read())
+
+    def test_partial_download_of_a_running_job(self):
+        self.create_job(status="downloading", playlist_name="Road Trip")
+        self.assertEqual(self.client.get("/download/job0000001/file?partial=true").status_code, 400)
+
+        downloader.open_archives["job0000001"] = archive = downloader.IncrementalArchive(self.scratch / "live.zip")
+        self.addCleanup(archive.close)
+        archive.add(write_file(self.scratch / "a.mp3", b"a" * 100), "Artist - A.mp3")
+        response = self.client.get("/download/job0000001/file?partial=true")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-disposition"], 'attachment; filename="Road_Trip_partial.zip"')
+        with zipfile.ZipFile(io.BytesIO(response.content)) as partial:
+            self.assertEqual(partial.namelist(), ["Artist - A.mp3"])
+
+
+class ResumeTests(DownloaderTestCase):
+    def test_resume_downloads_only_missing_tracks(self):
+        self.patch_env({"FAKE_SPOTDL_FAILURE_RATE": "0.5"})
+        self.create_job()
+        job = self.run_job("job0000001")
+        self.assertEqual(job["status"], "completed")
+        self.assertTrue(0 < job["failed_tracks"] < 4, job)
+        with zipfile.ZipFile(job["archive_path"]) as archive:
+            first_run = {info.filename: info.CRC for info in archive.infolist()}
+
+        self.patch_env({"FAKE_SPOTDL_FAILURE_RATE": "0"})
+        response = self.client.post("/download/job0000001/resume")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["queue_position"], 1)
+        job = self.run_job("job0000001")
+        self.assertEqual((job["status"], job["downloaded_tracks"], job["failed_tracks"], job["resumes"]), ("completed", 4, 0, 1))
+        with zipfile.ZipFile(job["archive_path"]) as archive:
+            self.assertEqual(len(archive.namelist()), 4)
+            # Each fake spotdl run writes different bytes, so tracks from the first run were not fetched again
+            self.assertEqual({name: archive.getinfo(name).CRC for name in first_run}, first_run)
+
+    def test_only_finished_jobs_with_missing_tracks_resume(self):
+        self.create_job("job0000001", status="downloading")
+        self.create_job("job0000002", status="completed", failed_tracks=0)
+        self.assertEqual(self.client.post("/download/job0000001/resume").status_code, 409)
+        self.assertEqual(self.client.post("/download/job0000002/resume").status_code, 400)
+        self.assertEqual(self.client.post("/download/unknown/resume").status_code, 404)
+
+    def test_deleted_job_is_not_resumed(self):
+        self.create_job(status="error")
+        self.assertTrue(downloader.scheduler.resume("job0000001"))
+        self.assertFalse(downloader.scheduler.resume("job0000001"))
+        self.jobs.delete("job0000001")
+        self.assertFalse(downloader.scheduler.resume("job0000001"))
+
+
+class JobEventTests(DownloaderTestCase):
+    def finish_job(self):
+        downloader.events.publish("job0000001", "track", {"track": "Artist - Song", "state": "downloaded"})
+        self.jobs.update("job0000001", status="completed", message="Download completed!", progress=1.0)
+        downloader.notify("job0000001")
+
+    def test_stream_follows_the_job_until_it_finishes(self):
+        self.create_job(status="downloading")
+
+        async def collect():
+            received = []
+            async for kind, data in downloader.job_event_stream("job0000001"):
+                received.append((kind, data))
+                if len(received) == 1:
+                    # Published from a worker thread, as the download workers do
+                    worker = threading.Thread(target=self.finish_job)
+                    worker.start()
+                    worker.join()
+            return received
+
+        received = downloader.asyncio.run(collect())
+        self.assertEqual([(kind, data["status"] if kind == "status" else data) for kind, data in received], [
+            ("status", "downloading"),
+            ("track", {"track": "Artist - Song", "state": "downloaded"}),
+            ("status", "completed")
+        ])
+        self.assertFalse(downloader.events.has_subscribers("job0000001"))
+
+    def test_server_sent_events(self):
+        self.create_job(status="completed", message="Download completed!", progress=1.0)
+        response = self.client.get("/download/job0000001/events")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "text/event-stream; charset=utf-8")
+        kind, data = response.text.strip().split("\n")
+        self.assertEqual(kind, "event: status")
+        self.assertEqual(json.loads(data[len("data: "):])["status"], "completed")
+        self.assertEqual(self.client.get("/download/unknown/events").status_code, 404)
+
+    def test_websocket_events(self):
+        self.create_job(status="error", message="Download failed")
+        with self.client.websocket_connect("/download/job0000001/events") as websocket:
+            message = websocket.receive_json()
+        self.assertEqual((message["event"], message["data"]["status"]), ("status", "error"))
+
+
+class CoalescingTests(DownloaderTestCase):
+    URL = "https://open.spotify.com/playlist/job0000001"
+
+    def post(self, url=URL, **fields):
+        return self.client.post("/download", json={"playlist_url": url, **fields}).json()
+
+    def test_coalesce_key(self):
+        key = downloader.coalesce_key(self.URL, "mp3", None)
+        self.assertEqual(key, "playlist:job0000001|mp3|auto")
+        self.assertEqual(downloader.coalesce_key("https://open.spotify.com/intl-de/playlist/job0000001?si=abc", "mp3", None), key)
+        self.assertNotEqual(downloader.coalesce_key(self.URL, "m4a", None), key)
+        self.assertNotEqual(downloader.coalesce_key(self.URL, "mp3", "320k"), key)
+
+    def test_request_joins_a_running_job(self):
+        self.create_job(status="downloading", progress=0.5)
+        joined = self.post(self.URL + "?si=share")
+        self.assertNotEqual(joined["download_id"], "job0000001")
+        self.assertEqual((joined["status"], joined["progress"]), ("downloading", 0.5))
+        self.assertEqual(self.jobs.get(joined["download_id"])["alias_of"], "job0000001")
+        self.assertEqual(downloader.coalescing, {"joined": 1, "reused": 0})
+
+        # The alias follows the shared job
+        self.jobs.update("job0000001", progress=0.75)
+        status = self.client.get(f"/download/{joined['download_id']}/status").json()
+        self.assertEqual((status["download_id"], status["progress"]), (joined["download_id"], 0.75))
+        # A different format is different work
+        self.assertEqual(self.post(audio_format="m4a")["status"], "queued")
+
+    def test_changed_playlist_is_not_joined(self):
+        self.create_job(status="downloading", snapshot_id="snap1")
+        self.assertIsNotNone(downloader.find_shared_job(downloader.coalesce_key(self.URL, "mp3", None), "snap1"))
+        self.assertIsNone(downloader.find_shared_job(downloader.coalesce_key(self.URL, "mp3", None), "snap2"))
+
+    def test_recent_archive_of_the_same_snapshot_is_reused(self):
+        archive = write_file(self.downloads / "Test_Playlist_job0000001.zip")
+        self.create_job(status="completed", snapshot_id="snap1", archive_path=str(archive), failed_tracks=0)
+        with mock.patch.object(downloader, "playlist_snapshot", return_value="snap1"):
+            reused = self.post()
+        self.assertEqual(reused["status"], "completed")
+        self.assertEqual(self.jobs.get(reused["download_id"])["alias_of"], "job0000001")
+        self.assertEqual(downloader.coalescing, {"joined": 0, "reused": 1})
+
+        # An edited playlist, an unknown snapshot or an expired archive start a fresh job
+        for snapshot_id, reuse_ttl in (("snap2", 3600), (None, 3600), ("snap1", 0)):
+            with mock.patch.object(downloader, "playlist_snapshot", return_value=snapshot_id), \
+                    mock.patch.object(downloader, "ARCHIVE_REUSE_TTL", reuse_ttl):
+                self.assertEqual(self.post()["status"], "queued")
+
+    def test_archive_with_failed_tracks_is_not_reused(self):
+        archive = write_file(self.downloads / "Test_Playlist_job0000001.zip")
+        self.create_job(status="completed", snapshot_id="snap1", archive_path=str(archive), failed_tracks=1)
+        self.assertIsNone(downloader.find_shared_job(downloader.coalesce_key(self.URL, "mp3", None), "snap1"))
+
+
+class SyncTests(DownloaderTestCase):
+    def sync(self, sync_archive):
+        """Download the playlist, add two tracks to it, then sync against the first download"""
+        self.create_job()
+        previous = self.run_job("job0000001")
+        with zipfile.ZipFile(previous["archive_path"]) as archive:
+            known = {info.filename: info.CRC for info in archive.infolist()}
+
+        self.patch_env({"FAKE_SPOTDL_TRACKS": "6"})
+        response = self.client.post("/download", json={
+            "playlist_url": previous["playlist_url"], "sync": True, "sync_archive": sync_archive
+        }).json()
+        self.assertEqual(response["status"], "queued")
+        self.assertEqual(self.jobs.get(response["download_id"])["sync_of"], "job0000001")
+        job = self.run_job(response["download_id"])
+        self.assertEqual(job["status"], "completed")
+        # Known tracks sat in the job folder as placeholders, so spotdl skipped them
+        self.assertEqual((job["downloaded_tracks"], job["skipped_tracks"]), (2, 4))
+        self.assertEqual(list(Path(job["download_dir"]).iterdir()), [])
+        return known, zipfile.ZipFile(job["archive_path"])
+
+    def test_full_sync_copies_known_tracks(self):
+        known, archive = self.sync("full")
+        with archive:
+            self.assertEqual(len(archive.namelist()), 6)
+            self.assertIsNone(archive.testzip())
+            self.assertEqual({name: archive.getinfo(name).CRC for name in known}, known)
+
+    def test_delta_sync_holds_only_new_tracks(self):
+        known, archive = self.sync("delta")
+        with archive:
+            self.assertEqual(len(archive.namelist()), 2)
+            self.assertFalse(set(archive.namelist()) & set(known))
+
+    def test_sync_without_an_earlier_download_fetches_everything(self):
+        response = self.client.post("/download", json={"playlist_url": "https://open.spotify.com/playlist/new", "sync": True}).json()
+        self.assertIsNone(self.jobs.get(response["download_id"])["sync_of"])
+
+
+class JanitorTests(DownloaderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.janitor = downloader.DownloadJanitor(self.downloads, ttl=3600, free_low=0.10, free_high=0.20, interval=60)
+
+    def finished_job(self, download_id, age, **fields):
+        """A completed job with a folder and an archive, last updated `age` seconds ago"""
+        archive = write_file(self.downloads / f"Test_Playlist_{download_id}.zip", b"z" * 1000)
+        self.create_job(download_id, status="completed", archive_path=str(archive), **fields)
+        self.jobs.jobs[download_id]["updated_at"] = downloader.time.time() - age
+        return archive
+
+    def test_expired_jobs_are_removed_with_their_files_and_aliases(self):
+        archive = self.finished_job("job0000001", age=7200)
+        self.finished_job("job0000002", age=60)
+        self.jobs.create("alias00001", status="alias", alias_of="job0000001")
+
+        self.assertEqual(self.janitor.sweep(), (1, 1000))
+        self.assertIsNone(self.jobs.get("job0000001"))
+        self.assertIsNone(self.jobs.get("alias00001"))
+        self.assertFalse(archive.exists())
+        self.assertFalse((self.downloads / "job0000001").exists())
+        self.assertEqual(self.jobs.get("job0000002")["status"], "completed")
+        self.assertEqual(self.janitor.stats()["jobs_removed"], 1)
+
+    def test_low_disk_evicts_the_oldest_jobs_until_the_high_watermark(self):
+        for index, age in enumerate((400, 300, 200, 100)):
+            self.finished_job(f"job000000{index}", age=age)
+        def free_fraction():
+            # Every deleted job frees 6% of the disk, starting from 5% free
+            return 0.05 + 0.06 * (4 - len(self.jobs.list("completed")))
+
+        with mock.patch.object(self.janitor, "free_fraction", side_effect=free_fraction):
+            removed, _ = self.janitor.sweep()
+        self.assertEqual(removed, 3)
+        self.assertEqual([job["id"] for job in self.jobs.list()], ["job0000003"])
+
+    def test_plenty_of_space_keeps_fresh_jobs(self):
+        self.finished_job("job0000001", age=60)
+        with mock.patch.object(self.janitor, "free_fraction", return_value=0.5):
+            self.assertEqual(self.janitor.sweep(), (0, 0))
+
+    def test_jobs_a_running_sync_builds_on_are_kept(self):
+        self.finished_job("job0000001", age=7200)
+        self.create_job("job0000002", status="downloading", sync_of="job0000001")
+        self.assertEqual(self.janitor.sweep(), (0, 0))
+        self.assertEqual(self.jobs.get("job0000001")["status"], "completed")
+
+    def resume_after_listing(self, list_jobs):
+        """jobs.list that lets a resume slip in once the janitor has listed the finished jobs"""
+        def listing(*statuses):
+            found = list_jobs(*statuses)
+            if statuses == downloader.FINISHED_STATUSES:
+                downloader.scheduler.resume("job0000001")
+            return found
+        return listing
+
+    def test_resumed_jobs_are_not_removed(self):
+        self.finished_job("job0000001", age=7200)
+        # A resume requeues the job between the janitor listing it and claiming it
+        with mock.patch.object(self.jobs, "list", side_effect=self.resume_after_listing(self.jobs.list)):
+            self.assertEqual(self.janitor.sweep()[0], 0)
+        self.assertEqual(self.jobs.get("job0000001")["status"], "queued")
+
+    def test_orphans_are_removed_after_a_grace_period(self):
+        self.finished_job("job0000001", age=60)
+        stale = write_file(self.downloads / "gone0000001" / "Artist - Song.mp3").parent
+        partial = write_file(self.downloads / "gone0000002.zip.part")
+        fresh = write_file(self.downloads / "gone0000003" / "Artist - Song.mp3").parent
+        cache = write_file(self.downloads / ".track-cache" / "key-mp3-auto.mp3").parent
+        for path in (stale, partial, cache, self.downloads / "job0000001"):
+            os.utime(path, (0, 0))
+
+        self.assertEqual(self.janitor.remove_orphans()[0], 2)
+        self.assertFalse(stale.exists())
+        self.assertFalse(partial.exists())
+        self.assertTrue(fresh.exists())
+        self.assertTrue(cache.exists())
+        self.assertTrue((self.downloads / "job0000001").exists())
+
+
+class FileDeliveryTests(DownloaderTestCase):
+    def test_interrupted_download_resumes(self):
+        self.create_job()
+        job = self.run_job("job0000001")
+        data = open(job["archive_path"], "rb").read()
+
+        head = self.client.head("/download/job0000001/file")
+        self.assertEqual(head.status_code, 200)
+        self.assertEqual(head.headers["content-length"], str(len(data)))
+        self.assertEqual(head.content, b"")
+
+        rest = self.client.get("/download/job0000001/file", headers={
+            "range": "bytes=100-", "if-range": head.headers["etag"]
+        })
+        self.assertEqual(rest.status_code, 206)
+        self.assertEqual(rest.content, data[100:])
+        self.assertEqual(self.client.head("/download/unknown/file").status_code, 404)
+
+
+class TrackManifestTests(DownloaderTestCase):
+    def manifest(self):
+        response = self.client.get("/download/job0000001/tracks")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_tracks_of_an_incremental_archive(self):
+        self.create_job()
+        job = self.run_job("job0000001")
+        manifest = self.manifest()
+        self.assertEqual((manifest["complete"], manifest["total_tracks"], len(manifest["tracks"])), (True, 4, 4))
+
+        with zipfile.ZipFile(job["archive_path"]) as archive:
+            for track in manifest["tracks"]:
+                data = archive.read(track["name"])
+                self.assertEqual(track["size"], len(data))
+                self.assertEqual(track["sha256"], hashlib.sha256(data).hexdigest())
+                self.assertEqual(track["crc32"], f"{archive.getinfo(track['name']).CRC:08x}")
+
+                response = self.client.get(track["url"])
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, data)
+                self.assertEqual(response.headers["content-type"], "audio/mpeg")
+
+        track = manifest["tracks"][0]
+        head = self.client.head(track["url"])
+        self.assertEqual((head.status_code, head.headers["content-length"], head.content), (200, str(track["size"]), b""))
+        tail = self.client.get(track["url"], headers={"range": "bytes=-10", "if-range": head.headers["etag"]})
+        self.assertEqual(tail.status_code, 206)
+        self.assertEqual(len(tail.content), 10)
+
+    def test_finished_tracks_of_a_streamed_job(self):
+        self.create_job(archive_mode="stream", status="downloading", playlist_name="Road Trip")
+        write_file(self.downloads / "job0000001" / "Artist - Done.mp3", b"done")
+        write_file(self.downloads / "job0000001" / "Artist - Writing.mp3", b"half")
+        self.jobs.set_track("job0000001", "Artist - Done", "downloaded")
+
+        manifest = self.manifest()
+        self.assertFalse(manifest["complete"])
+        self.assertEqual([(track["name"], track["sha256"]) for track in manifest["tracks"]], [
+            ("Artist - Done.mp3", hashlib.sha256(b"done").hexdigest())
+        ])
+        self.assertEqual(self.client.get(manifest["tracks"][0]["url"]).content, b"done")
+        self.assertEqual(self.client.get("/download/job0000001/tracks/unknown").status_code, 404)
+        self.assertEqual(self.client.get("/download/unknown/tracks").status_code, 404)
+
+
+class MetricsTests(DownloaderTestCase):
+    def test_finished_jobs_are_measured(self):
+        self.patch(downloader, "janitor", downloader.DownloadJanitor(self.downloads, 3600, 0.1, 0.2, 60))
+        completed = downloader.jobs_finished.values.get(("completed",), 0)
+        self.create_job()
+        self.run_job("job0000001")
+        downloader.record_finished_job("job0000001")
+        self.assertEqual(downloader.jobs_finished.values[("completed",)], completed + 1)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        body = response.text
+        self.assertIn(f'reed_jobs_finished_total{{status="completed"}} {completed + 1}', body)
+        for phase in ("queued", "analyzing", "downloading", "packaging"):
+            self.assertIn(f'reed_job_phase_seconds_count{{phase="{phase}"}}', body)
+        self.assertIn("reed_queue_depth 0", body)
+        self.assertIn("reed_toolchain_ready 1", body)
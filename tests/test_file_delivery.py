@@ -0,0 +1,136 @@
+"""Tests for ranged, resumable file responses."""
+import asyncio
+import time
+import unittest
+from email.utils import formatdate
+from unittest import mock
+
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import file_delivery
+from file_delivery import RangeFileResponse, parse_range, read_at
+from tests.support import ScratchTestCase, write_file
+
+DATA = bytes(range(256)) * 4
+
+
+class ParseRangeTests(unittest.TestCase):
+    def test_ranges(self):
+        cases = {
+            "bytes=0-99": (0, 99),
+            "bytes=100-": (100, 1023),
+            "bytes=1000-5000": (1000, 1023),
+            "bytes=-24": (1000, 1023),
+            "bytes=-5000": (0, 1023),
+            "bytes = 5 - 9": (5, 9),
+            "bytes=1024-": "unsatisfiable",
+            "bytes=9-5": "unsatisfiable",
+            "bytes=-0": "unsatisfiable",
+            "bytes=-": None,
+            "bytes=0-1,5-9": None,
+            "items=0-9": None
+        }
+        for header, expected in cases.items():
+            self.assertEqual(parse_range(header, 1024), expected, header)
+
+
+class RangeFileResponseTests(ScratchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = write_file(self.scratch / "playlist.zip", DATA)
+        self.options = {"media_type": "application/zip"}
+        self.client = TestClient(Starlette(routes=[Route("/", self.endpoint, methods=["GET", "HEAD"])]))
+
+    async def endpoint(self, request):
+        return RangeFileResponse(self.path, request.headers, **self.options)
+
+    def get(self, **headers):
+        return self.client.get("/", headers=headers)
+
+    def test_full_body(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, DATA)
+        self.assertEqual(response.headers["accept-ranges"], "bytes")
+        self.assertEqual(response.headers["content-length"], "1024")
+        self.assertEqual(response.headers["content-type"], "application/zip")
+
+    def test_range(self):
+        response = self.get(range="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, DATA[10:20])
+        self.assertEqual(response.headers["content-range"], "bytes 10-19/1024")
+        self.assertEqual(self.get(range="bytes=-4").content, DATA[-4:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(range="bytes=2048-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers["content-range"], "bytes */1024")
+        self.assertEqual(response.content, b"")
+
+    def test_not_modified(self):
+        etag = self.get().headers["etag"]
+        response = self.get(**{"if-none-match": f'"other", {etag}'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertNotIn("content-length", response.headers)
+
+    def test_if_range(self):
+        first = self.get()
+        etag, last_modified = first.headers["etag"], first.headers["last-modified"]
+        self.assertEqual(self.get(range="bytes=10-19", **{"if-range": etag}).status_code, 206)
+        self.assertEqual(self.get(range="bytes=10-19", **{"if-range": last_modified}).status_code, 206)
+
+        # A changed file, a weak validator or an older date get the whole file again
+        for if_range in ('"stale"', "W/" + etag, formatdate(0, usegmt=True), "not a date"):
+            response = self.get(range="bytes=10-19", **{"if-range": if_range})
+            self.assertEqual((response.status_code, len(response.content)), (200, 1024), if_range)
+
+    def test_head(self):
+        response = self.client.head("/", headers={"range": "bytes=0-9"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers["content-length"], "10")
+        self.assertEqual(response.content, b"")
+
+    def test_window_of_a_file(self):
+        self.options.update(offset=100, length=50, etag='"track"')
+        response = self.get()
+        self.assertEqual((response.content, response.headers["etag"]), (DATA[100:150], '"track"'))
+        response = self.get(range="bytes=10-19")
+        self.assertEqual(response.content, DATA[110:120])
+        self.assertEqual(response.headers["content-range"], "bytes 10-19/50")
+        self.assertEqual(self.get(range="bytes=50-").status_code, 416)
+
+    def test_bandwidth_cap(self):
+        self.path = write_file(self.scratch / "large.zip", b"x" * 40 * 1024)
+        self.options.update(bandwidth=64 * 1024)
+        started = time.monotonic()
+        self.assertEqual(len(self.get().content), 40 * 1024)
+        self.assertGreaterEqual(time.monotonic() - started, 0.5)
+
+    def test_zero_copy_send(self):
+        messages = []
+
+        async def send(message):
+            messages.append({**message, "file": message["file"].name} if "file" in message else message)
+
+        response = RangeFileResponse(self.path, {"range": "bytes=100-"}, chunk_size=512)
+        scope = {"type": "http", "method": "GET", "extensions": {"http.response.zerocopysend": {}}}
+        asyncio.run(response(scope, None, send))
+        self.assertEqual(messages[0]["status"], 206)
+        self.assertEqual([(message["offset"], message["count"], message["more_body"]) for message in messages[1:]], [
+            (100, 512, True), (612, 412, False)
+        ])
+        self.assertEqual({message["file"] for message in messages[1:]}, {str(self.path)})
+
+
+class ReadAtTests(ScratchTestCase):
+    def test_reads_with_and_without_pread(self):
+        path = write_file(self.scratch / "playlist.zip", DATA)
+        with open(path, "rb") as file:
+            self.assertEqual(read_at(file, 10, 5), DATA[10:15])
+            with mock.patch.object(file_delivery, "pread", None):
+                self.assertEqual(read_at(file, 300, 5), DATA[300:305])
+                self.assertEqual(read_at(file, 20, 5), DATA[20:25])
@@ -0,0 +1,60 @@
+"""Tests for the in-process job event fan-out."""
+import asyncio
+import threading
+import unittest
+
+from job_events import JobEvents
+
+
+class JobEventsTests(unittest.TestCase):
+    def test_events_published_from_another_thread_reach_every_subscriber(self):
+        events = JobEvents()
+
+        async def scenario():
+            first, second = events.subscribe("job"), events.subscribe("job")
+            other = events.subscribe("other")
+            worker = threading.Thread(target=events.publish, args=("job", "track", {"state": "downloaded"}))
+            worker.start()
+            worker.join()
+            received = [await asyncio.wait_for(queue.get(), 1) for queue in (first, second)]
+            return received, other.qsize()
+
+        received, unrelated = asyncio.run(scenario())
+        self.assertEqual(received, [("track", {"state": "downloaded"})] * 2)
+        self.assertEqual(unrelated, 0)
+
+    def test_slow_subscribers_lose_their_oldest_events(self):
+        events = JobEvents(max_pending=2)
+
+        async def scenario():
+            queue = events.subscribe("job")
+            for index in range(5):
+                events.publish("job", "status", index)
+            # Deliveries are scheduled on the loop, let them run
+            await asyncio.sleep(0)
+            return [queue.get_nowait() for _ in range(queue.qsize())]
+
+        self.assertEqual(asyncio.run(scenario()), [("status", 3), ("status", 4)])
+
+    def test_unsubscribe(self):
+        events = JobEvents()
+
+        async def scenario():
+            first, second = events.subscribe("job"), events.subscribe("job")
+            self.assertEqual(events.stats(), {"jobs": 1, "subscribers": 2})
+            events.unsubscribe("job", first)
+            self.assertEqual(events.topics(), ["job"])
+            events.unsubscribe("job", second)
+
+        asyncio.run(scenario())
+        self.assertFalse(events.has_subscribers("job"))
+        self.assertEqual(events.stats(), {"jobs": 0, "subscribers": 0})
+
+    def test_publishing_to_a_closed_loop_is_ignored(self):
+        events = JobEvents()
+
+        async def subscribe():
+            events.subscribe("job")
+
+        asyncio.run(subscribe())
+        events.publish("job", "status", {})
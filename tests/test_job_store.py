@@ -0,0 +1,154 @@
+"""Tests for the memory and SQLite job stores, which share one contract."""
+import itertools
+import threading
+from unittest import mock
+
+import job_store
+from job_store import MemoryJobStore, SQLiteJobStore, create_job_store
+from tests.support import ScratchTestCase
+
+
+class JobStoreContract:
+    """Behaviour both stores must share; subclasses provide make_store()"""
+
+    def setUp(self):
+        super().setUp()
+        # One tick per call, so creation order and staleness never depend on clock resolution
+        clock = itertools.count(1000)
+        patcher = mock.patch.object(job_store.time, "time", side_effect=lambda: float(next(clock)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = self.make_store()
+
+    def test_create_get_update(self):
+        self.store.create("a", status="queued", key="url|mp3", playlist_name="Road Trip")
+        job = self.store.get("a")
+        self.assertEqual((job["id"], job["status"], job["owner"], job["key"]), ("a", "queued", None, "url|mp3"))
+        self.assertEqual(job["playlist_name"], "Road Trip")
+        self.assertEqual(set(job["phase_times"]), {"queued"})
+
+        self.assertTrue(self.store.update("a", status="downloading", progress=0.5))
+        job = self.store.get("a")
+        self.assertEqual((job["status"], job["progress"]), ("downloading", 0.5))
+        self.assertEqual(set(job["phase_times"]), {"queued", "downloading"})
+        self.assertFalse(self.store.update("missing", status="error"))
+        self.assertIsNone(self.store.get("missing"))
+
+    def test_requeue_starts_fresh_phase_times(self):
+        self.store.create("a", status="downloading")
+        self.store.update("a", status="queued")
+        self.assertEqual(set(self.store.get("a")["phase_times"]), {"queued"})
+
+    def test_claim_next_is_fifo(self):
+        for job_id in ("a", "b", "c"):
+            self.store.create(job_id, status="queued")
+        self.assertEqual([self.store.queue_position(job_id) for job_id in ("a", "b", "c")], [1, 2, 3])
+
+        claimed = self.store.claim_next("worker-1")
+        self.assertEqual((claimed["id"], claimed["status"], claimed["owner"]), ("a", "analyzing", "worker-1"))
+        self.assertEqual(self.store.get("a")["owner"], "worker-1")
+        self.assertIsNone(self.store.queue_position("a"))
+        self.assertEqual(self.store.queue_position("c"), 2)
+        self.assertEqual(self.store.claim_next("worker-2")["id"], "b")
+        self.assertEqual(self.store.claim_next("worker-1")["id"], "c")
+        self.assertIsNone(self.store.claim_next("worker-1"))
+        self.assertEqual(self.store.count("analyzing"), 3)
+
+    def test_transition_only_from_listed_statuses(self):
+        self.store.create("a", status="queued")
+        self.assertFalse(self.store.transition("a", ("error",), status="queued", message="Resuming"))
+        self.assertEqual(self.store.get("a")["status"], "queued")
+        self.assertTrue(self.store.transition("a", ("queued",), status="error", message="Cancelled"))
+        self.assertEqual(self.store.get("a")["message"], "Cancelled")
+        self.assertFalse(self.store.transition("missing", ("queued",), status="error"))
+
+    def test_requeue_stale(self):
+        self.store.create("alive", status="queued")
+        self.store.create("stale", status="queued")
+        self.store.create("done", status="completed")
+        self.store.claim_next("worker-1")
+        self.store.claim_next("worker-2")
+        cutoff = job_store.time.time()
+        self.store.heartbeat("worker-1")
+
+        self.assertEqual(self.store.requeue_stale(cutoff), ["stale"])
+        job = self.store.get("stale")
+        self.assertEqual((job["status"], job["owner"]), ("queued", None))
+        self.assertEqual(job["message"], "Requeued after the worker stopped responding")
+        self.assertEqual(self.store.get("alive")["status"], "analyzing")
+        self.assertEqual(self.store.get("done")["status"], "completed")
+        self.assertEqual(self.store.claim_next("worker-1")["id"], "stale")
+
+    def test_find_returns_the_newest_match(self):
+        self.store.create("old", status="completed", key="url|mp3")
+        self.store.create("new", status="completed", key="url|mp3")
+        self.store.create("running", status="downloading", key="url|mp3")
+        self.store.create("other", status="completed", key="url|m4a")
+        self.assertEqual(self.store.find("url|mp3", "completed")["id"], "new")
+        self.assertEqual(self.store.find("url|mp3", *job_store.RUNNING_STATUSES)["id"], "running")
+        self.assertIsNone(self.store.find("url|opus", "completed"))
+
+    def test_list_and_count(self):
+        self.store.create("a", status="queued")
+        self.store.create("b", status="completed")
+        self.assertEqual({job["id"] for job in self.store.list()}, {"a", "b"})
+        self.assertEqual([job["id"] for job in self.store.list("completed")], ["b"])
+        self.assertEqual(self.store.count("queued", "completed"), 2)
+
+    def test_tracks(self):
+        self.store.create("a", status="downloading")
+        self.store.set_track("a", "Artist - Song", "failed")
+        self.store.set_track("a", "Artist - Song", "downloaded")
+        self.store.set_track("a", "Artist - Other", "failed")
+        self.assertEqual(self.store.tracks("a"), {"Artist - Song": "downloaded", "Artist - Other": "failed"})
+
+        self.store.forget_tracks("a", "failed", "lookup_error")
+        self.assertEqual(self.store.tracks("a"), {"Artist - Song": "downloaded"})
+        self.store.delete("a")
+        self.assertIsNone(self.store.get("a"))
+        self.assertEqual(self.store.tracks("a"), {})
+
+
+class MemoryJobStoreTests(JobStoreContract, ScratchTestCase):
+    def make_store(self):
+        return MemoryJobStore()
+
+
+class SQLiteJobStoreTests(JobStoreContract, ScratchTestCase):
+    def make_store(self):
+        return SQLiteJobStore(self.scratch / "jobs.sqlite3")
+
+    def test_jobs_survive_a_restart(self):
+        self.store.create("a", status="queued", key="url|mp3")
+        self.store.set_track("a", "Artist - Song", "downloaded")
+        reopened = SQLiteJobStore(self.scratch / "jobs.sqlite3")
+        self.assertEqual(reopened.get("a")["key"], "url|mp3")
+        self.assertEqual(reopened.tracks("a"), {"Artist - Song": "downloaded"})
+
+    def test_concurrent_claims_never_share_a_job(self):
+        for index in range(40):
+            self.store.create(f"job{index:02d}", status="queued")
+        claimed = []
+
+        def worker(owner):
+            # Each thread gets its own connection, as separate processes would
+            while True:
+                job = self.store.claim_next(owner)
+                if job is None:
+                    return
+                claimed.append(job["id"])
+
+        threads = [threading.Thread(target=worker, args=(f"worker-{index}",)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), [f"job{index:02d}" for index in range(40)])
+
+
+class CreateJobStoreTests(ScratchTestCase):
+    def test_backends(self):
+        self.assertIsInstance(create_job_store("memory"), MemoryJobStore)
+        self.assertIsInstance(create_job_store("sqlite", self.scratch / "jobs.sqlite3"), SQLiteJobStore)
+        with self.assertRaisesRegex(ValueError, "redis"):
+            create_job_store("redis")
@@ -0,0 +1,61 @@
+"""Tests for the Prometheus text exposition."""
+import threading
+import unittest
+
+from metrics import Registry
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_unlabelled_metrics_start_at_zero(self):
+        self.registry.counter("reed_jobs_total", "Jobs")
+        self.registry.gauge("reed_queue_depth", "Queued jobs")
+        self.registry.counter("reed_errors_total", "Errors", labels=("reason",))
+        self.assertEqual(self.registry.render(), "\n".join([
+            "# HELP reed_jobs_total Jobs",
+            "# TYPE reed_jobs_total counter",
+            "reed_jobs_total 0",
+            "# HELP reed_queue_depth Queued jobs",
+            "# TYPE reed_queue_depth gauge",
+            "reed_queue_depth 0",
+            "# HELP reed_errors_total Errors",
+            "# TYPE reed_errors_total counter"
+        ]) + "\n")
+
+    def test_labels_are_escaped(self):
+        errors = self.registry.counter("reed_errors_total", "Errors", labels=("reason", "stage"))
+        errors.inc(reason='quote " and \\ slash\nnewline', stage="fetch")
+        errors.inc(2, reason="timeout", stage="fetch")
+        self.assertIn('reed_errors_total{reason="quote \\" and \\\\ slash\\nnewline",stage="fetch"} 1', self.registry.render())
+        self.assertIn('reed_errors_total{reason="timeout",stage="fetch"} 2', self.registry.render())
+        with self.assertRaisesRegex(ValueError, "takes labels"):
+            errors.inc(reason="timeout")
+
+    def test_histogram_buckets_are_cumulative(self):
+        durations = self.registry.histogram("reed_seconds", "Durations", buckets=(1, 5), labels=("phase",))
+        for value in (0.5, 1, 3, 10):
+            durations.observe(value, phase="downloading")
+        lines = self.registry.render().splitlines()[2:]
+        self.assertEqual(lines, [
+            'reed_seconds_bucket{phase="downloading",le="1"} 2',
+            'reed_seconds_bucket{phase="downloading",le="5"} 3',
+            'reed_seconds_bucket{phase="downloading",le="+Inf"} 4',
+            'reed_seconds_sum{phase="downloading"} 14.5',
+            'reed_seconds_count{phase="downloading"} 4'
+        ])
+
+    def test_concurrent_increments(self):
+        counter = self.registry.counter("reed_tracks_total", "Tracks")
+
+        def work():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIn("reed_tracks_total 4000", self.registry.render())
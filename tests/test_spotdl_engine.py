@@ -0,0 +1,137 @@
+"""Tests for the spotdl library engine protocol and the per-track pipeline."""
+import multiprocessing
+import threading
+import unittest
+
+from spotdl_engine import EngineError, LibraryEngine, TrackPipeline
+
+
+class _RunningProcess:
+    """Stands in for the engine process; the test plays its side of the pipe"""
+    pid = 0
+    alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, timeout=None):
+        self.alive = False
+
+
+class LibraryEngineTests(unittest.TestCase):
+    def serve(self, *replies):
+        """An engine whose process answers the next job with replies, then closes the pipe"""
+        engine = LibraryEngine({})
+        engine.connection, child = multiprocessing.Pipe()
+        engine.process = _RunningProcess()
+        received = []
+
+        def worker():
+            received.append(child.recv())
+            for reply in replies:
+                child.send(reply)
+            child.close()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        self.addCleanup(thread.join)
+        return engine, received
+
+    def test_events_are_forwarded_until_done(self):
+        engine, received = self.serve(
+            ("event", "found", "Road Trip", 2),
+            ("event", "downloaded", "Artist - Song", "/out/Artist - Song.mp3"),
+            ("event", "lookup_error", "Artist - Other", None),
+            ("done", {"downloaded": 1, "lookup_error": 1})
+        )
+        events = []
+        summary = engine.run("https://open.spotify.com/playlist/x", "/out", lambda *event: events.append(event), {"format": "m4a"})
+        self.assertEqual(received, [("download", "https://open.spotify.com/playlist/x", "/out", {"format": "m4a"})])
+        self.assertEqual(events, [
+            ("found", "Road Trip", 2),
+            ("downloaded", "Artist - Song", "/out/Artist - Song.mp3"),
+            ("lookup_error", "Artist - Other", None)
+        ])
+        self.assertEqual(summary, {"downloaded": 1, "lookup_error": 1})
+
+    def test_worker_errors_are_raised(self):
+        engine, _ = self.serve(("error", "SpotifyException: invalid id"))
+        with self.assertRaisesRegex(EngineError, "invalid id"):
+            engine.run("url", "/out", lambda *event: None)
+
+    def test_dead_worker_is_reported_and_forgotten(self):
+        engine, _ = self.serve(("event", "found", "Road Trip", 2))
+        with self.assertRaisesRegex(EngineError, "exited"):
+            engine.run("url", "/out", lambda *event: None)
+        # The next job starts a fresh process
+        self.assertIsNone(engine.process)
+
+
+class TrackPipelineTests(unittest.TestCase):
+    def run_pipeline(self, items, fetch, transcode=lambda item, fetched: f"{fetched}.mp3", **options):
+        results = {}
+        pipeline = TrackPipeline(fetch, transcode, **{"retries": 2, "backoff": 0, **options})
+        pipeline.run(items, lambda item, event, detail: results.__setitem__(item, (event, detail)))
+        return results
+
+    def flaky(self, failures, error=ConnectionError):
+        """A stage that raises error the first `failures` times for each item"""
+        calls = {}
+
+        def stage(item, *args):
+            calls[item] = calls.get(item, 0) + 1
+            if calls[item] <= failures:
+                raise error("temporary")
+            return item
+        return stage, calls
+
+    def test_failed_stages_are_retried(self):
+        fetch, calls = self.flaky(2)
+        self.assertEqual(self.run_pipeline(["a", "b"], fetch), {"a": ("downloaded", "a.mp3"), "b": ("downloaded", "b.mp3")})
+        self.assertEqual(calls, {"a": 3, "b": 3})
+
+    def test_retries_run_out(self):
+        fetch, calls = self.flaky(3)
+        self.assertEqual(self.run_pipeline(["a"], fetch), {"a": ("failed", "ConnectionError")})
+        self.assertEqual(calls, {"a": 3})
+
+    def test_failed_transcode(self):
+        transcode, calls = self.flaky(5, error=RuntimeError)
+        self.assertEqual(self.run_pipeline(["a"], lambda item: item, transcode), {"a": ("failed", "RuntimeError")})
+        self.assertEqual(calls, {"a": 3})
+
+    def test_missing_tracks_are_not_retried(self):
+        fetch, calls = self.flaky(1, error=LookupError)
+        self.assertEqual(self.run_pipeline(["a"], fetch), {"a": ("lookup_error", None)})
+        self.assertEqual(calls, {"a": 1})
+
+    def test_tracks_already_on_disk_are_skipped(self):
+        transcoded = []
+        results = self.run_pipeline(
+            ["a", "b"],
+            lambda item: None if item == "a" else item,
+            lambda item, fetched: transcoded.append(item) or "b.mp3"
+        )
+        self.assertEqual(results, {"a": ("skipped", None), "b": ("downloaded", "b.mp3")})
+        self.assertEqual(transcoded, ["b"])
+
+    def test_fetches_are_bounded_by_their_pool(self):
+        lock = threading.Lock()
+        running, peak = 0, 0
+
+        def fetch(item):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            threading.Event().wait(0.01)
+            with lock:
+                running -= 1
+            return item
+
+        results = self.run_pipeline(list(range(12)), fetch, fetch_workers=3)
+        self.assertEqual(len(results), 12)
+        self.assertLessEqual(peak, 3)
+
+    def test_empty_playlist(self):
+        self.assertEqual(self.run_pipeline([], lambda item: item), {})
@@ -0,0 +1,56 @@
+"""Tests for the shared track cache."""
+import os
+from unittest import mock
+
+import track_cache
+from tests.support import ScratchTestCase, write_file
+from track_cache import TrackCache, link_or_copy, track_key
+
+
+class TrackCacheTests(ScratchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = TrackCache(self.scratch / "cache", max_bytes=1000)
+
+    def test_hit_materializes_the_cached_file(self):
+        key = track_key("4uLU6hMCjMI75M1A2tKUQC", "mp3", "192k")
+        self.assertEqual(key, "4uLU6hMCjMI75M1A2tKUQC-mp3-192k")
+        self.cache.put(key, write_file(self.scratch / "job1" / "Song.mp3", b"x" * 100))
+
+        destination = self.scratch / "job2" / "Song.mp3"
+        self.assertTrue(self.cache.materialize(key, "mp3", destination))
+        self.assertEqual(destination.read_bytes(), b"x" * 100)
+        # Hardlinked, so the hit costs no disk space
+        self.assertEqual(os.stat(destination).st_ino, os.stat(self.scratch / "job1" / "Song.mp3").st_ino)
+
+    def test_miss(self):
+        self.assertFalse(self.cache.materialize(track_key("missing", "mp3"), "mp3", self.scratch / "Song.mp3"))
+        self.assertFalse((self.scratch / "Song.mp3").exists())
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for index in range(2):
+            path = self.cache.put(f"track{index}-mp3-auto", write_file(self.scratch / f"{index}.mp3", b"x" * 400))
+            os.utime(path, (1000 + index, 1000 + index))
+        # A hit makes track0 the most recently used, so the next put pushes out track1
+        self.cache.get("track0-mp3-auto", "mp3")
+        self.cache.put("track2-mp3-auto", write_file(self.scratch / "2.mp3", b"x" * 400))
+
+        self.assertIsNotNone(self.cache.get("track0-mp3-auto", "mp3"))
+        self.assertIsNone(self.cache.get("track1-mp3-auto", "mp3"))
+        self.assertIsNotNone(self.cache.get("track2-mp3-auto", "mp3"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["evictions"]), (2, 800, 1))
+
+    def test_disabled_cache(self):
+        cache = TrackCache(self.scratch / "disabled", max_bytes=0)
+        self.assertIsNone(cache.put("key-mp3-auto", write_file(self.scratch / "a.mp3")))
+        self.assertIsNone(cache.get("key-mp3-auto", "mp3"))
+        self.assertFalse((self.scratch / "disabled").exists())
+
+    def test_copies_when_links_are_not_possible(self):
+        source = write_file(self.scratch / "a.mp3", b"abc")
+        with mock.patch.object(track_cache.os, "link", side_effect=OSError("cross-device link")), \
+                mock.patch.object(track_cache, "fcntl", None):
+            self.assertEqual(link_or_copy(source, self.scratch / "b.mp3"), "copy")
+        self.assertEqual((self.scratch / "b.mp3").read_bytes(), b"abc")
@@ -0,0 +1,193 @@
+"""Content-addressed cache of finished tracks shared by every job and user.
+
+Entries are keyed by Spotify track id plus output format and bitrate, and
+live as plain files under the cache directory. The files themselves are the
+index: their mtime is bumped on every hit, so eviction can drop the least
+recently used entries even when several engine processes share the cache.
+Tracks are materialized into job folders as hardlinks (or reflinks/copies
+across filesystems), so a cache hit costs no bandwidth, transcode or disk.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+    FICLONE = 0x40049409
+except ImportError:
+    fcntl = None
+
+
+def track_key(track_id, audio_format, bitrate=None):
+    """Cache key for one rendition of a track"""
+    return f"{track_id}-{audio_format}-{bitrate or 'auto'}"
+
+
+def link_or_copy(source, destination):
+    """Materialize source at destination as a hardlink, reflink or plain copy"""
+    try:
+        os.link(source, destination)
+        return "hardlink"
+    except OSError:
+        pass
+
+    if fcntl is not None:
+        try:
+            with open(source, "rb") as src, open(destination, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError:
+            pass
+
+    shutil.copyfile(source, destination)
+    return "copy"
+
+
+class TrackCache:
+    """Size-bounded LRU cache of audio files keyed by track_key()"""
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.size = None
+        self.entries = None
+        self.scanned_at = 0.0
+        if self.enabled:
+            self.root.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key, extension):
+        return self.root / key[:2] / f"{key}.{extension}"
+
+    def get(self, key, extension):
+        """Return the cached file for key and mark it recently used, or None"""
+        if not self.enabled:
+            return None
+        path = self._path(key, extension)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def materialize(self, key, extension, destination):
+        """Place a cached track at destination; returns False on a miss"""
+        path = self.get(key, extension)
+        if path is None:
+            return False
+        destination = Path(destination)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            link_or_copy(path, destination)
+        except FileNotFoundError:
+            # Evicted by another process between the lookup and the link
+            return False
+        return True
+
+    def put(self, key, source):
+        """Add a finished track to the cache without copying its bytes where possible"""
+        if not self.enabled:
+            return None
+        source = Path(source)
+        path = self._path(key, source.suffix.lstrip("."))
+        if path.exists():
+            return path
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            link_or_copy(source, temporary)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning(f"Could not cache {source}: {str(e)}")
+            temporary.unlink(missing_ok=True)
+            return None
+
+        with self.lock:
+            if self.size is not None:
+                self.size += path.stat().st_size
+                self.entries += 1
+            over_budget = self.size is None or self.size > self.max_bytes
+        if over_budget:
+            self.evict()
+        return path
+
+    def _scan(self):
+        files = []
+        for directory in self.root.iterdir():
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits max_bytes"""
+        if not self.enabled:
+            return 0
+        files = self._scan()
+        size = sum(file_size for _, file_size, _ in files)
+        reclaimed = 0
+        evicted = 0
+        for _, file_size, path in sorted(files):
+            if size - reclaimed <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            reclaimed += file_size
+            evicted += 1
+
+        with self.lock:
+            self.size = size - reclaimed
+            self.entries = len(files) - evicted
+            self.evictions += evicted
+            self.scanned_at = time.time()
+        if evicted:
+            logger.info(f"Track cache evicted {evicted} entries ({reclaimed} bytes)")
+        return reclaimed
+
+    def record(self, hits=0, misses=0):
+        """Fold in hit/miss counts observed by another process"""
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self, max_age=60):
+        """Counters plus entry count and size, rescanning the directory when stale"""
+        with self.lock:
+            if self.enabled and (self.size is None or time.time() - self.scanned_at > max_age):
+                files = self._scan()
+                self.size = sum(file_size for _, file_size, _ in files)
+                self.entries = len(files)
+                self.scanned_at = time.time()
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": self.entries or 0,
+                "bytes": self.size or 0,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions
+            }